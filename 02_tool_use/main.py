@@ -22,6 +22,11 @@ def main() -> int:
         default=None,
         help="Directory for log files (default: ./logs in lesson dir).",
     )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream tokens and start tools as soon as their arguments are complete.",
+    )
     args = parser.parse_args()
 
     if args.log_dir:
@@ -29,7 +34,7 @@ def main() -> int:
     else:
         log_dir = Path(__file__).parent / "logs"
 
-    agent = MiniManus(max_steps=args.max_steps, log_dir=log_dir)
+    agent = MiniManus(max_steps=args.max_steps, log_dir=log_dir, stream=args.stream)
     agent.run(task=args.task)
     return 0
 
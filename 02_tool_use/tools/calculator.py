@@ -20,6 +20,10 @@ class CalculatorTool(BaseTool):
     def description(self) -> str:
         return "Evaluate a mathematical expression. Use this for any calculations. Use '**' for power, e.g., '2**10'."
 
+    @property
+    def parallel_safe(self) -> bool:
+        return True
+
     def _parameters_schema(self) -> dict[str, Any]:
         return {
             "type": "object",
@@ -18,6 +18,10 @@ class DateTimeTool(BaseTool):
     def description(self) -> str:
         return "Get the current date and time. Use this when you need to know the current time or date."
 
+    @property
+    def parallel_safe(self) -> bool:
+        return True
+
     def execute(self, **kwargs) -> tuple[bool, str]:
         """执行获取时间操作"""
         now = datetime.now()
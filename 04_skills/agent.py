@@ -2,20 +2,18 @@
 
 from __future__ import annotations
 
-import json
 from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Any
 
-from loguru import logger
-
 import sys
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "lib"))
 
 from env import find_and_load_env
-from openai_compat import chat_completions, load_config_from_env
-from log import init_logger, format_json
+from agent_loop import AgentLoop, ToolOutcome
+from openai_compat import load_config_from_env
+from log import init_logger, open_trace
 
 from tools import TOOL_REGISTRY
 
@@ -27,6 +25,12 @@ def execute_tool(name: str, arguments: dict[str, Any]) -> tuple[bool, str]:
     raise RuntimeError(f"Unknown tool: {name}")
 
 
+def is_parallel_safe(name: str) -> bool:
+    """工具是否可以与同一轮的其他调用并发执行"""
+    tool = TOOL_REGISTRY.get(name)
+    return bool(tool and tool.parallel_safe)
+
+
 @dataclass
 class MiniManus:
     max_steps: int = 10
@@ -61,6 +65,7 @@ class MiniManus:
     def run(self, *, task: str) -> None:
         if self.log_dir:
             init_logger(self.log_dir)
+        trace = open_trace(self.log_dir)
 
         find_and_load_env()
         cfg = load_config_from_env()
@@ -72,99 +77,24 @@ class MiniManus:
             {"role": "user", "content": task},
         ]
 
-        logger.info("=" * 60)
-        logger.info("Step 0: 初始上下文")
-        logger.info("=" * 60)
-        logger.info(format_json(messages))
-        logger.info(f"\nAvailable tools: {len(tools)}")
-        logger.info(f"Tools: {[t['function']['name'] for t in tools]}")
-
-        for step in range(1, self.max_steps + 1):
-            logger.info("#" * 60)
-            logger.info(f"# Step {step}")
-            logger.info("#" * 60)
-
-            resp = chat_completions(
-                cfg=cfg, messages=messages, tools=tools, tool_choice="auto"
-            )
-
-            logger.info(f"Step {step}: LLM response")
-            logger.info(format_json(resp))
-
-            msg = (resp.get("choices") or [{}])[0].get("message") or {}
-            tool_calls = msg.get("tool_calls") or []
-            content = (msg.get("content") or "").strip()
-
-            # 检查是否有 skill load 带来的新上下文
-            for msg_in_history in messages:
-                if isinstance(msg_in_history.get("content"), str):
-                    if "[SKILL_CONTEXT]" in msg_in_history["content"]:
-                        # 更新 skill context
-                        for t_call in tool_calls:
-                            fn = t_call.get("function") or {}
-                            if fn.get("name") == "skill":
-                                skill_instruction = fn.get("arguments", "{}")
-                                if "load" in skill_instruction:
-                                    logger.info("Skill loaded, updating context...")
-                                    messages[0]["content"] = self._system_prompt()
-
-            if tool_calls:
-                for idx, call in enumerate(tool_calls):
-                    fn = call.get("function") or {}
-                    name = fn.get("name") or ""
-
-                    raw_args = fn.get("arguments") or "{}"
-
-                    try:
-                        args = (
-                            json.loads(raw_args)
-                            if isinstance(raw_args, str)
-                            else dict(raw_args)
-                        )
-                    except Exception as e:
-                        raise RuntimeError(
-                            f"Invalid tool arguments for {name}: {raw_args}"
-                        ) from e
-
-                    logger.info(f"Step {step}: Calling tool {name}")
-                    logger.info(format_json({"arguments": args}))
-
-                    should_stop, output = execute_tool(name, args)
-
-                    logger.info(f"Step {step}: Tool returned")
-                    logger.info(output[:500] + "..." if len(output) > 500 else output)
-
-                    # 检查是否是 skill load
-                    if name == "skill" and args.get("action") == "load":
-                        # 将 skill 内容作为系统提示的一部分
-                        self.skill_context = (
-                            f"## Skill: {args.get('skill_name')}\n{output}"
-                        )
-                        messages[0]["content"] = self._system_prompt()
-                        tool_result_msg = f"[SKILL_LOADED]\n{output}"
-                    else:
-                        tool_result_msg = f"[TOOL_CALL {name}] {json.dumps(args)}\n[TOOL_RESULT] {output}"
-
-                    messages.append({"role": "user", "content": tool_result_msg})
-
-                    if should_stop:
-                        logger.info("*" * 60)
-                        logger.info("* Final Answer (Agent Loop Terminated)")
-                        logger.info("*" * 60)
-                        logger.info(output)
-                        return
-
-                logger.info(f"Step {step}: Updated messages")
-                logger.info(format_json(messages))
-                continue
-
-            if content:
-                logger.info("*" * 60)
-                logger.info("* LLM returned content directly (no tool call)")
-                logger.info("*" * 60)
-                logger.info(content)
-                return
-
-        raise RuntimeError(
-            f"Agent exceeded max_steps={self.max_steps} without termination."
+        def post_tool(outcome: ToolOutcome, messages: list[dict[str, Any]]):
+            # 检查是否是 skill load
+            args = outcome.call.args
+            if outcome.call.name != "skill" or args.get("action") != "load":
+                return None
+            # 将 skill 内容作为系统提示的一部分
+            self.skill_context = f"## Skill: {args.get('skill_name')}\n{outcome.output}"
+            messages[0]["content"] = self._system_prompt()
+            trace.event(outcome.step, "system_update", content=messages[0]["content"])
+            return {"role": "user", "content": f"[SKILL_LOADED]\n{outcome.output}"}
+
+        loop = AgentLoop(
+            cfg=cfg,
+            tools=tools,
+            execute_tool=execute_tool,
+            parallel_safe=is_parallel_safe,
+            max_steps=self.max_steps,
+            trace=trace,
+            post_tool=post_tool,
         )
+        loop.run(messages)
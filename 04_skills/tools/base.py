@@ -17,6 +17,11 @@ class BaseTool(ABC):
     def description(self) -> str:
         pass
 
+    @property
+    def parallel_safe(self) -> bool:
+        """是否无副作用，可与同一轮的其他工具调用并发执行（默认否）"""
+        return False
+
     @abstractmethod
     def execute(self, **kwargs) -> tuple[bool, str]:
         pass
@@ -21,6 +21,10 @@ class WebFetchTool(BaseTool):
     def description(self) -> str:
         return "Fetch content from a URL. Use this to get the content of web pages when you need specific information from a website."
 
+    @property
+    def parallel_safe(self) -> bool:
+        return True
+
     def _parameters_schema(self) -> dict[str, Any]:
         return {
             "type": "object",
@@ -0,0 +1,18 @@
+"""知识库模块：文档切块、分段向量索引、元数据存储、向量化"""
+
+from .chunking import chunk_text, iter_documents
+from .embedding import get_embedder
+from .index import build_index, choose_kind, evaluate
+from .metadata import MetadataStore
+from .segments import SegmentStore
+
+__all__ = [
+    "MetadataStore",
+    "SegmentStore",
+    "build_index",
+    "choose_kind",
+    "chunk_text",
+    "evaluate",
+    "get_embedder",
+    "iter_documents",
+]
@@ -0,0 +1,160 @@
+"""文档切块与流式读取
+
+all-MiniLM-L6-v2 最多只看前 256 个 token，长文档要先切成小块再向量化：
+- 先按句子切分（中文句号、问号、分号等，以及英文句点），尽量不在句子中间断开
+- 再把句子拼成不超过 size 的块，相邻块重叠约 overlap（块边界附近的内容两边都能检索到）
+- 长度按 token 估算：CJK 字符约 1 token / 字，其余约 4 字符 / token
+
+文档来源可以是文档的可迭代对象（生成器）、目录或 JSONL 文件，逐个读取，内存占用有上限。
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import os
+import re
+from itertools import islice
+from pathlib import Path
+from typing import Any, Iterable, Iterator
+
+# 块大小 / 重叠（估算的 token 数），留出模型 256 token 上限的余量
+CHUNK_SIZE = int(os.environ.get("RAG_CHUNK_SIZE", "200"))
+CHUNK_OVERLAP = int(os.environ.get("RAG_CHUNK_OVERLAP", "40"))
+# 从目录读取时包含的文件类型
+TEXT_SUFFIXES = {".txt", ".md", ".markdown", ".rst"}
+
+# 句末：中英文终止标点（含后面的引号、括号）、换行、英文单词后的句点
+_SENTENCE_END = re.compile(
+    r"[。！？!?；;…]+[”’」』）)\"']*|\n+|(?<=[A-Za-z0-9])\.(?=\s)"
+)
+
+
+def _is_cjk(ch: str) -> bool:
+    code = ord(ch)
+    return (
+        0x4E00 <= code <= 0x9FFF  # CJK 统一汉字
+        or 0x3400 <= code <= 0x4DBF  # 扩展 A
+        or 0x3000 <= code <= 0x303F  # CJK 标点
+        or 0xFF00 <= code <= 0xFFEF  # 全角字符
+        or 0x3040 <= code <= 0x30FF  # 日文假名
+        or 0xAC00 <= code <= 0xD7AF  # 韩文
+    )
+
+
+def estimate_tokens(text: str) -> int:
+    """按字符估算 token 数：CJK 字符约 1 token / 字，其余约 4 字符 / token"""
+    cjk = sum(1 for ch in text if _is_cjk(ch))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def split_sentences(text: str) -> list[str]:
+    """按句末标点和换行切分句子（保留标点）"""
+    sentences = []
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        sentence = text[start : match.end()].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = match.end()
+    tail = text[start:].strip()
+    if tail:
+        sentences.append(tail)
+    return sentences
+
+
+def _split_long(sentence: str, size: int) -> list[str]:
+    """超过 size 的单个句子按字符硬切"""
+    pieces, start, tokens = [], 0, 0.0
+    for i, ch in enumerate(sentence):
+        tokens += 1 if _is_cjk(ch) else 0.25
+        if tokens > size:
+            pieces.append(sentence[start:i])
+            start, tokens = i, (1 if _is_cjk(ch) else 0.25)
+    pieces.append(sentence[start:])
+    return [p for p in pieces if p.strip()]
+
+
+def _join(parts: list[str]) -> str:
+    """拼接句子：中文之间不加空格，其他加一个空格"""
+    text = parts[0]
+    for part in parts[1:]:
+        sep = "" if _is_cjk(text[-1]) or _is_cjk(part[0]) else " "
+        text += sep + part
+    return text
+
+
+def chunk_text(
+    text: str, size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP
+) -> list[str]:
+    """把文本切成不超过 size 个 token 的块，相邻块重叠不超过 overlap 个 token"""
+    pieces = []
+    for sentence in split_sentences(text):
+        if estimate_tokens(sentence) > size:
+            pieces.extend(_split_long(sentence, size))
+        else:
+            pieces.append(sentence)
+
+    chunks: list[str] = []
+    current: list[str] = []
+    current_tokens = 0
+    for piece in pieces:
+        tokens = estimate_tokens(piece)
+        if current and current_tokens + tokens > size:
+            chunks.append(_join(current))
+            # 从上一块末尾保留不超过 overlap 的句子作为下一块的开头
+            kept: list[str] = []
+            kept_tokens = 0
+            for prev in reversed(current):
+                prev_tokens = estimate_tokens(prev)
+                if kept_tokens + prev_tokens > overlap:
+                    break
+                kept.insert(0, prev)
+                kept_tokens += prev_tokens
+            if kept_tokens + tokens > size:
+                kept, kept_tokens = [], 0
+            current, current_tokens = kept, kept_tokens
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        chunks.append(_join(current))
+    return chunks
+
+
+def iter_documents(
+    source: str | Path | Iterable[dict[str, Any]],
+) -> Iterator[dict[str, Any]]:
+    """逐个产出文档 {"content", "source"}
+
+    Args:
+        source: 文档的可迭代对象（可以是生成器）、目录（读取其中的文本文件）
+            或 JSONL 文件（每行一个 {"content", "source"}）
+    """
+    if not isinstance(source, (str, Path)):
+        yield from source
+        return
+
+    path = Path(source)
+    if path.is_dir():
+        for file in sorted(path.rglob("*")):
+            if file.is_file() and file.suffix.lower() in TEXT_SUFFIXES:
+                yield {
+                    "content": file.read_text(encoding="utf-8", errors="ignore"),
+                    "source": str(file.relative_to(path)),
+                }
+        return
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if line:
+                doc = json.loads(line)
+                doc.setdefault("source", f"{path.name}:{line_no}")
+                yield doc
+
+
+def batched(items: Iterable[Any], n: int) -> Iterator[list[Any]]:
+    """按固定大小分批（最后一批可能不足 n 个）"""
+    iterator = iter(items)
+    while batch := list(islice(iterator, n)):
+        yield batch
@@ -0,0 +1,162 @@
+"""文本向量化 - 模型在第一次编码时才加载，进程内共享，也可以由本地服务共享
+
+- 未设置 RAG_EMBEDDING_URL：进程内加载 SentenceTransformer（所有 RAGTool 共用一个模型）
+- 设置 RAG_EMBEDDING_URL：请求本地向量化服务，多个 worker 进程共用服务里的一个模型
+
+启动服务：uv run python 05_light_rag/main.py --serve-embeddings --port 8765
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from loguru import logger
+
+# all-MiniLM-L6-v2: 384 维向量
+DEFAULT_MODEL = "all-MiniLM-L6-v2"
+DIMENSION = 384
+
+_models: dict[str, object] = {}
+_models_lock = threading.Lock()
+
+
+def get_model(name: str = DEFAULT_MODEL):
+    """进程内共享的 SentenceTransformer（首次调用时加载）"""
+    model = _models.get(name)
+    if model is None:
+        with _models_lock:
+            model = _models.get(name)
+            if model is None:
+                # 导入 sentence_transformers 本身就要加载 torch，也推迟到这里
+                from sentence_transformers import SentenceTransformer
+
+                logger.info(f"[RAG] 加载向量模型 {name}")
+                model = SentenceTransformer(name)
+                _models[name] = model
+    return model
+
+
+class LocalEmbedder:
+    """进程内向量化"""
+
+    def __init__(self, model_name: str = DEFAULT_MODEL):
+        self.model_name = model_name
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        return np.asarray(get_model(self.model_name).encode(texts), dtype="float32")
+
+
+class RemoteEmbedder:
+    """请求本地向量化服务；服务暂时不可用时退回进程内模型
+
+    协议：POST /embed，请求 {"texts": [...]}，响应为 float32 小端字节，
+    形状 (len(texts), DIMENSION)。
+
+    请求失败先退避重试 retries 次；仍失败时本次用进程内模型，
+    之后 cooldown_s 秒内的请求也直接走进程内模型，冷却结束再重新尝试服务。
+    """
+
+    def __init__(
+        self,
+        url: str,
+        timeout_s: float = 60.0,
+        retries: int = 2,
+        backoff_s: float = 0.5,
+        cooldown_s: float = 30.0,
+    ):
+        self.url = url.rstrip("/")
+        self.timeout_s = timeout_s
+        self.retries = retries
+        self.backoff_s = backoff_s
+        self.cooldown_s = cooldown_s
+        self._local = LocalEmbedder()
+        # 在这个时间点（time.monotonic()）之前不再请求服务
+        self._down_until = 0.0
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, DIMENSION), dtype="float32")
+        if time.monotonic() < self._down_until:
+            return self._local.encode(texts)
+        try:
+            return self._request(texts)
+        except (urllib.error.URLError, OSError) as e:
+            self._down_until = time.monotonic() + self.cooldown_s
+            logger.warning(
+                f"[RAG] 向量化服务 {self.url} 不可用，{self.cooldown_s:.0f}s 内"
+                f"改用进程内模型: {e}"
+            )
+            return self._local.encode(texts)
+
+    def _request(self, texts: list[str]) -> np.ndarray:
+        """请求服务，失败时按 backoff_s * 2^n 退避重试"""
+        data = json.dumps({"texts": texts}, ensure_ascii=False).encode("utf-8")
+        attempt = 0
+        while True:
+            request = urllib.request.Request(
+                f"{self.url}/embed",
+                data=data,
+                headers={"Content-Type": "application/json"},
+            )
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout_s) as resp:
+                    body = resp.read()
+                return np.frombuffer(body, dtype="<f4").reshape(len(texts), -1).copy()
+            except (urllib.error.URLError, OSError) as e:
+                if attempt >= self.retries:
+                    raise
+                logger.debug(f"[RAG] 向量化服务请求失败（第 {attempt + 1} 次）: {e}")
+                time.sleep(self.backoff_s * 2**attempt)
+                attempt += 1
+
+
+_embedder: LocalEmbedder | RemoteEmbedder | None = None
+
+
+def get_embedder() -> LocalEmbedder | RemoteEmbedder:
+    """按 RAG_EMBEDDING_URL 选择向量化方式（进程内共享，构造时不加载模型）"""
+    global _embedder
+    if _embedder is None:
+        url = os.environ.get("RAG_EMBEDDING_URL")
+        _embedder = RemoteEmbedder(url) if url else LocalEmbedder()
+    return _embedder
+
+
+def serve(host: str = "127.0.0.1", port: int = 8765, model_name: str = DEFAULT_MODEL):
+    """启动本地向量化服务（阻塞运行）"""
+    model = get_model(model_name)
+    # 同一时间只跑一个 batch，避免多个请求争抢 CPU
+    encode_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != "/embed":
+                self.send_error(404)
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            texts = json.loads(self.rfile.read(length))["texts"]
+            with encode_lock:
+                vectors = np.asarray(model.encode(texts), dtype="<f4")
+            body = vectors.tobytes()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(f"[RAG] {self.address_string()} {format % args}")
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    logger.info(f"[RAG] 向量化服务已启动: http://{host}:{port} ({model_name})")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
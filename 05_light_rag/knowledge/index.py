@@ -0,0 +1,182 @@
+"""向量索引 - 按语料规模选择 FAISS 索引类型
+
+- 小语料（< FLAT_MAX_VECTORS）：Flat，暴力精确检索
+- 中等语料：HNSW（无需训练）或 IVF-Flat
+- 大语料（>= PQ_MIN_VECTORS）：IVF-PQ，每个向量压缩到几十字节
+
+规模指整个知识库的向量数（分段存储时每个段按总规模选择类型），
+段本身太小、不足以训练 PQ 码本时退回 HNSW。
+
+RAG_INDEX 可以固定索引类型：auto / flat / hnsw / ivf / ivfpq，
+其他值按 faiss.index_factory 字符串处理（例如 "IVF1024,PQ32"）。
+"""
+
+from __future__ import annotations
+
+import math
+import os
+import time
+from typing import Any
+
+import faiss
+import numpy as np
+from loguru import logger
+
+FLAT_MAX_VECTORS = 10_000
+PQ_MIN_VECTORS = 500_000
+# 训练样本上限（IVF 每个聚类中心有几百个样本就足够）
+TRAIN_SAMPLE_MAX = 100_000
+# PQ 码本（每个子空间 256 个中心）至少需要的训练样本数
+PQ_MIN_TRAIN = 256 * 39
+
+
+def choose_kind(ntotal: int, kind: str | None = None) -> str:
+    """根据向量数选择索引类型（RAG_INDEX 非 auto 时直接使用配置）"""
+    kind = kind or os.environ.get("RAG_INDEX") or "auto"
+    if kind.lower() in ("flat", "hnsw", "ivf", "ivfpq"):
+        return kind.lower()
+    if kind.lower() != "auto":
+        return kind
+    if ntotal < FLAT_MAX_VECTORS:
+        return "flat"
+    if ntotal < PQ_MIN_VECTORS:
+        return "hnsw"
+    return "ivfpq"
+
+
+def ivf_nlist(ntotal: int) -> int:
+    """聚类中心数：约 4 * sqrt(N)，同时保证每个中心至少有 39 个训练样本"""
+    return max(1, min(int(4 * math.sqrt(ntotal)), ntotal // 39, 65536))
+
+
+def pq_subquantizers(dimension: int) -> int:
+    """PQ 子空间数：不超过 dim / 8，且能整除 dim"""
+    m = max(1, dimension // 8)
+    while dimension % m:
+        m -= 1
+    return m
+
+
+def index_spec(kind: str, ntotal: int, dimension: int) -> str:
+    """索引类型 -> faiss.index_factory 字符串"""
+    if kind == "flat":
+        return "Flat"
+    if kind == "hnsw":
+        return "HNSW32,Flat"
+    if kind == "ivf":
+        return f"IVF{ivf_nlist(ntotal)},Flat"
+    if kind == "ivfpq":
+        return f"IVF{ivf_nlist(ntotal)},PQ{pq_subquantizers(dimension)}"
+    return kind
+
+
+def index_kind(index: faiss.Index) -> str:
+    """已有索引的类型"""
+    if isinstance(index, faiss.IndexFlat):
+        return "flat"
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    return "custom"
+
+
+def configure(
+    index: faiss.Index, nprobe: int | None = None, ef_search: int | None = None
+) -> faiss.Index:
+    """设置检索参数：IVF 的 nprobe（RAG_NPROBE）、HNSW 的 efSearch（RAG_EF_SEARCH）"""
+    nprobe = nprobe or int(os.environ.get("RAG_NPROBE", "16"))
+    ef_search = ef_search or int(os.environ.get("RAG_EF_SEARCH", "64"))
+    try:
+        faiss.extract_index_ivf(index).nprobe = nprobe
+    except RuntimeError:
+        pass
+    hnsw = getattr(index, "hnsw", None)
+    if hnsw is not None:
+        hnsw.efSearch = ef_search
+    return index
+
+
+def build_index(
+    vectors: np.ndarray, kind: str | None = None, corpus_size: int | None = None
+) -> faiss.Index:
+    """用给定向量（已归一化，内积即余弦相似度）创建索引，需要时先训练
+
+    Args:
+        kind: 索引类型，默认按规模选择（见 choose_kind）
+        corpus_size: 选择类型时使用的规模，默认为 vectors 的条数；
+            分段存储时传整个知识库的向量数
+    """
+    ntotal, dimension = vectors.shape
+    kind = choose_kind(corpus_size or ntotal, kind)
+    if kind == "ivfpq" and ntotal < PQ_MIN_TRAIN:
+        # 单个段的样本不够训练 PQ 码本，先用 HNSW，段合并变大后再编码
+        kind = "hnsw"
+    spec = index_spec(kind, ntotal, dimension)
+    index = faiss.index_factory(dimension, spec, faiss.METRIC_INNER_PRODUCT)
+    if not index.is_trained:
+        sample = vectors
+        if ntotal > TRAIN_SAMPLE_MAX:
+            rng = np.random.default_rng(0)
+            sample = vectors[rng.choice(ntotal, TRAIN_SAMPLE_MAX, replace=False)]
+        logger.info(f"[RAG] 训练索引 {spec}（{len(sample)} 个样本）")
+        start = time.perf_counter()
+        index.train(sample)
+        logger.info(f"[RAG] 训练完成，耗时 {time.perf_counter() - start:.1f}s")
+    index.add(vectors)
+    return configure(index)
+
+
+def all_vectors(index: faiss.Index) -> np.ndarray:
+    """取出索引里的全部向量（Flat / HNSW / IVF-Flat 是原始向量，PQ 是近似值）"""
+    try:
+        faiss.extract_index_ivf(index).make_direct_map()
+    except RuntimeError:
+        pass
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def evaluate(
+    index: Any,
+    queries: np.ndarray,
+    vectors: np.ndarray,
+    k: int = 10,
+    kind: str | None = None,
+) -> dict[str, Any]:
+    """与 Flat 基线对比召回率和延迟
+
+    Args:
+        index: 待评估的索引（有 search / ntotal 即可，例如 SegmentStore）
+        queries: 查询向量（已归一化）
+        vectors: 索引中的全部原始向量，用于构建 Flat 基线
+        k: 取前 k 个结果计算 recall@k
+        kind: 报告中的索引类型，默认从 index 推断
+
+    Returns:
+        {"kind", "ntotal", "k", "recall", "flat_ms", "index_ms", "speedup"}
+        （延迟为平均每个查询的毫秒数）
+    """
+    k = min(k, len(vectors))
+    flat = faiss.IndexFlatIP(vectors.shape[1])
+    flat.add(vectors)
+
+    start = time.perf_counter()
+    _, truth = flat.search(queries, k)
+    flat_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    start = time.perf_counter()
+    _, found = index.search(queries, k)
+    index_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    hits = sum(len(set(t) & set(f)) for t, f in zip(truth.tolist(), found.tolist()))
+    return {
+        "kind": kind or index_kind(index),
+        "ntotal": index.ntotal,
+        "k": k,
+        "recall": hits / (len(queries) * k),
+        "flat_ms": flat_ms,
+        "index_ms": index_ms,
+        "speedup": flat_ms / index_ms if index_ms else float("inf"),
+    }
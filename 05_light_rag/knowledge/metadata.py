@@ -0,0 +1,144 @@
+"""文档元数据：SQLite - 按向量 id 取回内容，查询只读取命中的行
+
+每个向量对应文档的一个块（见 chunking.py），doc_id / chunk_index 记录它属于哪个文档、是第几块。
+"""
+
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Iterable
+
+
+class MetadataStore:
+    """向量 id -> 块内容 / 来源 / 所属文档
+
+    连接在第一次读写时才打开，构造本身不触及磁盘。
+
+    Args:
+        db_path: SQLite 文件路径
+        legacy_json: 旧版 metadata.json，存在时首次打开自动迁移
+    """
+
+    def __init__(self, db_path: Path, legacy_json: Path | None = None):
+        self.db_path = Path(db_path)
+        self.legacy_json = legacy_json
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._conn is None:
+                conn = sqlite3.connect(self.db_path, check_same_thread=False)
+                conn.row_factory = sqlite3.Row
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                with conn:
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS chunks (
+                            id INTEGER PRIMARY KEY,
+                            content TEXT NOT NULL,
+                            source TEXT NOT NULL,
+                            doc_id INTEGER,
+                            chunk_index INTEGER NOT NULL DEFAULT 0
+                        )
+                    """)
+                self._migrate_doc_columns(conn)
+                with conn:
+                    conn.execute(
+                        "CREATE INDEX IF NOT EXISTS idx_chunks_doc "
+                        "ON chunks (doc_id, chunk_index)"
+                    )
+                self._conn = conn
+                self._migrate_json(conn)
+        return self._conn
+
+    def _migrate_doc_columns(self, conn: sqlite3.Connection):
+        """旧库没有 doc_id / chunk_index：补上列，旧行各自算一个单块文档"""
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(chunks)")}
+        if "doc_id" in columns:
+            return
+        with conn:
+            conn.execute("ALTER TABLE chunks ADD COLUMN doc_id INTEGER")
+            conn.execute(
+                "ALTER TABLE chunks ADD COLUMN chunk_index INTEGER NOT NULL DEFAULT 0"
+            )
+            conn.execute("UPDATE chunks SET doc_id = id")
+
+    def _migrate_json(self, conn: sqlite3.Connection):
+        """把旧版 metadata.json 导入数据库，导入后重命名为 .migrated"""
+        if self.legacy_json is None or not self.legacy_json.exists():
+            return
+        with open(self.legacy_json, "r") as f:
+            items = json.load(f)
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO chunks (id, content, source, doc_id) "
+                "VALUES (?, ?, ?, ?)",
+                [(m["id"], m["content"], m["source"], m["id"]) for m in items],
+            )
+        self.legacy_json.rename(
+            self.legacy_json.with_name(self.legacy_json.name + ".migrated")
+        )
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def count(self) -> int:
+        """元数据条数"""
+        row = self._connect().execute("SELECT COUNT(*) FROM chunks").fetchone()
+        return row[0]
+
+    def next_doc_id(self) -> int:
+        """下一个可用的文档 id"""
+        row = self._connect().execute("SELECT MAX(doc_id) FROM chunks").fetchone()
+        return 0 if row[0] is None else row[0] + 1
+
+    def add_many(self, rows: Iterable[dict[str, Any]]):
+        """追加元数据，每项包含 id / content / source，可选 doc_id / chunk_index
+        （在同一个事务里写入）
+
+        id 已存在时覆盖：上次写入元数据后、保存索引前崩溃留下的行会被新数据替换。
+        """
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO chunks "
+                "(id, content, source, doc_id, chunk_index) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        m["id"],
+                        m["content"],
+                        m["source"],
+                        m.get("doc_id", m["id"]),
+                        m.get("chunk_index", 0),
+                    )
+                    for m in rows
+                ],
+            )
+
+    def get_many(self, ids: Iterable[int]) -> dict[int, dict[str, Any]]:
+        """按 id 批量读取，只读取命中的行"""
+        ids = [int(i) for i in ids]
+        if not ids:
+            return {}
+        placeholders = ",".join("?" * len(ids))
+        rows = self._connect().execute(
+            "SELECT id, content, source, doc_id, chunk_index FROM chunks "
+            f"WHERE id IN ({placeholders})",
+            ids,
+        ).fetchall()
+        return {row["id"]: dict(row) for row in rows}
+
+    def get_document(self, doc_id: int) -> list[dict[str, Any]]:
+        """按块顺序读取一个文档的全部块"""
+        rows = self._connect().execute(
+            "SELECT id, content, source, doc_id, chunk_index FROM chunks "
+            "WHERE doc_id = ? ORDER BY chunk_index",
+            (doc_id,),
+        ).fetchall()
+        return [dict(row) for row in rows]
@@ -0,0 +1,380 @@
+"""分段存储 - 只追加的向量段 + manifest
+
+rag_knowledge/
+├── manifest.json        # 当前有效的段列表
+├── seg-000001.index     # 段的 FAISS 索引（查询时 mmap 打开）
+├── seg-000001.npy       # 段的原始向量（合并、评估时使用；IVF-PQ 段默认不保存）
+└── metadata.db          # 元数据（见 metadata.py）
+
+- 每次 build 只写一个新段，写入量与本批文档数成正比，与总语料无关
+- 文件都先写临时文件、fsync 后 os.replace，最后替换 manifest；
+  中途崩溃时旧 manifest 和它引用的段仍然完整
+- 每个段按整个知识库的规模选择索引类型（见 index.py）；段数超过 MAX_SEGMENTS 时
+  在后台线程合并相邻的小段，并按当时的规模重新选择类型、训练
+- IVF-PQ 段只保存压缩后的索引：原始向量会抵消 PQ 省下的内存和磁盘，
+  合并时从索引解码（近似值）。--eval-index 需要原始向量，设置 RAG_KEEP_VECTORS=1 保留
+
+同一知识库目录同一时间只应有一个写入进程，读取进程会在 manifest 变化时重新加载。
+清理残留段文件、转换旧版 faiss.index 都只由写入方在持锁时进行，读取进程从不写文件：
+转换之前，旧版索引作为一个只读段参与检索。
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable
+
+import faiss
+import numpy as np
+from loguru import logger
+
+from .index import all_vectors, build_index, configure, index_kind
+
+MANIFEST = "manifest.json"
+# 尚未转换的旧版 faiss.index 作为只读段时的名字（不会写进 manifest）
+LEGACY_SEGMENT = "legacy"
+# 段数超过这个值时触发后台合并
+MAX_SEGMENTS = 8
+# 每次合并的相邻段数
+MERGE_FANOUT = 4
+
+
+def keep_raw_vectors() -> bool:
+    """IVF-PQ 段是否也保存原始向量（RAG_KEEP_VECTORS=1，评估召回率时需要）"""
+    return os.environ.get("RAG_KEEP_VECTORS", "0") == "1"
+
+
+@dataclass
+class Segment:
+    name: str
+    # 段内第一个向量的全局 id（段内位置 + start_id = 全局 id）
+    start_id: int
+    count: int
+
+
+def _atomic_write(path: Path, write: Callable[[Path], None]) -> None:
+    """写临时文件并 fsync，再原子替换目标文件"""
+    tmp = path.with_name(path.name + ".tmp")
+    write(tmp)
+    fd = os.open(tmp, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(tmp, path)
+
+
+def _save_npy(vectors: np.ndarray) -> Callable[[Path], None]:
+    def write(path: Path) -> None:
+        # 传文件对象，避免 np.save 给 .tmp 文件名再加 .npy 后缀
+        with open(path, "wb") as f:
+            np.save(f, vectors)
+
+    return write
+
+
+class SegmentStore:
+    """由多个只追加的段组成的向量索引
+
+    Args:
+        root: 知识库目录
+        legacy_index: 旧版单文件索引，存在时首次打开自动转换成第一个段
+    """
+
+    def __init__(self, root: Path, legacy_index: Path | None = None):
+        self.root = Path(root)
+        self.legacy_index = legacy_index
+        self._lock = threading.RLock()
+        self._segments: list[Segment] | None = None
+        self._next_id = 0
+        self._next_seq = 1
+        self._manifest_mtime: int | None = None
+        # 已打开的段索引（name -> index）
+        self._indexes: dict[str, faiss.Index] = {}
+        self._merge_thread: threading.Thread | None = None
+        # 本进程正在写、还没进入 manifest 的段（清理残留文件时跳过）
+        self._pending: set[str] = set()
+        self._orphans_removed = False
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.root / MANIFEST
+
+    # ---------- manifest ----------
+
+    def _ensure_loaded(self) -> list[Segment]:
+        """首次使用或 manifest 被其他进程更新时重新加载"""
+        with self._lock:
+            try:
+                mtime = self.manifest_path.stat().st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if self._segments is None or mtime != self._manifest_mtime:
+                self._load_manifest()
+            return self._segments
+
+    def _load_manifest(self) -> None:
+        if not self.manifest_path.exists():
+            self._segments, self._next_id, self._next_seq = [], 0, 1
+            self._manifest_mtime = None
+            if self.legacy_index is not None and self.legacy_index.exists():
+                # 旧版单文件索引：先作为只读段检索，第一次写入时再转换
+                legacy = Segment(LEGACY_SEGMENT, 0, 0)
+                legacy.count = self._open(legacy).ntotal
+                self._segments = [legacy]
+                self._next_id = legacy.count
+            return
+        with open(self.manifest_path, "r") as f:
+            manifest = json.load(f)
+        self._segments = [Segment(**s) for s in manifest["segments"]]
+        self._next_id = manifest["next_id"]
+        self._next_seq = manifest["next_seq"]
+        self._manifest_mtime = self.manifest_path.stat().st_mtime_ns
+        live = {s.name for s in self._segments}
+        self._indexes = {k: v for k, v in self._indexes.items() if k in live}
+
+    def _write_manifest(self) -> None:
+        manifest = {
+            "segments": [asdict(s) for s in self._segments],
+            "next_id": self._next_id,
+            "next_seq": self._next_seq,
+        }
+
+        def write(path: Path) -> None:
+            with open(path, "w") as f:
+                json.dump(manifest, f, indent=2)
+
+        _atomic_write(self.manifest_path, write)
+        self._manifest_mtime = self.manifest_path.stat().st_mtime_ns
+
+    def _migrate_legacy(self) -> None:
+        """旧版 faiss.index 转换成第一个段，转换后重命名为 .migrated
+
+        只在写入路径（append）持锁时调用，读取进程不会同时改写同一批文件。
+        """
+        if not self._segments or self._segments[0].name != LEGACY_SEGMENT:
+            return
+        vectors = all_vectors(faiss.read_index(str(self.legacy_index)))
+        self._segments, self._next_id = [], 0
+        self._indexes.pop(LEGACY_SEGMENT, None)
+        self.append(vectors)
+        self.legacy_index.rename(
+            self.legacy_index.with_name(self.legacy_index.name + ".migrated")
+        )
+        logger.info(f"[RAG] 已把 {self.legacy_index.name} 转换为分段存储")
+
+    def _remove_orphans(self) -> None:
+        """删除崩溃或合并中断留下的、manifest 之外的段文件（写入方持锁调用，每个实例一次）
+
+        跳过本进程正在写的段，以及比 manifest 新的文件（可能是其他进程正在写的段）。
+        """
+        if self._orphans_removed:
+            return
+        self._orphans_removed = True
+        live = {s.name for s in self._segments} | self._pending
+        for path in self.root.glob("seg-*"):
+            if path.name.split(".", 1)[0] in live:
+                continue
+            try:
+                if path.stat().st_mtime_ns >= (self._manifest_mtime or 0):
+                    continue
+            except FileNotFoundError:
+                continue
+            path.unlink(missing_ok=True)
+
+    # ---------- 读 ----------
+
+    @property
+    def ntotal(self) -> int:
+        return sum(s.count for s in self._ensure_loaded())
+
+    def kinds(self) -> list[str]:
+        """各段的索引类型"""
+        return [index_kind(self._open(s)) for s in self._ensure_loaded()]
+
+    def _index_path(self, segment: Segment) -> Path:
+        if segment.name == LEGACY_SEGMENT:
+            return self.legacy_index
+        return self.root / f"{segment.name}.index"
+
+    def _open(self, segment: Segment) -> faiss.Index:
+        index = self._indexes.get(segment.name)
+        if index is None:
+            path = self._index_path(segment)
+            # IO_FLAG_MMAP 只对 IVF 的倒排表生效，Flat / HNSW 仍会整个读进内存；
+            # IO_FLAG_MMAP_IFC 直接映射文件里的向量数组，所有索引类型都不占匿名内存
+            index = configure(faiss.read_index(str(path), faiss.IO_FLAG_MMAP_IFC))
+            self._indexes[segment.name] = index
+        return index
+
+    def search(self, queries: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """在所有段中检索，按相似度合并出前 k 个（返回全局 id，缺位为 -1）"""
+        with self._lock:
+            segments = list(self._ensure_loaded())
+            indexes = [self._open(s) for s in segments]
+        distances, ids = [], []
+        for segment, index in zip(segments, indexes):
+            d, i = index.search(queries, min(k, segment.count))
+            distances.append(d)
+            ids.append(np.where(i >= 0, i + segment.start_id, -1))
+        if not distances:
+            empty = np.empty((len(queries), 0))
+            return empty.astype("float32"), empty.astype("int64")
+        distances = np.hstack(distances)
+        ids = np.hstack(ids)
+        order = np.argsort(-distances, axis=1)[:, :k]
+        return (
+            np.take_along_axis(distances, order, axis=1),
+            np.take_along_axis(ids, order, axis=1),
+        )
+
+    def vectors(self) -> np.ndarray:
+        """按全局 id 顺序取出全部原始向量"""
+        segments = self._ensure_loaded()
+        if not segments:
+            return np.empty((0, 0), dtype="float32")
+        return np.concatenate([self._segment_vectors(s) for s in segments])
+
+    def has_raw_vectors(self) -> bool:
+        """所有段都能取出原始向量（没有 .npy 的 PQ 段只能解码出近似值）"""
+        return all(
+            (self.root / f"{s.name}.npy").exists()
+            or index_kind(self._open(s)) != "ivfpq"
+            for s in self._ensure_loaded()
+        )
+
+    def _segment_vectors(self, segment: Segment) -> np.ndarray:
+        path = self.root / f"{segment.name}.npy"
+        if path.exists():
+            return np.load(path, mmap_mode="r")
+        # 没有保存原始向量的段：单独读一份索引解码（不影响正在检索的那份）
+        index = faiss.read_index(
+            str(self._index_path(segment)), faiss.IO_FLAG_MMAP_IFC
+        )
+        return all_vectors(index)
+
+    # ---------- 写 ----------
+
+    def _new_name(self) -> str:
+        with self._lock:
+            name = f"seg-{self._next_seq:06d}"
+            self._next_seq += 1
+            self._pending.add(name)
+        return name
+
+    def _write_segment(
+        self, name: str, vectors: np.ndarray, corpus_size: int
+    ) -> faiss.Index:
+        index = build_index(vectors, corpus_size=corpus_size)
+        if index_kind(index) != "ivfpq" or keep_raw_vectors():
+            _atomic_write(self.root / f"{name}.npy", _save_npy(vectors))
+        _atomic_write(
+            self.root / f"{name}.index",
+            lambda path: faiss.write_index(index, str(path)),
+        )
+        return index
+
+    def append(self, vectors: np.ndarray) -> int:
+        """把一批向量（已归一化）写成一个新段
+
+        Returns:
+            这批向量的起始全局 id
+        """
+        with self._lock:
+            self._ensure_loaded()
+            self._migrate_legacy()
+            self._remove_orphans()
+            name = self._new_name()
+            start_id = self._next_id
+            try:
+                self._indexes[name] = self._write_segment(
+                    name, vectors, corpus_size=start_id + len(vectors)
+                )
+                self._segments.append(Segment(name, start_id, len(vectors)))
+                self._next_id = start_id + len(vectors)
+                self._write_manifest()
+            finally:
+                self._pending.discard(name)
+        return start_id
+
+    def merge_async(self) -> None:
+        """段数超过 MAX_SEGMENTS 时启动后台合并（已有合并在进行时跳过）"""
+        with self._lock:
+            if len(self._ensure_loaded()) <= MAX_SEGMENTS:
+                return
+            if self._merge_thread is not None and self._merge_thread.is_alive():
+                return
+            # 非守护线程：进程退出前等合并完成，中途被杀也不会损坏知识库
+            self._merge_thread = threading.Thread(
+                target=self._merge_loop, name="rag-merge"
+            )
+            self._merge_thread.start()
+
+    def wait_merge(self) -> None:
+        """等待后台合并结束"""
+        thread = self._merge_thread
+        if thread is not None:
+            thread.join()
+
+    def _pick_window(self) -> list[Segment] | None:
+        """选出总向量数最少的 MERGE_FANOUT 个相邻段"""
+        segments = self._ensure_loaded()
+        if len(segments) <= MAX_SEGMENTS:
+            return None
+        start = min(
+            range(len(segments) - MERGE_FANOUT + 1),
+            key=lambda i: sum(s.count for s in segments[i : i + MERGE_FANOUT]),
+        )
+        return segments[start : start + MERGE_FANOUT]
+
+    def _merge_loop(self) -> None:
+        while True:
+            with self._lock:
+                window = self._pick_window()
+            if window is None:
+                return
+            try:
+                self._merge(window)
+            except Exception as e:
+                logger.warning(f"[RAG] 合并段失败: {e}")
+                return
+
+    def _merge(self, window: list[Segment]) -> None:
+        """把相邻的几个段合并成一个（构建索引时不持有锁，不阻塞查询和追加）"""
+        vectors = np.concatenate([self._segment_vectors(s) for s in window])
+        name = self._new_name()
+        old = [s.name for s in window]
+        try:
+            index = self._write_segment(name, vectors, corpus_size=self.ntotal)
+            merged = Segment(name, window[0].start_id, len(vectors))
+
+            with self._lock:
+                segments = self._ensure_loaded()
+                names = [s.name for s in segments]
+                try:
+                    start = names.index(old[0])
+                except ValueError:
+                    start = -1
+                if names[start : start + len(old)] != old:
+                    # 段列表在合并期间被其他进程改变，放弃这次合并
+                    for path in self.root.glob(f"{name}.*"):
+                        path.unlink(missing_ok=True)
+                    return
+                segments[start : start + len(old)] = [merged]
+                self._indexes[name] = index
+                for n in old:
+                    self._indexes.pop(n, None)
+                self._write_manifest()
+        finally:
+            with self._lock:
+                self._pending.discard(name)
+        logger.info(f"[RAG] 合并 {len(old)} 个段 -> {name}（{len(vectors)} 条向量）")
+
+        # manifest 已经不再引用旧段，可以删除（已 mmap 的读者不受影响）
+        for n in old:
+            for path in self.root.glob(f"{n}.*"):
+                path.unlink(missing_ok=True)
@@ -10,9 +10,7 @@ def main() -> int:
     parser = argparse.ArgumentParser(
         description="Lesson 05: RAG - Build knowledge base and query"
     )
-    parser.add_argument(
-        "--task", required=True, help="The user task for the agent to solve."
-    )
+    parser.add_argument("--task", help="The user task for the agent to solve.")
     parser.add_argument(
         "--max-steps", type=int, default=10, help="Safety brake for the agent loop."
     )
@@ -22,8 +20,66 @@ def main() -> int:
         default=None,
         help="Directory for log files (default: ./logs in lesson dir).",
     )
+    parser.add_argument(
+        "--eval-index",
+        action="store_true",
+        help="Report recall@k and latency of the RAG index against a flat baseline.",
+    )
+    parser.add_argument(
+        "--eval-k", type=int, default=10, help="k for --eval-index recall@k."
+    )
+    parser.add_argument(
+        "--ingest",
+        metavar="PATH",
+        help="Chunk and index a directory of .txt/.md files or a JSONL file.",
+    )
+    parser.add_argument(
+        "--serve-embeddings",
+        action="store_true",
+        help="Run a local embedding server shared by workers (see RAG_EMBEDDING_URL).",
+    )
+    parser.add_argument(
+        "--port", type=int, default=8765, help="Port for --serve-embeddings."
+    )
     args = parser.parse_args()
 
+    # 本地向量化服务：多个进程共用一个模型
+    if args.serve_embeddings:
+        from knowledge.embedding import serve
+
+        serve(port=args.port)
+        return 0
+
+    # 批量导入文档：流式切块、分批向量化，不经过 agent
+    if args.ingest:
+        from tools.registry import TOOL_REGISTRY
+
+        rag = TOOL_REGISTRY["rag"]
+        n_docs, n_chunks = rag.ingest(args.ingest)
+        rag.segments.wait_merge()
+        print(f"[RAG] 导入 {n_docs} 个文档，共 {n_chunks} 块")
+        return 0
+
+    # 评估检索索引：召回率 / 延迟 vs Flat 基线
+    if args.eval_index:
+        from tools.registry import TOOL_REGISTRY
+
+        try:
+            report = TOOL_REGISTRY["rag"].evaluate(k=args.eval_k)
+        except ValueError as e:
+            print(f"[RAG] 无法评估: {e}")
+            return 1
+        print(
+            f"[RAG] 索引 {report['kind']}, {report['ntotal']} 条向量\n"
+            f"[RAG] recall@{report['k']}: {report['recall']:.3f}\n"
+            f"[RAG] 延迟: {report['index_ms']:.3f} ms/query "
+            f"(Flat {report['flat_ms']:.3f} ms/query, {report['speedup']:.1f}x)"
+        )
+        return 0
+
+    if not args.task:
+        parser.error("--task is required")
+
     if args.log_dir:
         log_dir = Path(args.log_dir)
     else:
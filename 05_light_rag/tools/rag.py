@@ -2,17 +2,27 @@
 
 from __future__ import annotations
 
-import json
 import pickle
 from pathlib import Path
-from typing import Any
+from typing import Any, Iterable, Iterator
 
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from loguru import logger
+
+from knowledge.chunking import batched, chunk_text, iter_documents
+from knowledge.embedding import DIMENSION, get_embedder
+from knowledge.index import evaluate
+from knowledge.metadata import MetadataStore
+from knowledge.segments import SegmentStore
 
 from .base import BaseTool
 
+# 每次送进模型的块数（控制向量化时的内存峰值）
+EMBED_BATCH = 64
+# 攒够这么多块写一个段（约 6MB 向量），避免流式导入产生大量小段
+SEGMENT_CHUNKS = 4096
+
 
 class RAGTool(BaseTool):
     """RAG 工具：构建知识库、检索文档"""
@@ -24,29 +34,16 @@ class RAGTool(BaseTool):
         self.index_path = self.db_path / "faiss.index"
         self.meta_path = self.db_path / "metadata.json"
 
-        # all-MiniLM-L6-v2: 384 维向量
-        self.model = SentenceTransformer("all-MiniLM-L6-v2")
-        self.dimension = 384
-
-        # 加载已有索引
-        self.index = None
-        self.metadata: list[dict] = []
-        self._load()
-
-    def _load(self):
-        """加载已有索引"""
-        if self.index_path.exists():
-            self.index = faiss.read_index(str(self.index_path))
-        if self.meta_path.exists():
-            with open(self.meta_path, "r") as f:
-                self.metadata = json.load(f)
-
-    def _save(self):
-        """保存索引"""
-        if self.index is not None:
-            faiss.write_index(self.index, str(self.index_path))
-        with open(self.meta_path, "w") as f:
-            json.dump(self.metadata, f)
+        # 向量模型在第一次编码时才加载，多个 RAGTool 共用一个
+        self.embedder = get_embedder()
+        self.dimension = DIMENSION
+
+        # 索引和元数据都在第一次使用时才打开，启动时间与语料规模无关
+        # 每次 build 追加一个新段，段多了在后台合并
+        self.segments = SegmentStore(self.db_path, legacy_index=self.index_path)
+        self.metadata = MetadataStore(
+            self.db_path / "metadata.db", legacy_json=self.meta_path
+        )
 
     @property
     def name(self) -> str:
@@ -57,11 +54,13 @@ class RAGTool(BaseTool):
         return """RAG 工具：基于知识库回答问题。
 
 actions:
-- build: 构建知识库（输入：documents 文档列表，每项包含 content 和 source）
+- build: 构建知识库（输入：documents 文档列表，每项包含 content 和 source；
+  或 path 目录 / JSONL 文件路径）。长文档会自动切块
 - query: 查询知识库（输入：question 问题）
 
 示例：
 rag(action="build", documents=[{"content": "Python 是编程语言", "source": "doc1"}])
+rag(action="build", path="docs/")
 rag(action="query", question="什么是 Python？")
 """
 
@@ -85,6 +84,11 @@ rag(action="query", question="什么是 Python？")
                         },
                     },
                 },
+                "path": {
+                    "type": "string",
+                    "description": "目录（读取 .txt/.md 文件）或 JSONL 文件路径"
+                    "（build 动作可选，代替 documents）",
+                },
                 "question": {
                     "type": "string",
                     "description": "查询问题（query 动作需要）",
@@ -97,7 +101,9 @@ rag(action="query", question="什么是 Python？")
         action = kwargs.get("action", "")
 
         if action == "build":
-            documents = kwargs.get("documents", [])
+            documents = kwargs.get("documents") or []
+            if kwargs.get("path"):
+                return self._build_index(kwargs["path"])
             return self._build_index(documents)
         elif action == "query":
             question = kwargs.get("question", "")
@@ -105,67 +111,116 @@ rag(action="query", question="什么是 Python？")
         else:
             return False, f"Unknown action: {action}. Use 'build' or 'query'."
 
-    def _build_index(self, documents: list[dict[str, Any]]) -> tuple[bool, str]:
+    def _build_index(
+        self, documents: list[dict[str, Any]] | str | Path
+    ) -> tuple[bool, str]:
         """构建知识库索引"""
         if not documents:
             return False, "No documents provided"
-
-        # 向量化
-        texts = [doc.get("content", "") for doc in documents]
-        vectors = self.model.encode(texts)
-
-        # 转换为 float32
-        vectors = vectors.astype("float32")
-
-        # 创建或追加到索引
-        if self.index is None:
-            self.index = faiss.IndexFlatIP(self.dimension)  # 内积相似度
-
-        # 归一化向量（用于余弦相似度）
-        faiss.normalize_L2(vectors)
-
-        # 添加到索引
-        self.index.add(vectors)
-
-        # 保存元数据
+        try:
+            n_docs, n_chunks = self.ingest(documents)
+        except (OSError, ValueError) as e:
+            return False, f"Failed to read documents: {e}"
+        if n_chunks == 0:
+            return False, "No documents provided"
+        return True, f"Indexed {n_docs} documents ({n_chunks} chunks)"
+
+    def ingest(
+        self,
+        documents: Iterable[dict[str, Any]] | str | Path,
+        batch_size: int = EMBED_BATCH,
+    ) -> tuple[int, int]:
+        """流式导入：切块 -> 按 batch_size 向量化 -> 攒够 SEGMENT_CHUNKS 写一个段
+
+        内存占用只与 batch_size / SEGMENT_CHUNKS 和单个文档大小有关，与语料总量无关。
+
+        Args:
+            documents: 文档的可迭代对象（可以是生成器）、目录或 JSONL 文件路径
+
+        Returns:
+            (文档数, 块数)
+        """
+        stats = {"docs": 0}
+        chunks = self._iter_chunks(iter_documents(documents), stats)
+        n_chunks = 0
+        rows: list[dict[str, Any]] = []
+        vectors: list[np.ndarray] = []
+        for batch in batched(chunks, batch_size):
+            batch_vectors = self.embedder.encode([c["content"] for c in batch])
+            # 归一化向量（用于余弦相似度）
+            faiss.normalize_L2(batch_vectors)
+            rows.extend(batch)
+            vectors.append(batch_vectors)
+            n_chunks += len(batch)
+            if len(rows) >= SEGMENT_CHUNKS:
+                self._write_chunks(rows, vectors)
+                rows, vectors = [], []
+                logger.info(f"[RAG] 已导入 {stats['docs']} 个文档 / {n_chunks} 块")
+        if rows:
+            self._write_chunks(rows, vectors)
+        return stats["docs"], n_chunks
+
+    def _iter_chunks(
+        self, documents: Iterator[dict[str, Any]], stats: dict[str, int]
+    ) -> Iterator[dict[str, Any]]:
+        """把文档逐个切块，产出带 doc_id / chunk_index 的块"""
+        doc_id = self.metadata.next_doc_id()
         for i, doc in enumerate(documents):
-            self.metadata.append(
-                {
-                    "id": len(self.metadata),
-                    "content": doc.get("content", ""),
-                    "source": doc.get("source", f"doc_{i}"),
+            source = doc.get("source") or f"doc_{i}"
+            pieces = chunk_text(doc.get("content") or "")
+            if not pieces:
+                continue
+            for chunk_index, piece in enumerate(pieces):
+                yield {
+                    "content": piece,
+                    "source": source,
+                    "doc_id": doc_id,
+                    "chunk_index": chunk_index,
                 }
-            )
-
-        # 保存
-        self._save()
-
-        return True, f"Indexed {len(documents)} documents"
+            doc_id += 1
+            stats["docs"] += 1
+
+    def _write_chunks(self, rows: list[dict[str, Any]], vectors: list[np.ndarray]):
+        """把一批块写成一个新段"""
+        # 元数据先于向量段写入：段提交前崩溃时，多出的元数据行不会被检索到，
+        # 下次写入同样的 id 时被覆盖
+        start_id = self.segments.ntotal
+        self.metadata.add_many(
+            {**row, "id": start_id + i} for i, row in enumerate(rows)
+        )
+
+        # 追加一个新段（内积相似度），段多了在后台合并、按规模重新选择索引类型
+        self.segments.append(np.vstack(vectors))
+        self.segments.merge_async()
 
     def _query(self, question: str) -> tuple[bool, str]:
         """查询知识库"""
         if not question:
             return False, "No question provided"
 
-        if self.index is None or len(self.metadata) == 0:
+        ntotal = self.segments.ntotal
+        if ntotal == 0:
             return False, "Knowledge base is empty. Please build it first."
 
         # 把问题转成向量
-        question_vector = self.model.encode([question]).astype("float32")
+        question_vector = self.embedder.encode([question])
         faiss.normalize_L2(question_vector)
 
         # 检索相似文档
-        k = min(3, self.index.ntotal)
-        distances, indices = self.index.search(question_vector, k)
+        k = min(3, ntotal)
+        distances, indices = self.segments.search(question_vector, k)
 
-        # 提取相关文档
+        # 提取相关文档（只读取命中的元数据行）
+        found = self.metadata.get_many(idx for idx in indices[0] if idx >= 0)
         context_parts = []
         for i, idx in enumerate(indices[0]):
-            if idx < 0:
+            if idx not in found:
                 continue
-            meta = self.metadata[idx]
+            meta = found[idx]
             content = meta["content"]
             source = meta["source"]
+            if meta["chunk_index"]:
+                source = f"{source} #{meta['chunk_index'] + 1}"
             distance = float(distances[0][i])
             context_parts.append(f"[{source}] (similarity: {distance:.4f})\n{content}")
 
@@ -176,3 +231,19 @@ rag(action="query", question="什么是 Python？")
 
         # 返回上下文，供 LLM 生成答案
         return False, f"Relevant context:\n\n{context}"
+
+    def evaluate(self, k: int = 10, n_queries: int = 100) -> dict[str, Any]:
+        """用库中随机抽取的向量作查询，对比当前索引与 Flat 基线的召回率和延迟"""
+        if self.segments.ntotal == 0:
+            raise ValueError("Knowledge base is empty. Please build it first.")
+        if not self.segments.has_raw_vectors():
+            raise ValueError(
+                "IVF-PQ segments do not keep raw vectors. "
+                "Set RAG_KEEP_VECTORS=1 and rebuild to evaluate recall."
+            )
+        vectors = self.segments.vectors()
+        rng = np.random.default_rng(0)
+        picks = rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)
+        kinds = self.segments.kinds()
+        kind = f"{len(kinds)} 段: {', '.join(sorted(set(kinds)))}"
+        return evaluate(self.segments, vectors[picks], vectors, k, kind=kind)
@@ -2,8 +2,7 @@
 
 from __future__ import annotations
 
-import json
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Any
 
@@ -14,17 +13,21 @@ import sys
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "lib"))
 
 from env import find_and_load_env
-from openai_compat import chat_completions, load_config_from_env
-from log import init_logger, format_json
+from agent_loop import AgentLoop, AgentResult
+from openai_compat import OpenAICompatConfig, load_config_from_env
+from log import init_logger, open_trace
 
 from tools.registry import TOOL_REGISTRY as BASE_TOOL_REGISTRY
 from tools.search import SearchTool
-from message import MessageStore
+from message import BackgroundCompressor, MessageStore, default_db_path
 from message.compression import (
     should_compress,
-    compress_conversation,
-    estimate_tokens,
+    count_message_tokens,
+    fold_history,
+    fold_if_over,
+    load_history,
 )
+from message.tokens import get_counter
 
 
 # 添加搜索工具到注册表
@@ -40,11 +43,26 @@ def execute_tool(name: str, arguments: dict[str, Any]) -> tuple[bool, str]:
     raise RuntimeError(f"Unknown tool: {name}")
 
 
+def is_parallel_safe(name: str) -> bool:
+    """工具是否可以与同一轮的其他调用并发执行"""
+    tool = TOOL_REGISTRY.get(name)
+    return bool(tool and tool.parallel_safe)
+
+
 @dataclass
 class MiniManus:
     max_steps: int = 10
     log_dir: Path | None = None
     max_tokens: int = 4000
+    # 读取历史的 token 预算（按 token 而不是条数截取，超过 max_tokens 再压缩）
+    history_tokens: int = 16000
+    # 未折叠的历史超过 max_tokens * soft_ratio 时，一轮结束后在后台压缩；
+    # 超过 max_tokens（硬上限）才在请求内同步压缩
+    soft_ratio: float = 0.75
+    # 跨多次 run 复用（队列模式下不必每个任务重新打开数据库）
+    message_store: MessageStore | None = field(default=None, repr=False)
+    # 后台压缩执行器（跨多次 run 复用）
+    compressor: BackgroundCompressor | None = field(default=None, repr=False)
 
     def _system_prompt(self) -> str:
         tool_descriptions = []
@@ -60,41 +78,45 @@ class MiniManus:
             "When you have the final answer, call `terminate`.\n"
         )
 
-    def run(self, *, task: str, session_id: str = "default") -> None:
-        if self.log_dir:
-            init_logger(self.log_dir)
-
-        find_and_load_env()
-        cfg = load_config_from_env()
-
-        # 初始化消息存储
-        db_path = Path(__file__).parent / "message" / "messages.db"
-        message_store = MessageStore(str(db_path))
-
-        tools = [tool.schema() for tool in TOOL_REGISTRY.values()]
-
-        # 获取历史消息
-        history = message_store.get_recent(limit=20, session_id=session_id)
-
-        logger.info("=" * 60)
-        logger.info("Step 0: 初始上下文")
-        logger.info("=" * 60)
-
+    def _compress_history(
+        self, history: list[dict[str, Any]], session_id: str, cfg: OpenAICompatConfig
+    ) -> list[dict[str, Any]]:
+        """历史消息超过阈值时，把较早的消息折叠进滚动摘要"""
         # 计算并显示 token 估算
-        total_tokens = sum(estimate_tokens(m.get("content", "")) for m in history)
+        total_tokens = count_message_tokens(history)
         logger.info(f"历史消息数量: {len(history)} 条")
-        logger.info(f"估算 token 数量: {total_tokens} (阈值: {self.max_tokens})")
+        logger.info(
+            f"估算 token 数量: {total_tokens} "
+            f"(软阈值: {self.soft_tokens}, 硬上限: {self.max_tokens})"
+        )
 
-        # 检查是否需要压缩
+        if (
+            should_compress(history, self.max_tokens)
+            and self.compressor is not None
+            and self.compressor.busy(session_id)
+        ):
+            # 上一轮的后台压缩还没完成：等它完成后重新读取，通常就不再超限
+            logger.info("[压缩] 等待后台压缩完成...")
+            self.compressor.wait(session_id)
+            history = load_history(self.message_store, session_id, self.history_tokens)
+            total_tokens = count_message_tokens(history)
+
+        # 只有超过硬上限才在请求内同步压缩
         if should_compress(history, self.max_tokens):
             logger.info(
                 f"[压缩] 需要压缩！当前 {total_tokens} tokens > {self.max_tokens} tokens"
             )
             logger.info(f"[压缩] 正在压缩 {len(history)} 条消息...")
 
-            compressed = compress_conversation(history, cfg)
+            # 最近一半预算内的消息保持原样，更早的新消息折叠进摘要
+            fold_history(
+                self.message_store, session_id, cfg, keep_tokens=self.max_tokens // 2
+            )
+            compressed = load_history(
+                self.message_store, session_id, self.history_tokens
+            )
 
-            new_tokens = sum(estimate_tokens(m.get("content", "")) for m in compressed)
+            new_tokens = count_message_tokens(compressed)
             logger.info(
                 f"[压缩] 压缩完成！{total_tokens} tokens -> {new_tokens} tokens (节省 {total_tokens - new_tokens} tokens)"
             )
@@ -106,97 +128,96 @@ class MiniManus:
                 f"[无需压缩] 当前 {total_tokens} tokens <= {self.max_tokens} tokens"
             )
 
+        return history
+
+    @property
+    def soft_tokens(self) -> int:
+        """触发后台压缩的软阈值"""
+        return int(self.max_tokens * self.soft_ratio)
+
+    def _compress_in_background(self, session_id: str, cfg: OpenAICompatConfig) -> None:
+        """一轮结束后提交后台压缩，下一轮直接读取算好的摘要"""
+        store = self.message_store
+
+        def job() -> None:
+            fold_if_over(
+                store,
+                session_id,
+                cfg,
+                soft_tokens=self.soft_tokens,
+                keep_tokens=self.max_tokens // 2,
+            )
+
+        self.compressor.submit(session_id, job)
+
+    def run(self, *, task: str, session_id: str = "default") -> None:
+        if self.log_dir:
+            init_logger(self.log_dir)
+        trace = open_trace(self.log_dir)
+
+        find_and_load_env()
+        cfg = load_config_from_env()
+
+        # 初始化消息存储
+        if self.message_store is None:
+            self.message_store = MessageStore(default_db_path())
+        message_store = self.message_store
+        if self.compressor is None:
+            self.compressor = BackgroundCompressor()
+
+        tools = [tool.schema() for tool in TOOL_REGISTRY.values()]
+
+        # 已归档的冷会话先恢复
+        if message_store.restore_session(session_id):
+            logger.info(f"[会话] 已从归档恢复: {session_id}")
+
+        # 获取历史消息：滚动摘要 + 摘要之后的消息
+        history = load_history(message_store, session_id, self.history_tokens)
+
         messages: list[dict[str, Any]] = [
             {"role": "system", "content": self._system_prompt()},
             *history,
             {"role": "user", "content": task},
         ]
 
-        logger.info(format_json(messages))
-        logger.info(f"\nAvailable tools: {len(tools)}")
-        logger.info(f"Tools: {[t['function']['name'] for t in tools]}")
-
-        for step in range(1, self.max_steps + 1):
-            logger.info("#" * 60)
-            logger.info(f"# Step {step}")
-            logger.info("#" * 60)
-
-            resp = chat_completions(
-                cfg=cfg, messages=messages, tools=tools, tool_choice="auto"
-            )
-
-            logger.info(f"Step {step}: LLM response")
-            logger.info(format_json(resp))
-
-            msg = (resp.get("choices") or [{}])[0].get("message") or {}
-            tool_calls = msg.get("tool_calls") or []
-            content = (msg.get("content") or "").strip()
-
-            if tool_calls:
-                for idx, call in enumerate(tool_calls):
-                    fn = call.get("function") or {}
-                    name = fn.get("name") or ""
-
-                    raw_args = fn.get("arguments") or "{}"
-
-                    try:
-                        args = (
-                            json.loads(raw_args)
-                            if isinstance(raw_args, str)
-                            else dict(raw_args)
-                        )
-                    except Exception as e:
-                        raise RuntimeError(
-                            f"Invalid tool arguments for {name}: {raw_args}"
-                        ) from e
-
-                    logger.info(f"Step {step}: Calling tool {name}")
-                    logger.info(format_json({"arguments": args}))
-
-                    should_stop, output = execute_tool(name, args)
-
-                    logger.info(f"Step {step}: Tool returned")
-                    logger.info(output[:500] + "..." if len(output) > 500 else output)
-
-                    tool_result_msg = (
-                        f"[TOOL_CALL {name}] {json.dumps(args)}\n[TOOL_RESULT] {output}"
-                    )
-                    messages.append({"role": "user", "content": tool_result_msg})
-
-                    if should_stop:
-                        logger.info("*" * 60)
-                        logger.info("* Final Answer (Agent Loop Terminated)")
-                        logger.info("*" * 60)
-                        logger.info(output)
-
-                        # 存储最终消息
-                        message_store.add("user", task, session_id)
-                        message_store.add("assistant", output, session_id)
-
-                        # 显示当前会话消息统计
-                        total_msgs = message_store.count(session_id)
-                        logger.info(f"[消息] 共存储 {total_msgs} 条消息")
-                        return
-
-                logger.info(f"Step {step}: Updated messages")
-                logger.info(format_json(messages))
-                continue
-
-            if content:
-                logger.info("*" * 60)
-                logger.info("* LLM returned content directly (no tool call)")
-                logger.info("*" * 60)
-                logger.info(content)
-
-                # 存储消息
-                message_store.add("user", task, session_id)
-                message_store.add("assistant", content, session_id)
-
-                # 显示当前会话消息统计
-                total_msgs = message_store.count(session_id)
-                logger.info(f"[消息] 共存储 {total_msgs} 条消息")
-                return
-
-        raise RuntimeError(
-            f"Agent exceeded max_steps={self.max_steps} without termination."
+        def compress(messages: list[dict[str, Any]]) -> list[dict[str, Any]]:
+            # 只压缩历史部分，保留 system prompt 和本轮任务
+            history = self._compress_history(messages[1:-1], session_id, cfg)
+            return [messages[0], *history, messages[-1]]
+
+        def post_llm(step: int, messages: list[dict[str, Any]], resp: dict) -> None:
+            # 用 API 实际的 prompt_tokens 校准 token 估算
+            get_counter().calibrate(messages, resp.get("usage"), tools)
+
+        def persist(result: AgentResult) -> None:
+            # 一轮对话（任务、中间的工具结果、最终回答）在同一个事务里写入
+            steps = result.new_messages
+            if result.stopped_by:
+                # 终止工具的结果就是最终回答，不重复存储
+                steps = steps[:-1]
+            turn = [
+                {"role": "user", "content": task},
+                *steps,
+                {"role": "assistant", "content": result.output},
+            ]
+            message_store.add_many(turn, session_id)
+
+            # 显示当前会话消息统计
+            total_msgs = message_store.count(session_id)
+            logger.info(f"[消息] 共存储 {total_msgs} 条消息")
+
+            # 压缩放到后台，不占用本轮的响应时间
+            self._compress_in_background(session_id, cfg)
+
+        loop = AgentLoop(
+            cfg=cfg,
+            tools=tools,
+            execute_tool=execute_tool,
+            parallel_safe=is_parallel_safe,
+            max_steps=self.max_steps,
+            trace=trace,
+            compress=compress,
+            post_llm=post_llm,
+            persist=persist,
         )
+        loop.run(messages)
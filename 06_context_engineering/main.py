@@ -26,7 +26,14 @@ def main() -> int:
         "--max-tokens",
         type=int,
         default=4000,
-        help="Max tokens before compression.",
+        help="Hard token limit: history above it is compressed before the request.",
+    )
+    parser.add_argument(
+        "--soft-ratio",
+        type=float,
+        default=0.75,
+        help="Compress in the background after a turn once history exceeds "
+        "max-tokens * soft-ratio.",
     )
     parser.add_argument(
         "--log-dir",
@@ -42,7 +49,10 @@ def main() -> int:
         log_dir = Path(__file__).parent / "logs"
 
     agent = MiniManus(
-        max_steps=args.max_steps, log_dir=log_dir, max_tokens=args.max_tokens
+        max_steps=args.max_steps,
+        log_dir=log_dir,
+        max_tokens=args.max_tokens,
+        soft_ratio=args.soft_ratio,
     )
     agent.run(task=args.task, session_id=args.session_id)
     return 0
@@ -1,5 +1,15 @@
 """消息模块"""
 
-from .message_store import MessageStore
+from .background import BackgroundCompressor
+from .message_store import MessageStore, default_db_path
+from .retention import Maintenance, RetentionPolicy
+from .writer import BufferedWriter
 
-__all__ = ["MessageStore"]
+__all__ = [
+    "MessageStore",
+    "BufferedWriter",
+    "BackgroundCompressor",
+    "RetentionPolicy",
+    "Maintenance",
+    "default_db_path",
+]
@@ -2,86 +2,652 @@
 
 from __future__ import annotations
 
+import json
+import os
 import sqlite3
+import threading
+import zlib
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Iterator, Optional
+
+from .tokens import MESSAGE_OVERHEAD, get_counter
+
+if TYPE_CHECKING:
+    from .retention import RetentionPolicy
+
+# 过期删除每个事务最多删除的条数（避免长时间持有写锁）
+EXPIRE_BATCH = 1000
+
+
+def default_db_path() -> str:
+    """消息库路径：MESSAGE_DB_PATH，未设置时放在 message/ 目录下"""
+    return os.environ.get("MESSAGE_DB_PATH") or str(
+        Path(__file__).parent / "messages.db"
+    )
+
+
+def _utc_before(days: float) -> str:
+    """days 天之前的 UTC 时间，格式与 CURRENT_TIMESTAMP 一致"""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    return cutoff.strftime("%Y-%m-%d %H:%M:%S")
 
 
 class MessageStore:
-    """消息存储：SQLite"""
+    """消息存储：SQLite
+
+    每个线程复用一条长连接（WAL + synchronous=NORMAL），
+    读不阻塞写，提交时也不必每次都 fsync 主库文件。
+    """
 
     def __init__(self, db_path: str = "messages.db"):
         self.db_path = db_path
+        self.counter = get_counter()
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._conns: list[sqlite3.Connection] = []
         self._init_db()
 
+    def _conn(self) -> sqlite3.Connection:
+        """当前线程的长连接（首次使用时创建）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # cached_statements: 固定的 SQL 只编译一次
+            conn = sqlite3.connect(
+                self.db_path,
+                timeout=30,
+                check_same_thread=False,
+                cached_statements=64,
+            )
+            conn.row_factory = sqlite3.Row
+            # 只对新建的数据库生效；旧库需要 compact(full=True) 转换一次
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    def close(self):
+        """关闭所有线程的连接"""
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            conn.close()
+        self._local = threading.local()
+
     def _init_db(self):
         """初始化数据库表"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._conn() as conn:
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS messages (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     role TEXT NOT NULL,
                     content TEXT NOT NULL,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    session_id TEXT DEFAULT 'default'
+                    session_id TEXT DEFAULT 'default',
+                    tokens INTEGER NOT NULL DEFAULT 0
                 )
             """)
+            self._migrate_tokens(conn)
+            # 查询都按 id 排序：(session_id, id, tokens) 既能按会话顺序扫描，
+            # 也能只读索引就完成 token 预算的累加
+            conn.execute("DROP INDEX IF EXISTS idx_session_created")
             conn.execute("""
-                CREATE INDEX IF NOT EXISTS idx_session_created 
-                ON messages(session_id, created_at)
+                CREATE INDEX IF NOT EXISTS idx_session_id
+                ON messages(session_id, id, tokens)
             """)
+            # 过期删除按时间查找（恢复的归档会让 id 与 created_at 不同序）
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_messages_created
+                ON messages(created_at)
+            """)
+            self._init_sessions(conn)
 
-    def add(self, role: str, content: str, session_id: str = "default"):
-        """添加消息"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute(
-                "INSERT INTO messages (role, content, session_id) VALUES (?, ?, ?)",
-                (role, content, session_id),
+    def _init_sessions(self, conn: sqlite3.Connection):
+        """会话汇总表：随写入 / 清空同步维护，避免每次都扫描 messages"""
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sessions'"
+        ).fetchone()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                msg_count INTEGER NOT NULL DEFAULT 0,
+                token_total INTEGER NOT NULL DEFAULT 0,
+                last_active TIMESTAMP,
+                compressed_upto INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_sessions_active
+            ON sessions(last_active)
+        """)
+        if not exists:
+            # 旧数据库：从 messages 回填一次
+            conn.execute("""
+                INSERT INTO sessions (session_id, msg_count, token_total, last_active)
+                SELECT session_id, COUNT(*), SUM(tokens), MAX(created_at)
+                FROM messages
+                GROUP BY session_id
+            """)
+        # 冷会话归档：整段消息压缩成一个 BLOB
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS archived_sessions (
+                session_id TEXT PRIMARY KEY,
+                payload BLOB NOT NULL,
+                msg_count INTEGER NOT NULL,
+                token_total INTEGER NOT NULL,
+                last_active TIMESTAMP,
+                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
+        """)
+        # 滚动摘要：summary 是合并后的总摘要，segments 是尚未合并的分段摘要，
+        # watermark 之前（含）的消息都已折叠进摘要
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS summaries (
+                session_id TEXT PRIMARY KEY,
+                summary TEXT NOT NULL DEFAULT '',
+                segments TEXT NOT NULL DEFAULT '[]',
+                watermark INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
 
-    def get_recent(self, limit: int = 20, session_id: str = "default") -> list[dict]:
-        """获取最近的 N 条消息"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.execute(
+    def _migrate_tokens(self, conn: sqlite3.Connection):
+        """旧数据库没有 tokens 列：补上并回填计数"""
+        columns = {r[1] for r in conn.execute("PRAGMA table_info(messages)")}
+        if "tokens" in columns:
+            return
+        conn.execute(
+            "ALTER TABLE messages ADD COLUMN tokens INTEGER NOT NULL DEFAULT 0"
+        )
+        rows = conn.execute("SELECT id, role, content FROM messages").fetchall()
+        conn.executemany(
+            "UPDATE messages SET tokens = ? WHERE id = ?",
+            [
+                (self.counter.raw_message_tokens({"role": r, "content": c}), i)
+                for i, r, c in rows
+            ],
+        )
+
+    def _prime(self, content: str, tokens: int):
+        """把数据库里的计数写入计数器缓存，恢复会话时无需重新分词"""
+        if tokens:
+            self.counter.prime(content, tokens - MESSAGE_OVERHEAD)
+
+    def add(self, role: str, content: str, session_id: str = "default"):
+        """添加消息（写入时计算并保存 token 数）"""
+        self.add_many([{"role": role, "content": content}], session_id)
+
+    def add_many(self, messages: list[dict], session_id: str = "default"):
+        """在一个事务里添加多条消息（一轮对话只提交一次）"""
+        self.write_batch([(session_id, m) for m in messages])
+
+    def write_batch(self, items: list[tuple[str, dict]]):
+        """批量写入 (session_id, message)，可跨会话，一个事务一次提交"""
+        rows = []
+        for session_id, m in items:
+            content = m.get("content") or ""
+            tokens = self.counter.raw_message_tokens({"content": content})
+            rows.append((m["role"], content, session_id, tokens))
+        if not rows:
+            return
+
+        # 按会话汇总，每个会话只更新一次 sessions
+        totals: dict[str, list[int]] = {}
+        for _, _, session_id, tokens in rows:
+            total = totals.setdefault(session_id, [0, 0])
+            total[0] += 1
+            total[1] += tokens
+
+        with self._lock, self._conn() as conn:
+            conn.executemany(
+                "INSERT INTO messages (role, content, session_id, tokens) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            conn.executemany(
                 """
-                SELECT role, content 
-                FROM messages 
-                WHERE session_id = ?
-                ORDER BY id DESC 
-                LIMIT ?
+                INSERT INTO sessions (session_id, msg_count, token_total, last_active)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(session_id) DO UPDATE SET
+                    msg_count = msg_count + excluded.msg_count,
+                    token_total = token_total + excluded.token_total,
+                    last_active = excluded.last_active
             """,
-                (session_id, limit),
+                [(sid, n, tokens) for sid, (n, tokens) in totals.items()],
             )
-            rows = cursor.fetchall()
-            return [
-                {"role": r["role"], "content": r["content"]} for r in reversed(rows)
-            ]
+
+    def get_recent(self, limit: int = 20, session_id: str = "default") -> list[dict]:
+        """获取最近的 N 条消息"""
+        cursor = self._conn().execute(
+            """
+            SELECT role, content, tokens
+            FROM messages 
+            WHERE session_id = ?
+            ORDER BY id DESC 
+            LIMIT ?
+        """,
+            (session_id, limit),
+        )
+        rows = cursor.fetchall()
+        for r in rows:
+            self._prime(r["content"], r["tokens"])
+        return [{"role": r["role"], "content": r["content"]} for r in reversed(rows)]
 
     def get_all(self, session_id: str = "default") -> list[dict]:
         """获取会话的所有消息"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.execute(
+        return list(self.iter_messages(session_id))
+
+    def iter_messages(
+        self,
+        session_id: str = "default",
+        after_id: int = 0,
+        page_size: int = 200,
+        with_id: bool = False,
+    ) -> Iterator[dict]:
+        """按 id 游标分页遍历会话消息（keyset 分页，不会一次性读入整个会话）
+
+        Args:
+            after_id: 只返回 id 大于它的消息
+            page_size: 每页读取的行数
+            with_id: 返回的消息是否带上 id 字段
+        """
+        last_id = after_id
+        while True:
+            cursor = self._conn().execute(
                 """
-                SELECT role, content 
-                FROM messages 
-                WHERE session_id = ?
+                SELECT id, role, content, tokens
+                FROM messages
+                WHERE session_id = ? AND id > ?
                 ORDER BY id ASC
+                LIMIT ?
             """,
-                (session_id,),
+                (session_id, last_id, page_size),
             )
-            return [{"role": r["role"], "content": r["content"]} for r in cursor]
+            rows = cursor.fetchall()
+            for r in rows:
+                self._prime(r["content"], r["tokens"])
+                yield self._to_message(r, with_id)
+            if len(rows) < page_size:
+                return
+            last_id = rows[-1]["id"]
+
+    def get_within_budget(
+        self,
+        max_tokens: int,
+        session_id: str = "default",
+        after_id: int = 0,
+        with_id: bool = False,
+    ) -> list[dict]:
+        """获取最新的若干条消息，总 token 数不超过 max_tokens（按时间正序返回）
+
+        先只扫描索引累加 tokens 找到起点，再读取这一段的内容。
+        """
+        conn = self._conn()
+        total = 0
+        start_id = None
+        cursor = conn.execute(
+            """
+            SELECT id, tokens
+            FROM messages
+            WHERE session_id = ? AND id > ?
+            ORDER BY id DESC
+        """,
+            (session_id, after_id),
+        )
+        for r in cursor:
+            if total + r["tokens"] > max_tokens:
+                break
+            total += r["tokens"]
+            start_id = r["id"]
+        cursor.close()
+
+        if start_id is None:
+            return []
+        return list(self.iter_messages(session_id, start_id - 1, with_id=with_id))
+
+    @staticmethod
+    def _to_message(row: sqlite3.Row, with_id: bool = False) -> dict:
+        message = {"role": row["role"], "content": row["content"]}
+        if with_id:
+            message["id"] = row["id"]
+        return message
+
+    def get_session(self, session_id: str = "default") -> dict | None:
+        """会话汇总信息；会话不存在时返回 None"""
+        row = self._conn().execute(
+            """
+            SELECT session_id, msg_count, token_total, last_active, compressed_upto
+            FROM sessions
+            WHERE session_id = ?
+        """,
+            (session_id,),
+        ).fetchone()
+        return dict(row) if row else None
 
     def count(self, session_id: str = "default") -> int:
         """统计消息数量"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute(
-                "SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)
+        session = self.get_session(session_id)
+        return session["msg_count"] if session else 0
+
+    def token_total(self, session_id: str = "default", after_id: int = 0) -> int:
+        """会话累计的 token 数（未校准的原始计数）
+
+        after_id > 0 时只统计 id 之后的消息（例如摘要水位线之后），
+        走 (session_id, id, tokens) 覆盖索引，不读取消息内容
+        """
+        if after_id > 0:
+            row = self._conn().execute(
+                "SELECT COALESCE(SUM(tokens), 0) FROM messages "
+                "WHERE session_id = ? AND id > ?",
+                (session_id, after_id),
+            ).fetchone()
+            return row[0]
+        session = self.get_session(session_id)
+        return session["token_total"] if session else 0
+
+    def get_summary(self, session_id: str = "default") -> dict:
+        """会话的滚动摘要：{"summary", "segments", "watermark"}"""
+        row = self._conn().execute(
+            "SELECT summary, segments, watermark FROM summaries WHERE session_id = ?",
+            (session_id,),
+        ).fetchone()
+        if row is None:
+            return {"summary": "", "segments": [], "watermark": 0}
+        return {
+            "summary": row["summary"],
+            "segments": json.loads(row["segments"]),
+            "watermark": row["watermark"],
+        }
+
+    def save_summary(
+        self,
+        session_id: str,
+        summary: str,
+        segments: list[str],
+        watermark: int,
+    ):
+        """保存滚动摘要，并把压缩点推进到 watermark"""
+        with self._lock, self._conn() as conn:
+            conn.execute(
+                """
+                INSERT INTO summaries (session_id, summary, segments, watermark)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(session_id) DO UPDATE SET
+                    summary = excluded.summary,
+                    segments = excluded.segments,
+                    watermark = excluded.watermark,
+                    updated_at = CURRENT_TIMESTAMP
+            """,
+                (
+                    session_id,
+                    summary,
+                    json.dumps(segments, ensure_ascii=False),
+                    watermark,
+                ),
+            )
+            conn.execute(
+                "UPDATE sessions SET compressed_upto = ? WHERE session_id = ?",
+                (watermark, session_id),
             )
-            return cursor.fetchone()[0]
 
     def clear(self, session_id: str = "default"):
         """清空会话消息"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._lock, self._conn() as conn:
             conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM summaries WHERE session_id = ?", (session_id,))
+
+    # ---------- 保留策略 / 归档 / 压缩 ----------
+
+    def archive_session(self, session_id: str) -> int:
+        """把会话的消息压缩后移入 archived_sessions，返回归档的消息数"""
+        with self._lock, self._conn() as conn:
+            rows = conn.execute(
+                """
+                SELECT role, content, created_at, tokens
+                FROM messages
+                WHERE session_id = ?
+                ORDER BY id ASC
+            """,
+                (session_id,),
+            ).fetchall()
+            if not rows:
+                return 0
+
+            records = [dict(r) for r in rows]
+            archived = conn.execute(
+                "SELECT payload FROM archived_sessions WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()
+            if archived:
+                # 已有归档：新消息接在后面
+                records = self._unpack(archived["payload"]) + records
+
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO archived_sessions
+                    (session_id, payload, msg_count, token_total, last_active)
+                VALUES (?, ?, ?, ?, ?)
+            """,
+                (
+                    session_id,
+                    self._pack(records),
+                    len(records),
+                    sum(r["tokens"] for r in records),
+                    records[-1]["created_at"],
+                ),
+            )
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            # 恢复时消息会重新编号，摘要的 watermark 不再有效
+            conn.execute("DELETE FROM summaries WHERE session_id = ?", (session_id,))
+        return len(rows)
+
+    def restore_session(self, session_id: str) -> int:
+        """把归档的会话恢复到 messages（会话不在归档中时返回 0）"""
+        with self._lock, self._conn() as conn:
+            archived = conn.execute(
+                "SELECT payload FROM archived_sessions WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()
+            if not archived:
+                return 0
+
+            records = self._unpack(archived["payload"])
+            # 恢复时放在现有消息之前，保持时间顺序
+            current = conn.execute(
+                """
+                SELECT role, content, created_at, tokens
+                FROM messages
+                WHERE session_id = ?
+                ORDER BY id ASC
+            """,
+                (session_id,),
+            ).fetchall()
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            records += [dict(r) for r in current]
+            conn.executemany(
+                """
+                INSERT INTO messages (role, content, created_at, session_id, tokens)
+                VALUES (?, ?, ?, ?, ?)
+            """,
+                [
+                    (r["role"], r["content"], r["created_at"], session_id, r["tokens"])
+                    for r in records
+                ],
+            )
+            conn.execute(
+                "DELETE FROM archived_sessions WHERE session_id = ?", (session_id,)
+            )
+            conn.execute("DELETE FROM summaries WHERE session_id = ?", (session_id,))
+            self._refresh_sessions(conn, [session_id])
+            # 恢复即视为活跃：否则 last_active 仍是归档前的时间，
+            # 后台保留策略会在本轮进行中再次把它归档
+            conn.execute(
+                "UPDATE sessions SET last_active = CURRENT_TIMESTAMP "
+                "WHERE session_id = ?",
+                (session_id,),
+            )
+        return len(records)
+
+    def list_archived(self) -> list[dict]:
+        """列出已归档的会话"""
+        cursor = self._conn().execute("""
+            SELECT session_id, msg_count, token_total, last_active, archived_at,
+                   LENGTH(payload) AS archived_bytes
+            FROM archived_sessions
+            ORDER BY last_active DESC
+        """)
+        return [dict(r) for r in cursor]
+
+    def db_size(self) -> int:
+        """数据库中实际使用的字节数（不含空闲页）"""
+        conn = self._conn()
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return (page_count - freelist) * page_size
+
+    def apply_retention(self, policy: RetentionPolicy) -> dict[str, int]:
+        """按保留策略删除 / 归档消息，返回各项处理的数量
+
+        依次执行：过期删除 -> 每会话条数上限 -> 冷会话归档 -> 数据库大小上限。
+        """
+        stats = {"expired": 0, "trimmed": 0, "archived": 0, "dropped_archives": 0}
+
+        if policy.max_age_days:
+            stats["expired"] = self._expire(_utc_before(policy.max_age_days))
+
+        if policy.max_messages_per_session:
+            stats["trimmed"] = self._trim_sessions(policy.max_messages_per_session)
+
+        if policy.archive_after_days:
+            cutoff = _utc_before(policy.archive_after_days)
+            cold = self._conn().execute(
+                "SELECT session_id FROM sessions WHERE last_active < ?", (cutoff,)
+            ).fetchall()
+            for r in cold:
+                stats["archived"] += self.archive_session(r["session_id"])
+
+        if policy.max_db_bytes:
+            # 先归档最久未活跃的会话，仍然超出再丢弃最旧的归档
+            while self.db_size() > policy.max_db_bytes:
+                row = self._conn().execute(
+                    "SELECT session_id FROM sessions ORDER BY last_active ASC LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    break
+                stats["archived"] += self.archive_session(row["session_id"])
+            while self.db_size() > policy.max_db_bytes:
+                with self._lock, self._conn() as conn:
+                    deleted = conn.execute("""
+                        DELETE FROM archived_sessions WHERE session_id = (
+                            SELECT session_id FROM archived_sessions
+                            ORDER BY last_active ASC LIMIT 1
+                        )
+                    """).rowcount
+                if not deleted:
+                    break
+                stats["dropped_archives"] += deleted
+
+        return stats
+
+    def compact(self, full: bool = False, max_pages: int = 2000):
+        """回收空闲页（不要在请求路径上调用）
+
+        Args:
+            full: 执行完整 VACUUM，并把旧数据库切换为 incremental auto_vacuum
+            max_pages: 增量回收时每次最多释放的页数
+        """
+        with self._lock:
+            conn = self._conn()
+            if full:
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                conn.execute("VACUUM")
+            elif conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                # executescript 会把 PRAGMA 执行到底（execute 只 step 一次，只释放一页）
+                conn.executescript(f"PRAGMA incremental_vacuum({int(max_pages)});")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def _expire(self, cutoff: str) -> int:
+        """删除 cutoff 之前的消息（按 created_at 索引分批删除）"""
+        deleted = 0
+        while True:
+            with self._lock, self._conn() as conn:
+                rows = conn.execute(
+                    "SELECT id, session_id FROM messages WHERE created_at < ? "
+                    "ORDER BY created_at LIMIT ?",
+                    (cutoff, EXPIRE_BATCH),
+                ).fetchall()
+                if not rows:
+                    break
+                ids = [r["id"] for r in rows]
+                conn.execute(
+                    f"DELETE FROM messages WHERE id IN ({','.join('?' * len(ids))})",
+                    ids,
+                )
+                self._refresh_sessions(conn, list({r["session_id"] for r in rows}))
+            deleted += len(rows)
+        return deleted
+
+    def _trim_sessions(self, keep: int) -> int:
+        """每个会话只保留最新的 keep 条消息"""
+        over = self._conn().execute(
+            "SELECT session_id FROM sessions WHERE msg_count > ?", (keep,)
+        ).fetchall()
+        deleted = 0
+        for r in over:
+            session_id = r["session_id"]
+            with self._lock, self._conn() as conn:
+                deleted += conn.execute(
+                    """
+                    DELETE FROM messages
+                    WHERE session_id = ? AND id < (
+                        SELECT id FROM messages WHERE session_id = ?
+                        ORDER BY id DESC LIMIT 1 OFFSET ?
+                    )
+                """,
+                    (session_id, session_id, keep - 1),
+                ).rowcount
+                self._refresh_sessions(conn, [session_id])
+        return deleted
+
+    @staticmethod
+    def _refresh_sessions(conn: sqlite3.Connection, session_ids: list[str]):
+        """删除 / 恢复消息后重新计算会话汇总（走 (session_id, id, tokens) 索引）"""
+        for session_id in session_ids:
+            row = conn.execute(
+                """
+                SELECT COUNT(*), COALESCE(SUM(tokens), 0), MAX(created_at)
+                FROM messages
+                WHERE session_id = ?
+            """,
+                (session_id,),
+            ).fetchone()
+            if row[0] == 0:
+                conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                continue
+            conn.execute(
+                """
+                INSERT INTO sessions (session_id, msg_count, token_total, last_active)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(session_id) DO UPDATE SET
+                    msg_count = excluded.msg_count,
+                    token_total = excluded.token_total,
+                    last_active = excluded.last_active
+            """,
+                (session_id, row[0], row[1], row[2]),
+            )
+
+    @staticmethod
+    def _pack(records: list[dict]) -> bytes:
+        return zlib.compress(
+            json.dumps(records, ensure_ascii=False).encode("utf-8"), 6
+        )
+
+    @staticmethod
+    def _unpack(payload: bytes) -> list[dict]:
+        return json.loads(zlib.decompress(payload).decode("utf-8"))
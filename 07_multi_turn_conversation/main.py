@@ -1,10 +1,12 @@
 """Lesson 07: Multi-turn Conversation - 入口"""
 
 import argparse
+from contextlib import ExitStack
 from pathlib import Path
 
 from agent import MiniManus
-from task import TaskQueue
+from log import init_logger
+from task import TaskQueue, run_workers
 
 
 def main() -> int:
@@ -25,7 +27,14 @@ def main() -> int:
         "--max-tokens",
         type=int,
         default=4000,
-        help="Max tokens before compression.",
+        help="Hard token limit: history above it is compressed before the request.",
+    )
+    parser.add_argument(
+        "--soft-ratio",
+        type=float,
+        default=0.75,
+        help="Compress in the background after a turn once history exceeds "
+        "max-tokens * soft-ratio.",
     )
     parser.add_argument(
         "--log-dir",
@@ -43,11 +52,22 @@ def main() -> int:
         action="store_true",
         help="Run all tasks in the queue.",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Queue tasks run in parallel (tasks of one session never overlap).",
+    )
     parser.add_argument(
         "--list-sessions",
         action="store_true",
         help="List all existing sessions.",
     )
+    parser.add_argument(
+        "--maintain",
+        action="store_true",
+        help="Apply the retention policy (MESSAGE_* env vars) and VACUUM the DB.",
+    )
     parser.add_argument(
         "--list-queue",
         action="store_true",
@@ -68,7 +88,10 @@ def main() -> int:
 
     # 创建 Agent 实例
     agent = MiniManus(
-        max_steps=args.max_steps, log_dir=log_dir, max_tokens=args.max_tokens
+        max_steps=args.max_steps,
+        log_dir=log_dir,
+        max_tokens=args.max_tokens,
+        soft_ratio=args.soft_ratio,
     )
 
     # 任务队列
@@ -76,10 +99,9 @@ def main() -> int:
 
     # 列出所有会话
     if args.list_sessions:
-        from message import MessageStore
+        from message import MessageStore, default_db_path
 
-        db_path = Path(__file__).parent / "message" / "messages.db"
-        store = MessageStore(str(db_path))
+        store = MessageStore(default_db_path())
         sessions = store.list_sessions()
 
         if not sessions:
@@ -87,10 +109,29 @@ def main() -> int:
             return 0
 
         print(f"共有 {len(sessions)} 个会话：\n")
-        print(f"{'Session ID':<20} {'消息数':<10} {'最后活跃':<20}")
-        print("-" * 50)
+        print(f"{'Session ID':<20} {'消息数':<10} {'Tokens':<10} {'最后活跃':<20}")
+        print("-" * 60)
         for s in sessions:
-            print(f"{s['session_id']:<20} {s['msg_count']:<10} {s['last_active']:<20}")
+            print(
+                f"{s['session_id']:<20} {s['msg_count']:<10} "
+                f"{s['token_total']:<10} {s['last_active']:<20}"
+            )
+        return 0
+
+    # 保留策略 + 完整 VACUUM（离线执行）
+    if args.maintain:
+        from message import MessageStore, RetentionPolicy, default_db_path
+
+        store = MessageStore(default_db_path())
+        before = store.db_size()
+        stats = store.apply_retention(RetentionPolicy.from_env())
+        store.compact(full=True)
+        print(
+            f"[维护] 过期 {stats['expired']} 条, 截断 {stats['trimmed']} 条, "
+            f"归档 {stats['archived']} 条, 丢弃归档 {stats['dropped_archives']} 个"
+        )
+        after = store.db_size()
+        print(f"[维护] 数据库: {before / 2**20:.1f} MB -> {after / 2**20:.1f} MB")
         return 0
 
     # 列出队列任务
@@ -103,20 +144,25 @@ def main() -> int:
         stats = queue.get_stats()
         print(
             f"队列统计: 待处理 {stats['pending']}, 进行中 {stats['running']}, "
-            f"已完成 {stats['completed']}, 失败 {stats['failed']}\n"
+            f"已完成 {stats['completed']}, 失败 {stats['failed']}, "
+            f"死信 {stats['dead']}\n"
         )
 
-        print(f"{'状态':<12} {'任务':<40} {'会话':<15}")
-        print("-" * 70)
+        print(f"{'ID':<6} {'状态':<12} {'任务':<40} {'会话':<15}")
+        print("-" * 76)
         for t in tasks:
             status_icon = {
                 "pending": "⏳",
                 "running": "🔄",
                 "completed": "✅",
                 "failed": "❌",
+                "dead": "💀",
             }
             icon = status_icon.get(t["status"], "❓")
-            print(f"{icon} {t['status']:<8} {t['task'][:38]:<40} {t['session_id']:<15}")
+            print(
+                f"{t['id']:<6} {icon} {t['status']:<8} "
+                f"{t['task'][:38]:<40} {t['session_id']:<15}"
+            )
         return 0
 
     # 清空队列
@@ -132,29 +178,59 @@ def main() -> int:
 
     # 运行队列
     if args.run_queue:
-        print("[队列] 开始执行任务队列\n")
-        while queue.has_pending():
-            task_info = queue.pop()
-            task = task_info["task"]
-            session_id = task_info.get("session_id", "default")
+        from message import (
+            BackgroundCompressor,
+            BufferedWriter,
+            Maintenance,
+            MessageStore,
+            RetentionPolicy,
+            default_db_path,
+        )
 
-            print(f"\n{'=' * 60}")
-            print(f"[队列] 执行任务: {task}")
-            print(f"[队列] 会话: {session_id}")
-            print(f"{'=' * 60}\n")
+        print(f"[队列] 开始执行任务队列（{args.workers} 个 worker）\n")
+
+        # 日志只初始化一次：多个 worker 共用同一组 sink
+        init_logger(log_dir)
+
+        # 多个任务的消息由后台线程合并提交
+        agent.message_store = MessageStore(default_db_path())
+        agent.writer = BufferedWriter(agent.message_store)
+        agent.compressor = BackgroundCompressor()
 
-            try:
-                agent.run(task=task, session_id=session_id)
-                queue.complete(task)
-            except Exception as e:
-                queue.fail(task, str(e))
-                print(f"[错误] {e}")
+        # 配置了保留策略时在后台定期清理
+        maintenance = None
+        policy = RetentionPolicy.from_env()
+        if policy.enabled:
+            maintenance = Maintenance(agent.message_store, policy)
+            maintenance.start()
 
+        def run_task(task_info: dict) -> None:
+            print(f"\n{'=' * 60}")
+            print(f"[队列] 执行任务 #{task_info['id']}: {task_info['task']}")
+            print(f"[队列] 会话: {task_info['session_id']}")
+            print(f"{'=' * 60}\n")
+            agent.run(task=task_info["task"], session_id=task_info["session_id"])
+            # 先把本轮消息落盘，再由 worker 标记任务完成：
+            # 标记完成后进程崩溃也不会丢掉这一轮（写入失败时任务按失败处理）
+            agent.writer.flush()
+
+        # 多个 worker 共享同一个 agent（存储、写入缓冲、后台压缩都是线程安全的）
+        # 清理按注册的逆序执行；worker 抛出异常或 Ctrl-C 时也会关闭 writer，
+        # 把缓冲区里的消息落盘（某一步出错不影响后面的步骤）
+        with ExitStack() as cleanup:
+            cleanup.callback(agent.message_store.close)
+            cleanup.callback(agent.writer.close)
+            # 后台压缩会先落盘写入缓冲区，要在关闭 writer 之前结束
+            cleanup.callback(agent.compressor.shutdown)
+            if maintenance is not None:
+                cleanup.callback(maintenance.stop)
+            run_workers(queue, run_task, workers=args.workers)
         print("\n[队列] 所有任务已完成")
         return 0
 
     # 单任务模式
     if args.task:
+        init_logger(log_dir)
         agent.run(task=args.task, session_id=args.session_id)
         return 0
 
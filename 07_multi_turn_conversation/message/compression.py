@@ -1,19 +1,27 @@
 """对话压缩模块"""
 
+import hashlib
+import json
 from typing import Any
 
 from loguru import logger
 
+from .tokens import get_counter
+
 
 def estimate_tokens(text: str) -> int:
-    """简单估算 token 数量（1 token ≈ 4 字符）"""
-    return len(text) // 4
+    """估算文本的 token 数量（tokenizer 优先，按 API usage 校准）"""
+    return get_counter().count_text(text)
+
+
+def count_message_tokens(messages: list[dict]) -> int:
+    """估算消息列表的 token 数量（每条消息的计数有缓存）"""
+    return get_counter().count_messages(messages)
 
 
 def should_compress(messages: list[dict], max_tokens: int = 4000) -> bool:
     """判断是否需要压缩"""
-    total = sum(estimate_tokens(m.get("content", "")) for m in messages)
-    return total > max_tokens
+    return count_message_tokens(messages) > max_tokens
 
 
 def compress_conversation(messages: list[dict], cfg) -> list[dict]:
@@ -61,6 +69,7 @@ def compress_conversation(messages: list[dict], cfg) -> list[dict]:
         cfg=cfg,
         messages=[{"role": "user", "content": prompt}],
         tools=None,
+        cache=True,
     )
 
     summary = (
@@ -77,3 +86,253 @@ def compress_conversation(messages: list[dict], cfg) -> list[dict]:
     ]
 
     return compressed
+
+
+# ---------- 抽取式压缩（不调用 LLM） ----------
+
+TOOL_RESULT_MARK = "[TOOL_RESULT] "
+# 单条工具结果保留的字符上限（超过时保留开头和结尾）
+TOOL_RESULT_MAX_CHARS = 1500
+TOOL_RESULT_HEAD_CHARS = 1000
+TOOL_RESULT_TAIL_CHARS = 300
+# 短于这个长度的重复内容（如“好的”）不去重
+DEDUPE_MIN_CHARS = 200
+# 读取历史时先按预算的这么多倍取原文，压缩后仍有空余时加倍再取
+HISTORY_FETCH_FACTOR = 4
+
+
+def compact_json(text: str) -> str:
+    """去掉 JSON 的缩进和多余空白；不是 JSON 时原样返回"""
+    stripped = text.strip()
+    if not stripped or stripped[0] not in "[{":
+        return text
+    try:
+        data = json.loads(stripped)
+    except ValueError:
+        return text
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def elide(
+    text: str,
+    max_chars: int = TOOL_RESULT_MAX_CHARS,
+    head: int = TOOL_RESULT_HEAD_CHARS,
+    tail: int = TOOL_RESULT_TAIL_CHARS,
+) -> str:
+    """超过 max_chars 时只保留开头 head 和结尾 tail 个字符"""
+    if len(text) <= max_chars:
+        return text
+    omitted = len(text) - head - tail
+    return f"{text[:head]}\n...[已省略 {omitted} 字符]...\n{text[-tail:]}"
+
+
+def _shrink_tool_result(content: str, max_chars: int) -> str:
+    # Moonshot 风格的工具结果：[TOOL_CALL name] args\n[TOOL_RESULT] output
+    prefix, mark, output = content.partition(TOOL_RESULT_MARK)
+    if not mark:
+        prefix, output = "", content
+    output = elide(
+        compact_json(output),
+        max_chars,
+        head=max_chars * 2 // 3,
+        tail=max_chars // 5,
+    )
+    return f"{prefix}{mark}{output}"
+
+
+def is_tool_result(message: dict) -> bool:
+    content = message.get("content")
+    return message.get("role") == "tool" or (
+        isinstance(content, str) and TOOL_RESULT_MARK in content
+    )
+
+
+def shrink_messages(
+    messages: list[dict], max_result_chars: int = TOOL_RESULT_MAX_CHARS
+) -> list[dict]:
+    """抽取式压缩：不调用 LLM，结果是确定的
+
+    1. 工具结果里的 JSON 去掉缩进，过长的只保留开头和结尾
+    2. 重复出现的长内容只保留最近一次，较早的换成占位说明
+
+    返回新列表，不修改传入的消息。
+    """
+    result: list[dict] = []
+    seen: set[str] = set()
+    # 倒序处理：重复内容保留离当前最近的一份
+    for message in reversed(messages):
+        content = message.get("content")
+        if not isinstance(content, str) or message.get("role") == "system":
+            result.append(message)
+            continue
+        if is_tool_result(message):
+            content = _shrink_tool_result(content, max_result_chars)
+        if len(content) >= DEDUPE_MIN_CHARS:
+            digest = hashlib.sha1(content.encode("utf-8")).hexdigest()
+            if digest in seen:
+                content = "[重复内容已省略，见后文]"
+            seen.add(digest)
+        result.append({**message, "content": content})
+    result.reverse()
+    return result
+
+
+def fit_budget(messages: list[dict], max_tokens: int) -> list[dict]:
+    """从最新的消息往前保留，总 token 数不超过 max_tokens"""
+    counter = get_counter()
+    total = 0
+    start = len(messages)
+    for i in range(len(messages) - 1, -1, -1):
+        tokens = counter.count_messages([messages[i]])
+        if total + tokens > max_tokens:
+            break
+        total += tokens
+        start = i
+    return messages[start:]
+
+
+# ---------- 滚动摘要 ----------
+
+# 分段摘要攒到这么多段时合并进总摘要
+SEGMENT_FANOUT = 4
+
+
+def _summarize(prompt: str, cfg) -> str:
+    from openai_compat import chat_completions
+
+    resp = chat_completions(
+        cfg=cfg,
+        messages=[{"role": "user", "content": prompt}],
+        tools=None,
+        cache=True,
+    )
+    message = (resp.get("choices") or [{}])[0].get("message") or {}
+    return (message.get("content") or "").strip()
+
+
+def summary_message(state: dict) -> dict | None:
+    """把滚动摘要转成一条 system 消息（没有摘要时返回 None）"""
+    parts = [p for p in [state["summary"], *state["segments"]] if p]
+    if not parts:
+        return None
+    return {"role": "system", "content": "[历史摘要] " + "\n".join(parts)}
+
+
+def load_history(store, session_id: str, max_tokens: int) -> list[dict]:
+    """会话历史 = 滚动摘要 + watermark 之后的消息（按 token 预算截取）
+
+    读出的消息先经过抽取式压缩（shrink_messages），数据库里保留原文。
+    预算按压缩后的大小计算：按 HISTORY_FETCH_FACTOR 倍预算读取原文，压缩后
+    截到 max_tokens 以内；预算还没用满且还有更早的消息时加倍读取，
+    压缩省下的空间能放进更早的消息。
+    """
+    state = store.get_summary(session_id)
+    watermark = state["watermark"]
+    pending = store.token_total(session_id, after_id=watermark)
+    fetch = max_tokens * HISTORY_FETCH_FACTOR
+    while True:
+        raw = store.get_within_budget(fetch, session_id, after_id=watermark)
+        history = fit_budget(shrink_messages(raw), max_tokens)
+        # 截掉了较早的消息（预算已用满），或已经读到 watermark
+        if len(history) < len(raw) or fetch >= pending:
+            break
+        fetch *= 2
+    summary = summary_message(state)
+    return [summary, *history] if summary else history
+
+
+def fold_history(store, session_id: str, cfg, keep_tokens: int) -> dict:
+    """把 watermark 之后、最近 keep_tokens 之前的消息折叠进滚动摘要
+
+    只处理 watermark 之后的新消息，压缩成本与新增消息数成正比：
+    1. 新消息生成一段分段摘要
+    2. 分段摘要攒够 SEGMENT_FANOUT 段时，与总摘要合并成新的总摘要
+
+    Returns:
+        更新后的摘要状态 {"summary", "segments", "watermark"}
+    """
+    state = store.get_summary(session_id)
+    watermark = state["watermark"]
+
+    # 最近 keep_tokens 以内的消息保持原样
+    recent = store.get_within_budget(
+        keep_tokens, session_id, after_id=watermark, with_id=True
+    )
+    keep_from = recent[0]["id"] if recent else None
+
+    to_fold = []
+    for m in store.iter_messages(session_id, after_id=watermark, with_id=True):
+        if keep_from is not None and m["id"] >= keep_from:
+            break
+        to_fold.append(m)
+    if not to_fold:
+        return state
+
+    logger.info(
+        f"[压缩] 折叠 {len(to_fold)} 条新消息 "
+        f"(id {to_fold[0]['id']}-{to_fold[-1]['id']}) 到滚动摘要"
+    )
+    # 先做抽取式压缩，同样 500 字里能放进更多有效内容
+    conversation_text = "\n".join(
+        f"{m['role']}: {m['content'][:500]}" for m in shrink_messages(to_fold)
+    )
+    segment = _summarize(
+        f"""请用不超过 100 字总结以下对话的要点（保留关键事实、结论和未完成的事项）：
+
+{conversation_text}
+
+只需返回摘要，不要其他内容。""",
+        cfg,
+    )
+
+    summary = state["summary"]
+    segments = [*state["segments"], segment]
+    if len(segments) >= SEGMENT_FANOUT:
+        logger.info(f"[压缩] 合并 {len(segments)} 段摘要到总摘要")
+        parts = "\n".join(f"- {p}" for p in [summary, *segments] if p)
+        summary = _summarize(
+            f"""以下是同一段对话按时间顺序的多段摘要，请合并成一段不超过 300 字的摘要（保留关键事实、结论和未完成的事项）：
+
+{parts}
+
+只需返回摘要，不要其他内容。""",
+            cfg,
+        )
+        segments = []
+
+    watermark = to_fold[-1]["id"]
+    store.save_summary(session_id, summary, segments, watermark)
+    return {"summary": summary, "segments": segments, "watermark": watermark}
+
+
+def pending_tokens(store, session_id: str) -> int:
+    """watermark 之后尚未折叠的消息 token 数（按当前校准系数换算）"""
+    state = store.get_summary(session_id)
+    raw = store.token_total(session_id, after_id=state["watermark"])
+    return round(raw * get_counter().scale)
+
+
+def fold_if_over(
+    store, session_id: str, cfg, soft_tokens: int, keep_tokens: int
+) -> dict | None:
+    """未折叠的消息超过软阈值时折叠进滚动摘要（供后台压缩调用）
+
+    Returns:
+        折叠后的摘要状态；未超过阈值（或抽取式压缩后已不超过）时返回 None
+    """
+    tokens = pending_tokens(store, session_id)
+    if tokens <= soft_tokens:
+        return None
+    # 抽取式压缩后已经不超过软阈值时不必调用 LLM
+    watermark = store.get_summary(session_id)["watermark"]
+    pending = list(store.iter_messages(session_id, after_id=watermark))
+    shrunk = count_message_tokens(shrink_messages(pending))
+    if shrunk <= soft_tokens:
+        logger.info(
+            f"[压缩] {session_id} 抽取式压缩后 {tokens} -> {shrunk} tokens，无需摘要"
+        )
+        return None
+    logger.info(
+        f"[压缩] 后台压缩: {session_id} 未折叠 {tokens} tokens > 软阈值 {soft_tokens}"
+    )
+    return fold_history(store, session_id, cfg, keep_tokens)
@@ -0,0 +1,99 @@
+"""消息库保留策略 - 过期删除、冷会话归档、空间回收（后台执行）"""
+
+from __future__ import annotations
+
+import os
+import threading
+from dataclasses import dataclass
+
+from loguru import logger
+
+from .message_store import MessageStore
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    """保留策略（0 表示不限制）
+
+    Attributes:
+        max_age_days: 消息最长保留天数
+        max_messages_per_session: 每个会话最多保留的消息数（保留最新的）
+        archive_after_days: 超过这么多天未活跃的会话压缩归档
+        max_db_bytes: 数据库大小上限，超出时从最久未活跃的会话开始归档
+    """
+
+    max_age_days: float = 0
+    max_messages_per_session: int = 0
+    archive_after_days: float = 0
+    max_db_bytes: int = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(
+            self.max_age_days
+            or self.max_messages_per_session
+            or self.archive_after_days
+            or self.max_db_bytes
+        )
+
+    @classmethod
+    def from_env(cls) -> "RetentionPolicy":
+        """从环境变量读取（MESSAGE_MAX_AGE_DAYS 等）"""
+        return cls(
+            max_age_days=float(os.environ.get("MESSAGE_MAX_AGE_DAYS") or 0),
+            max_messages_per_session=int(
+                os.environ.get("MESSAGE_MAX_PER_SESSION") or 0
+            ),
+            archive_after_days=float(os.environ.get("MESSAGE_ARCHIVE_AFTER_DAYS") or 0),
+            max_db_bytes=int(float(os.environ.get("MESSAGE_MAX_DB_MB") or 0) * 2**20),
+        )
+
+
+class Maintenance:
+    """后台维护线程：定期执行保留策略并回收空间，不占用请求路径"""
+
+    def __init__(
+        self,
+        store: MessageStore,
+        policy: RetentionPolicy,
+        interval_s: float = 3600,
+    ):
+        self.store = store
+        self.policy = policy
+        self.interval_s = interval_s
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def run_once(self) -> dict[str, int]:
+        """执行一次保留策略 + 增量 vacuum"""
+        stats = self.store.apply_retention(self.policy)
+        self.store.compact()
+        if any(stats.values()):
+            logger.info(
+                f"[维护] 过期 {stats['expired']} 条, 截断 {stats['trimmed']} 条, "
+                f"归档 {stats['archived']} 条, 丢弃归档 {stats['dropped_archives']} 个"
+            )
+        return stats
+
+    def start(self):
+        """启动后台线程（启动后先执行一次）"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="message-maintenance", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.warning(f"[维护] 执行失败: {e}")
+            self._stop.wait(self.interval_s)
@@ -1,5 +1,6 @@
 """任务队列模块"""
 
 from .task_queue import TaskQueue
+from .worker_pool import run_workers
 
-__all__ = ["TaskQueue"]
+__all__ = ["TaskQueue", "run_workers"]
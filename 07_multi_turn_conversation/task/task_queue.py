@@ -1,38 +1,149 @@
-"""任务队列模块 - 支持多任务连续执行"""
+"""任务队列模块 - 支持多任务连续执行
+
+任务保存在 SQLite 里（WAL），每次状态变化只更新一行：
+- 任务有自增 id，相同内容的任务互不影响
+- (status, id) 索引，取下一个待执行任务不需要扫描全表
+- 领取任务用一条 UPDATE ... RETURNING，多个线程同时领取也不会拿到同一个任务
+- 同一会话同时只有一个任务在执行，不同会话的任务可以并行
+- 领取的任务带租约（lease），执行期间定期续约；进程崩溃后租约过期，
+  任务自动重新排队，超过 max_attempts 次的任务进入死信（dead）
+- 所有状态都在数据库里，同一台机器上的多个进程可以共享一个队列
+"""
 
 from __future__ import annotations
 
 import json
-from pathlib import Path
+import os
+import sqlite3
+import socket
+import threading
+import time
 from dataclasses import dataclass, field
+from pathlib import Path
 from typing import Any
 
+STATUSES = ("pending", "running", "completed", "failed", "dead")
+
+
+def default_queue_path() -> str:
+    """队列库路径：TASK_QUEUE_PATH，未设置时放在 task/ 目录下"""
+    return os.environ.get("TASK_QUEUE_PATH") or str(
+        Path(__file__).parent / "task_queue.db"
+    )
+
 
 @dataclass
 class TaskQueue:
     """任务队列：支持多任务连续执行"""
 
+    db_path: str = field(default_factory=default_queue_path)
+    # 旧版 JSON 队列文件，存在时首次打开自动迁移
     queue_file: Path = field(
         default_factory=lambda: Path(__file__).parent / "task_queue.json"
     )
-    _queue: list[dict[str, Any]] = field(default_factory=list)
+    # 租约时长：超过这个时间没有续约的任务视为执行者已崩溃
+    lease_s: float = 300.0
+    # 每个任务最多执行（领取）的次数，用完后进入死信
+    max_attempts: int = 3
+    # 本进程的执行者标识（多线程时再加上线程序号）
+    worker_id: str = field(
+        default_factory=lambda: f"{socket.gethostname()}:{os.getpid()}"
+    )
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    _local: threading.local = field(default_factory=threading.local, repr=False)
+    _conns: list[sqlite3.Connection] = field(default_factory=list, repr=False)
 
     def __post_init__(self):
-        self._load()
-
-    def _load(self):
-        """从文件加载队列"""
-        if self.queue_file.exists():
-            try:
-                with open(self.queue_file) as f:
-                    self._queue = json.load(f)
-            except json.JSONDecodeError:
-                self._queue = []
-
-    def _save(self):
-        """保存队列到文件"""
-        with open(self.queue_file, "w") as f:
-            json.dump(self._queue, f, ensure_ascii=False, indent=2)
+        self._init_db()
+        self._migrate_json()
+
+    def _conn(self) -> sqlite3.Connection:
+        """当前线程的长连接（首次使用时创建）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    def close(self):
+        """关闭所有线程的连接"""
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            conn.close()
+        self._local = threading.local()
+
+    def _init_db(self):
+        with self._conn() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    task TEXT NOT NULL,
+                    session_id TEXT NOT NULL DEFAULT 'default',
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker TEXT,
+                    lease_until REAL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_tasks_status
+                ON tasks(status, id)
+            """)
+            self._migrate_lease(conn)
+
+    @staticmethod
+    def _migrate_lease(conn: sqlite3.Connection):
+        """旧库补上租约相关的列"""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(tasks)")}
+        if "lease_until" in columns:
+            return
+        conn.execute(
+            "ALTER TABLE tasks ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0"
+        )
+        conn.execute("ALTER TABLE tasks ADD COLUMN worker TEXT")
+        conn.execute("ALTER TABLE tasks ADD COLUMN lease_until REAL")
+        # 旧版 running 的任务没有租约，视为已过期，下次领取时重新排队
+        conn.execute("UPDATE tasks SET lease_until = 0 WHERE status = 'running'")
+
+    def _migrate_json(self):
+        """把旧版 task_queue.json 导入数据库，导入后重命名为 .migrated"""
+        if not self.queue_file.exists():
+            return
+        try:
+            with open(self.queue_file) as f:
+                items = json.load(f)
+        except json.JSONDecodeError:
+            items = []
+        with self._conn() as conn:
+            conn.executemany(
+                "INSERT INTO tasks (task, session_id, status, error) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (
+                        item["task"],
+                        item.get("session_id", "default"),
+                        # 旧版 running 的任务不会再有人完成，重新排队
+                        "pending"
+                        if item.get("status") in (None, "running")
+                        else item["status"],
+                        item.get("error"),
+                    )
+                    for item in items
+                ],
+            )
+        self.queue_file.rename(
+            self.queue_file.with_name(self.queue_file.name + ".migrated")
+        )
+        print(f"[队列] 已从 {self.queue_file.name} 迁移 {len(items)} 个任务")
 
     def add(self, task: str, session_id: str = "default") -> int:
         """
@@ -43,54 +154,166 @@ class TaskQueue:
             session_id: 会话 ID
 
         Returns:
-            队列中的任务数量
+            任务 id
+        """
+        with self._conn() as conn:
+            cursor = conn.execute(
+                "INSERT INTO tasks (task, session_id) VALUES (?, ?)",
+                (task, session_id),
+            )
+        print(f"[队列] 添加任务 #{cursor.lastrowid}: {task[:50]}...")
+        return cursor.lastrowid
+
+    def add_many(self, tasks: list[tuple[str, str]]) -> int:
+        """批量添加 (task, session_id)，在同一个事务里写入
+
+        Returns:
+            添加的任务数
         """
-        self._queue.append(
-            {
-                "task": task,
-                "session_id": session_id,
-                "status": "pending",
-            }
+        with self._conn() as conn:
+            conn.executemany(
+                "INSERT INTO tasks (task, session_id) VALUES (?, ?)", tasks
+            )
+        return len(tasks)
+
+    def _requeue_expired(self, conn: sqlite3.Connection, now: float) -> None:
+        """租约过期的任务重新排队；次数用完的进入死信"""
+        conn.execute(
+            """
+            UPDATE tasks
+            SET status = CASE WHEN attempts >= ? THEN 'dead' ELSE 'pending' END,
+                error = 'lease expired (worker ' || COALESCE(worker, '?') || ')',
+                worker = NULL,
+                lease_until = NULL,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE status = 'running' AND lease_until < ?
+        """,
+            (self.max_attempts, now),
         )
-        self._save()
-        print(f"[队列] 添加任务: {task[:50]}...")
-        return len(self._queue)
-
-    def pop(self) -> dict[str, Any] | None:
-        """取出下一个待执行任务"""
-        for item in self._queue:
-            if item["status"] == "pending":
-                item["status"] = "running"
-                self._save()
-                return item
-        return None
-
-    def complete(self, task: str):
+
+    def pop(self, worker: str | None = None) -> dict[str, Any] | None:
+        """领取下一个待执行任务（原子操作），没有时返回 None
+
+        会话已有任务在执行时跳过该会话的任务，保证同一会话的任务按顺序串行执行。
+        领取的任务持有 lease_s 秒的租约，执行期间需要调用 heartbeat() 续约。
+
+        Args:
+            worker: 执行者标识，默认为 worker_id
+        """
+        worker = worker or self.worker_id
+        now = time.time()
+        # 回收过期租约和领取在同一个事务里，多个进程同时领取也是串行的
+        with self._conn() as conn:
+            self._requeue_expired(conn, now)
+            row = conn.execute(
+                """
+                UPDATE tasks
+                SET status = 'running',
+                    attempts = attempts + 1,
+                    worker = ?,
+                    lease_until = ?,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = (
+                    SELECT id FROM tasks
+                    WHERE status = 'pending'
+                    AND session_id NOT IN (
+                        SELECT session_id FROM tasks WHERE status = 'running'
+                    )
+                    ORDER BY id LIMIT 1
+                )
+                RETURNING id, task, session_id, status, attempts, worker
+            """,
+                (worker, now + self.lease_s),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def heartbeat(self, task_id: int, worker: str | None = None) -> bool:
+        """续约；租约已经过期并被回收时返回 False"""
+        with self._conn() as conn:
+            cursor = conn.execute(
+                """
+                UPDATE tasks SET lease_until = ?
+                WHERE id = ? AND status = 'running' AND worker = ?
+            """,
+                (time.time() + self.lease_s, task_id, worker or self.worker_id),
+            )
+        return cursor.rowcount > 0
+
+    def _finish(
+        self, task_id: int, status: str, error: str | None, worker: str | None
+    ) -> dict | None:
+        # 只有仍持有租约的执行者才能更新任务状态
+        with self._conn() as conn:
+            row = conn.execute(
+                """
+                UPDATE tasks
+                SET status = CASE
+                        WHEN ? = 'pending' AND attempts >= ? THEN 'dead'
+                        ELSE ?
+                    END,
+                    error = ?,
+                    worker = NULL,
+                    lease_until = NULL,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'running' AND worker = ?
+                RETURNING task, status
+            """,
+                (
+                    status,
+                    self.max_attempts,
+                    status,
+                    error,
+                    task_id,
+                    worker or self.worker_id,
+                ),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def complete(self, task_id: int, worker: str | None = None):
         """标记任务完成"""
-        for item in self._queue:
-            if item["task"] == task:
-                item["status"] = "completed"
-                self._save()
-                print(f"[队列] 完成任务: {item['task'][:50]}...")
-                break
-
-    def fail(self, task: str, error: str):
-        """标记任务失败"""
-        for item in self._queue:
-            if item["task"] == task:
-                item["status"] = "failed"
-                item["error"] = error
-                self._save()
-                print(f"[队列] 任务失败: {item['task'][:50]}... 错误: {error}")
-                break
+        row = self._finish(task_id, "completed", None, worker)
+        if row is None:
+            print(f"[队列] 任务 #{task_id} 的租约已失效，忽略完成状态")
+            return
+        print(f"[队列] 完成任务 #{task_id}: {row['task'][:50]}...")
+
+    def fail(
+        self, task_id: int, error: str, worker: str | None = None, retry: bool = False
+    ):
+        """标记任务失败
+
+        Args:
+            retry: 暂时性错误传 True：执行次数未达到 max_attempts 时重新排队，
+                用完后进入死信；默认 False，直接标记为 failed
+        """
+        row = self._finish(task_id, "pending" if retry else "failed", error, worker)
+        if row is None:
+            print(f"[队列] 任务 #{task_id} 的租约已失效，忽略失败状态")
+            return
+        action = {"pending": "重新排队", "dead": "进入死信"}.get(row["status"], "失败")
+        print(f"[队列] 任务{action} #{task_id}: {row['task'][:50]}... 错误: {error}")
 
     def has_pending(self) -> bool:
-        """检查是否有待执行任务"""
-        return any(item["status"] == "pending" for item in self._queue)
+        """检查是否有待执行任务（包括租约已过期、等待重新排队的任务）"""
+        row = self._conn().execute(
+            """
+            SELECT EXISTS(
+                SELECT 1 FROM tasks
+                WHERE status = 'pending'
+                OR (status = 'running' AND lease_until < ?)
+            )
+        """,
+            (time.time(),),
+        ).fetchone()
+        return bool(row[0])
 
     def list_tasks(self) -> list[dict[str, Any]]:
         """列出所有任务"""
-        return self._queue.copy()
+        rows = self._conn().execute(
+            "SELECT id, task, session_id, status, error, attempts, worker "
+            "FROM tasks ORDER BY id"
+        ).fetchall()
+        return [dict(row) for row in rows]
 
     def clear(self, status: str | None = None):
         """
@@ -99,17 +322,19 @@ class TaskQueue:
         Args:
             status: 如果指定，只清空指定状态的任务
         """
-        if status is None:
-            self._queue = []
-        else:
-            self._queue = [item for item in self._queue if item["status"] != status]
-        self._save()
+        with self._conn() as conn:
+            if status is None:
+                conn.execute("DELETE FROM tasks")
+            else:
+                conn.execute("DELETE FROM tasks WHERE status = ?", (status,))
 
     def get_stats(self) -> dict[str, int]:
         """获取队列统计"""
-        stats = {"pending": 0, "running": 0, "completed": 0, "failed": 0}
-        for item in self._queue:
-            status = item.get("status", "pending")
+        stats = dict.fromkeys(STATUSES, 0)
+        rows = self._conn().execute(
+            "SELECT status, COUNT(*) FROM tasks GROUP BY status"
+        ).fetchall()
+        for status, count in rows:
             if status in stats:
-                stats[status] += 1
+                stats[status] = count
         return stats
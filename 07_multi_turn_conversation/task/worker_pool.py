@@ -0,0 +1,131 @@
+"""并发执行队列任务 - 同一会话的任务串行，不同会话的任务并行"""
+
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from .task_queue import TaskQueue
+
+# openai 的连接 / 超时 / 限流 / 5xx 错误（按类名判断，不直接依赖 openai 包）
+_TRANSIENT_API_ERRORS = {
+    "APIConnectionError",
+    "APITimeoutError",
+    "RateLimitError",
+    "InternalServerError",
+}
+
+
+def is_transient(error: Exception) -> bool:
+    """只有网络、数据库繁忙这类暂时性错误才值得重试
+
+    MaxStepsExceeded、参数错误等确定性失败重试也一样失败，直接标记为 failed。
+    """
+    if isinstance(error, (OSError, sqlite3.OperationalError)):
+        return True
+    if type(error).__name__ in _TRANSIENT_API_ERRORS:
+        return True
+    # 包装过的异常（如消息写入失败）按原始原因判断
+    cause = error.__cause__
+    return cause is not None and is_transient(cause)
+
+
+class _Heartbeat:
+    """后台线程定期为正在执行的任务续约"""
+
+    def __init__(self, queue: TaskQueue, interval_s: float):
+        self.queue = queue
+        self.interval_s = interval_s
+        # task_id -> worker
+        self._held: dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="queue-heartbeat", daemon=True
+        )
+        self._thread.start()
+
+    def hold(self, task_id: int, worker: str) -> None:
+        with self._lock:
+            self._held[task_id] = worker
+
+    def release(self, task_id: int) -> None:
+        with self._lock:
+            self._held.pop(task_id, None)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            with self._lock:
+                held = list(self._held.items())
+            for task_id, worker in held:
+                try:
+                    if not self.queue.heartbeat(task_id, worker):
+                        print(f"[队列] 任务 #{task_id} 的租约已失效")
+                        self.release(task_id)
+                except Exception as e:
+                    print(f"[队列] 任务 #{task_id} 续约失败: {e}")
+
+
+def run_workers(
+    queue: TaskQueue,
+    handle: Callable[[dict[str, Any]], None],
+    workers: int = 1,
+    poll_interval_s: float = 0.2,
+    retryable: Callable[[Exception], bool] = is_transient,
+) -> None:
+    """用 workers 个线程执行队列中的任务，直到没有待执行任务
+
+    任务大部分时间在等待 LLM 响应，用线程就能让吞吐随 worker 数近似线性增长。
+    同一会话的串行由 TaskQueue.pop() 保证；执行期间每 lease_s / 3 续约一次，
+    进程崩溃时租约过期，任务由其他进程（或下次运行）重新领取。
+    多个进程可以同时对同一个队列调用 run_workers。
+
+    Args:
+        queue: 任务队列
+        handle: 执行单个任务；返回后任务立即标记为完成，结果要在返回前落盘。
+            抛出暂时性错误时任务重试，次数用完后进入死信，其他异常直接标记为 failed
+        workers: 并发的 worker 数
+        poll_interval_s: 剩余任务都在等待同会话的任务时，重新领取的间隔
+        retryable: 判断异常是否值得重试
+    """
+    heartbeat = _Heartbeat(queue, interval_s=queue.lease_s / 3)
+
+    def worker(index: int) -> None:
+        name = f"{queue.worker_id}/{index}"
+        while True:
+            task_info = queue.pop(worker=name)
+            if task_info is None:
+                # 剩下的任务所在的会话正被其他 worker 执行，稍后再领取
+                if queue.has_pending():
+                    time.sleep(poll_interval_s)
+                    continue
+                return
+            task_id = task_info["id"]
+            heartbeat.hold(task_id, name)
+            try:
+                handle(task_info)
+                heartbeat.release(task_id)
+                queue.complete(task_id, worker=name)
+            except Exception as e:
+                heartbeat.release(task_id)
+                queue.fail(task_id, str(e), worker=name, retry=retryable(e))
+                print(f"[错误] {e}")
+
+    try:
+        if workers <= 1:
+            worker(0)
+            return
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="queue"
+        ) as pool:
+            for future in [pool.submit(worker, i) for i in range(workers)]:
+                future.result()
+    finally:
+        heartbeat.stop()
@@ -2,6 +2,7 @@
 
 from __future__ import annotations
 
+import asyncio
 import json
 from dataclasses import dataclass
 from pathlib import Path
@@ -14,7 +15,7 @@ import sys
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "lib"))
 
 from env import find_and_load_env
-from openai_compat import chat_completions, load_config_from_env
+from openai_compat import aclose_clients, chat_completions, load_config_from_env
 from log import init_logger, format_json
 
 from tools.registry import TOOL_REGISTRY as BASE_TOOL_REGISTRY
@@ -100,6 +101,33 @@ class MiniManusAgent:
         logger.info("*" * 60)
         logger.info(result)
 
+    async def arun(self, *, task: str, session_id: str = "default") -> str:
+        """异步运行：同一进程内可以并发服务多个会话"""
+        find_and_load_env()
+        cfg = load_config_from_env()
+
+        coordinator = create_multi_agent_system(cfg)
+        logger.info(f"[{session_id}] 已注册 Agent: {coordinator.list_agents()}")
+
+        result = await coordinator.adispatch(task)
+
+        logger.info(f"[{session_id}] 最终答案")
+        logger.info(result)
+        return result
+
+    def run_async(self, *, task: str, session_id: str = "default") -> None:
+        """在新事件循环中执行 arun（命令行入口使用）"""
+        if self.log_dir:
+            init_logger(self.log_dir)
+
+        async def _main() -> None:
+            try:
+                await self.arun(task=task, session_id=session_id)
+            finally:
+                await aclose_clients()
+
+        asyncio.run(_main())
+
 
 # 兼容旧接口
 MiniManus = MiniManusAgent
@@ -22,6 +22,12 @@ def main() -> int:
         default=None,
         help="Directory for log files (default: ./logs in lesson dir).",
     )
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="Use the async coordinator (subtasks run concurrently).",
+    )
     args = parser.parse_args()
 
     # 设置日志目录
@@ -31,7 +37,10 @@ def main() -> int:
         log_dir = Path(__file__).parent / "logs"
 
     agent = MiniManus(max_steps=args.max_steps, log_dir=log_dir)
-    agent.run(task=args.task)
+    if args.use_async:
+        agent.run_async(task=args.task)
+    else:
+        agent.run(task=args.task)
     return 0
 
 
@@ -0,0 +1,72 @@
+"""后台压缩 - 把上下文压缩移出请求的关键路径
+
+一轮对话结束后，在后台线程里把超过软阈值的历史折叠进滚动摘要，
+下一轮直接读取算好的摘要；只有历史超过硬上限时才在请求内同步压缩。
+"""
+
+from __future__ import annotations
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+from loguru import logger
+
+
+class BackgroundCompressor:
+    """后台压缩任务执行器（同一会话同时最多一个任务）
+
+    Args:
+        max_workers: 后台线程数（摘要调用 LLM，一般 1 个就够）
+    """
+
+    def __init__(self, max_workers: int = 1):
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="compress"
+        )
+        self._pending: dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def submit(
+        self, session_id: str, fn: Callable[..., Any], *args: Any
+    ) -> Future | None:
+        """提交一个会话的压缩任务；该会话已有任务在排队或执行时返回 None"""
+        with self._lock:
+            future = self._pending.get(session_id)
+            if future is not None and not future.done():
+                return None
+            future = self._pool.submit(self._run, session_id, fn, *args)
+            self._pending[session_id] = future
+        future.add_done_callback(lambda f: self._discard(session_id, f))
+        return future
+
+    def wait(self, session_id: str, timeout: float | None = None) -> None:
+        """等待会话正在进行的压缩完成（同步压缩前调用，避免重复摘要）"""
+        with self._lock:
+            future = self._pending.get(session_id)
+        if future is not None:
+            future.result(timeout=timeout)
+
+    def busy(self, session_id: str) -> bool:
+        """会话是否有压缩任务在排队或执行"""
+        with self._lock:
+            future = self._pending.get(session_id)
+        return future is not None and not future.done()
+
+    def shutdown(self, wait: bool = True) -> None:
+        """停止接收新任务；wait=True 时等待已提交的任务完成"""
+        self._pool.shutdown(wait=wait)
+
+    @staticmethod
+    def _run(session_id: str, fn: Callable[..., Any], *args: Any) -> Any:
+        try:
+            return fn(*args)
+        except Exception as e:
+            # 后台失败不影响对话：下一轮超过硬上限时会同步压缩
+            logger.warning(f"[压缩] 后台压缩失败 ({session_id}): {e}")
+            return None
+
+    def _discard(self, session_id: str, future: Future) -> None:
+        with self._lock:
+            if self._pending.get(session_id) is future:
+                del self._pending[session_id]
@@ -4,14 +4,16 @@ from dataclasses import dataclass, field
 from typing import Optional
 from loguru import logger
 
-import json
+import asyncio
+import re
 from pathlib import Path
 
 import sys
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent / "lib"))
 
-from openai_compat import chat_completions, load_config_from_env
+from agent_loop import AgentLoop, MaxStepsExceeded, ToolOutcome
+from openai_compat import achat_completions, chat_completions, load_config_from_env
 
 
 @dataclass
@@ -48,84 +50,104 @@ class MiniManus:
         # 构建消息
         messages = self._build_messages(task, context)
 
-        # 获取工具 schema
-        tools = [tool.schema() for tool in self.tools_registry.values()]
+        def execute_tool(name: str, args: dict) -> tuple[bool, str]:
+            # 检查是否是请求协调器（唯一允许的跨 Agent 通讯方式）
+            if name == "request_help":
+                return False, self._request_help(args, messages)
+            return self._execute_tool(name, args)
 
-        # Agent Loop
-        for step in range(1, self.max_steps + 1):
-            resp = chat_completions(
-                cfg=self.cfg,
-                messages=messages,
-                tools=tools if tools else None,
-                tool_choice="auto",
-            )
+        try:
+            result = self._loop(execute_tool=execute_tool).run(messages)
+        except MaxStepsExceeded:
+            return "任务超时"
+
+        logger.info(f"[{self.spec.name}] 任务完成")
+        return result.output
+
+    async def arun(self, task: str, context: list[dict] | None = None) -> str:
+        """执行任务（异步版本）
+
+        LLM 调用走 achat_completions，同步工具放到线程池执行，
+        这样多个 Agent / 多个会话可以在同一个事件循环里并发。
+        """
+
+        logger.info(f"[{self.spec.name}] 开始处理任务: {task[:50]}...")
+
+        messages = self._build_messages(task, context)
 
-            msg = (resp.get("choices") or [{}])[0].get("message") or {}
-            tool_calls = msg.get("tool_calls") or []
-            content = (msg.get("content") or "").strip()
-
-            if tool_calls:
-                for call in tool_calls:
-                    fn = call.get("function") or {}
-                    name = fn.get("name", "")
-                    raw_args = fn.get("arguments", "{}")
-
-                    try:
-                        args = (
-                            json.loads(raw_args)
-                            if isinstance(raw_args, str)
-                            else dict(raw_args)
-                        )
-                    except:
-                        args = {}
-
-                    # 检查是否是请求协调器（唯一允许的跨 Agent 通讯方式）
-                    if name == "request_help":
-                        # 请求协调器转交给其他 Agent
-                        target_agent = args.get("agent", "")
-                        task_desc = args.get("task", "")
-                        logger.info(
-                            f"[{self.spec.name}] 请求协调器转交给 {target_agent}"
-                        )
-
-                        # 通过协调器执行子任务
-                        result = self.coordinator.handoff(
-                            from_agent=self.name,
-                            to_agent=target_agent,
-                            task=task_desc,
-                            context=messages,
-                        )
-
-                        # 将结果添加到上下文
-                        messages.append(
-                            {"role": "user", "content": f"[协调器返回]: {result}"}
-                        )
-                        continue
-
-                    # 执行普通工具
-                    tool = self.tools_registry.get(name)
-                    if tool:
-                        should_stop, output = tool.execute(**args)
-                    else:
-                        output = f"Unknown tool: {name}"
-                        should_stop = False
-
-                    tool_result = (
-                        f"[TOOL_CALL {name}] {json.dumps(args)}\n[TOOL_RESULT] {output}"
-                    )
-                    messages.append({"role": "user", "content": tool_result})
-
-                    if should_stop:
-                        logger.info(f"[{self.spec.name}] 任务完成")
-                        return output
-
-                continue
-
-            if content:
-                logger.info(f"[{self.spec.name}] 任务完成")
-                return content
-
-        return "任务超时"
+        def execute_tool(name: str, args: dict) -> tuple[bool, str]:
+            return self._execute_tool(name, args)
+
+        async def aexecute_tool(name: str, args: dict) -> tuple[bool, str]:
+            if name == "request_help":
+                return False, await self._arequest_help(args, messages)
+            return await asyncio.to_thread(self._execute_tool, name, args)
+
+        loop = self._loop(execute_tool=execute_tool, aexecute_tool=aexecute_tool)
+        try:
+            result = await loop.arun(messages)
+        except MaxStepsExceeded:
+            return "任务超时"
+
+        logger.info(f"[{self.spec.name}] 任务完成")
+        return result.output
+
+    def _loop(self, **kwargs) -> AgentLoop:
+        """构建本次任务的 Agent Loop"""
+        return AgentLoop(
+            cfg=self.cfg,
+            tools=[tool.schema() for tool in self.tools_registry.values()],
+            parallel_safe=self._parallel_safe,
+            max_steps=self.max_steps,
+            strict_args=False,
+            verbose=False,
+            post_tool=self._post_tool,
+            **kwargs,
+        )
+
+    @staticmethod
+    def _post_tool(outcome: ToolOutcome, messages: list[dict]) -> dict | None:
+        if outcome.call.name == "request_help":
+            # 将结果添加到上下文
+            return {"role": "user", "content": f"[协调器返回]: {outcome.output}"}
+        return None
+
+    def _parallel_safe(self, name: str) -> bool:
+        tool = self.tools_registry.get(name)
+        return bool(tool and tool.parallel_safe)
+
+    def _execute_tool(self, name: str, args: dict) -> tuple[bool, str]:
+        """执行普通工具"""
+        tool = self.tools_registry.get(name)
+        if tool:
+            return tool.execute(**args)
+        return False, f"Unknown tool: {name}"
+
+    def _request_help(self, args: dict, messages: list[dict]) -> str:
+        """请求协调器转交给其他 Agent"""
+        target_agent = args.get("agent", "")
+        task_desc = args.get("task", "")
+        logger.info(f"[{self.spec.name}] 请求协调器转交给 {target_agent}")
+
+        # 通过协调器执行子任务
+        return self.coordinator.handoff(
+            from_agent=self.name,
+            to_agent=target_agent,
+            task=task_desc,
+            context=messages,
+        )
+
+    async def _arequest_help(self, args: dict, messages: list[dict]) -> str:
+        target_agent = args.get("agent", "")
+        task_desc = args.get("task", "")
+        logger.info(f"[{self.spec.name}] 请求协调器转交给 {target_agent}")
+
+        return await self.coordinator.ahandoff(
+            from_agent=self.name,
+            to_agent=target_agent,
+            task=task_desc,
+            context=messages,
+        )
 
     def _build_messages(
         self, task: str, context: list[dict] | None = None
@@ -172,6 +194,16 @@ class Coordinator:
         else:
             return self._dispatch_direct(task)
 
+    async def adispatch(self, task: str) -> str:
+        """分发主任务 - 异步入口（子任务并发执行）"""
+
+        logger.info(f"[Coordinator] 收到主任务: {task[:50]}...")
+
+        if await self._aneed_decompose(task):
+            return await self._adispatch_with_decompose(task)
+        else:
+            return await self._adispatch_direct(task)
+
     def handoff(
         self, from_agent: str, to_agent: str, task: str, context: list[dict]
     ) -> str:
@@ -193,6 +225,23 @@ class Coordinator:
         logger.info(f"[Coordinator] 子任务完成，返回给 {from_agent}")
         return result
 
+    async def ahandoff(
+        self, from_agent: str, to_agent: str, task: str, context: list[dict]
+    ) -> str:
+        """处理 Agent 之间的交接（异步版本）"""
+
+        logger.info(f"[Coordinator] 交接: {from_agent} -> {to_agent}")
+
+        target = self.agents.get(to_agent)
+        if not target:
+            return f"错误：Agent {to_agent} 不存在"
+
+        ctx = [m for m in context if m.get("role") != "system"]
+        result = await target.arun(task, context=ctx)
+
+        logger.info(f"[Coordinator] 子任务完成，返回给 {from_agent}")
+        return result
+
     def _dispatch_direct(self, task: str) -> str:
         """直接分发（单一 Agent）"""
 
@@ -205,6 +254,18 @@ class Coordinator:
 
         return "没有 Agent 可以处理这个任务"
 
+    async def _adispatch_direct(self, task: str) -> str:
+        """直接分发（异步版本）"""
+
+        agent_name = await self._aselect_agent(task)
+        agent = self.agents.get(agent_name)
+
+        if agent:
+            logger.info(f"[Coordinator] 分发给: {agent_name}")
+            return await agent.arun(task)
+
+        return "没有 Agent 可以处理这个任务"
+
     def _dispatch_with_decompose(self, task: str) -> str:
         """分解任务后分发"""
 
@@ -229,75 +290,78 @@ class Coordinator:
         # 合并结果
         return self._merge_results(task, results)
 
-    def _need_decompose(self, task: str) -> bool:
-        """判断是否需要分解任务"""
+    async def _adispatch_with_decompose(self, task: str) -> str:
+        """分解任务后分发（异步版本：各子任务并发执行，结果保持原顺序）"""
 
-        prompt = f"""判断以下任务是否需要分解为多个子任务才能完成。
-如果需要不同专业能力的子任务，回答"需要"。如果一个 Agent 能完成，回答"不需要"。
+        subtasks = await self._adecompose_task(task)
+        logger.info(f"[Coordinator] 任务分解为 {len(subtasks)} 个子任务（并发执行）")
 
-任务：{task}
+        async def run_subtask(i: int, subtask: str) -> dict | None:
+            logger.info(
+                f"[Coordinator] 执行子任务 {i + 1}/{len(subtasks)}: {subtask[:30]}..."
+            )
+            agent_name = await self._aselect_agent(subtask)
+            agent = self.agents.get(agent_name)
+            if not agent:
+                return None
+            result = await agent.arun(subtask)
+            logger.info(f"[Coordinator] 子任务 {i + 1} 完成")
+            return {"task": subtask, "agent": agent_name, "result": result}
+
+        gathered = await asyncio.gather(
+            *(run_subtask(i, subtask) for i, subtask in enumerate(subtasks))
+        )
+        results = [r for r in gathered if r is not None]
 
-只需要回答"需要"或"不需要"。"""
+        return await self._amerge_results(task, results)
 
+    def _ask(self, prompt: str) -> str:
+        """单轮问答（无工具）：路由 / 分解 / 合并，同样的输入可以走缓存"""
         response = chat_completions(
             cfg=self.cfg,
             messages=[{"role": "user", "content": prompt}],
             tools=None,
+            cache=True,
         )
+        return _content_of(response)
 
-        content = (
-            (response.get("choices") or [{}])[0]
-            .get("message", {})
-            .get("content", "")
-            .strip()
-        )
-        return "需要" in content
-
-    def _decompose_task(self, task: str) -> list[str]:
-        """分解任务"""
-
-        prompt = f"""将以下任务分解为多个子任务，每个子任务由一个专业 Agent 独立完成。
-列出子任务，每行一个。
-
-任务：{task}
-
-只需要返回子任务列表。"""
-
-        response = chat_completions(
+    async def _aask(self, prompt: str) -> str:
+        """单轮问答（异步版本）"""
+        response = await achat_completions(
             cfg=self.cfg,
             messages=[{"role": "user", "content": prompt}],
             tools=None,
+            cache=True,
         )
+        return _content_of(response)
 
-        content = (
-            (response.get("choices") or [{}])[0]
-            .get("message", {})
-            .get("content", "")
-            .strip()
-        )
+    def _need_decompose(self, task: str) -> bool:
+        """判断是否需要分解任务"""
+        return "需要" in self._ask(_need_decompose_prompt(task))
 
-        # 解析子任务
-        lines = [line.strip() for line in content.split("\n") if line.strip()]
-        # 过滤掉可能的编号
-        subtasks = []
-        for line in lines:
-            # 去掉 "1." "2." 等前缀
-            import re
+    async def _aneed_decompose(self, task: str) -> bool:
+        return "需要" in await self._aask(_need_decompose_prompt(task))
 
-            cleaned = re.sub(r"^\d+[.)]\s*", "", line)
-            if cleaned:
-                subtasks.append(cleaned)
+    def _decompose_task(self, task: str) -> list[str]:
+        """分解任务"""
+        return _parse_subtasks(self._ask(_decompose_prompt(task)), task)
 
-        return subtasks if subtasks else [task]
+    async def _adecompose_task(self, task: str) -> list[str]:
+        return _parse_subtasks(await self._aask(_decompose_prompt(task)), task)
 
     def _select_agent(self, task: str) -> str:
         """为任务选择合适的 Agent"""
+        return self._match_agent(self._ask(self._select_agent_prompt(task)))
+
+    async def _aselect_agent(self, task: str) -> str:
+        return self._match_agent(await self._aask(self._select_agent_prompt(task)))
 
+    def _select_agent_prompt(self, task: str) -> str:
         options = "\n".join(
             [f"- {name}: {agent.spec.specialty}" for name, agent in self.agents.items()]
         )
 
-        prompt = f"""从以下 Agent 选择最合适的一个来处理这个任务。
+        return f"""从以下 Agent 选择最合适的一个来处理这个任务。
 
 {options}
 
@@ -305,19 +369,8 @@ class Coordinator:
 
 只需要返回 Agent 名称。"""
 
-        response = chat_completions(
-            cfg=self.cfg,
-            messages=[{"role": "user", "content": prompt}],
-            tools=None,
-        )
-
-        content = (
-            (response.get("choices") or [{}])[0]
-            .get("message", {})
-            .get("content", "")
-            .strip()
-        )
-
+    def _match_agent(self, content: str) -> str:
+        """从 LLM 回复中匹配 Agent 名称"""
         for name in self.agents.keys():
             if name in content:
                 return name
@@ -330,37 +383,76 @@ class Coordinator:
         if len(results) == 1:
             return results[0]["result"]
 
-        combined = "\n\n".join(
-            [
-                f"## 子任务 {i + 1}: {r['task']}\n({r['agent']} 完成)\n\n{r['result']}"
-                for i, r in enumerate(results)
-            ]
-        )
+        return self._ask(_merge_prompt(original_task, results))
 
-        prompt = f"""原始任务：{original_task}
+    async def _amerge_results(self, original_task: str, results: list[dict]) -> str:
+        if len(results) == 1:
+            return results[0]["result"]
 
-以下是各子任务的结果：
+        return await self._aask(_merge_prompt(original_task, results))
 
-{combined}
+    def list_agents(self) -> list[str]:
+        """列出所有 Agent"""
+        return [f"{name} ({a.spec.specialty})" for name, a in self.agents.items()]
 
-请综合给出最终答案。"""
 
-        response = chat_completions(
-            cfg=self.cfg,
-            messages=[{"role": "user", "content": prompt}],
-            tools=None,
-        )
+def _content_of(response: dict) -> str:
+    """提取 LLM 回复文本"""
+    return (
+        (response.get("choices") or [{}])[0]
+        .get("message", {})
+        .get("content", "")
+        .strip()
+    )
 
-        return (
-            (response.get("choices") or [{}])[0]
-            .get("message", {})
-            .get("content", "")
-            .strip()
-        )
 
-    def list_agents(self) -> list[str]:
-        """列出所有 Agent"""
-        return [f"{name} ({a.spec.specialty})" for name, a in self.agents.items()]
+def _need_decompose_prompt(task: str) -> str:
+    return f"""判断以下任务是否需要分解为多个子任务才能完成。
+如果需要不同专业能力的子任务，回答"需要"。如果一个 Agent 能完成，回答"不需要"。
+
+任务：{task}
+
+只需要回答"需要"或"不需要"。"""
+
+
+def _decompose_prompt(task: str) -> str:
+    return f"""将以下任务分解为多个子任务，每个子任务由一个专业 Agent 独立完成。
+列出子任务，每行一个。
+
+任务：{task}
+
+只需要返回子任务列表。"""
+
+
+def _parse_subtasks(content: str, task: str) -> list[str]:
+    """解析子任务列表"""
+    lines = [line.strip() for line in content.split("\n") if line.strip()]
+    # 过滤掉可能的编号
+    subtasks = []
+    for line in lines:
+        # 去掉 "1." "2." 等前缀
+        cleaned = re.sub(r"^\d+[.)]\s*", "", line)
+        if cleaned:
+            subtasks.append(cleaned)
+
+    return subtasks if subtasks else [task]
+
+
+def _merge_prompt(original_task: str, results: list[dict]) -> str:
+    combined = "\n\n".join(
+        [
+            f"## 子任务 {i + 1}: {r['task']}\n({r['agent']} 完成)\n\n{r['result']}"
+            for i, r in enumerate(results)
+        ]
+    )
+
+    return f"""原始任务：{original_task}
+
+以下是各子任务的结果：
+
+{combined}
+
+请综合给出最终答案。"""
 
 
 __all__ = ["AgentSpec", "MiniManus", "Coordinator"]
@@ -20,6 +20,10 @@ class SearchTool(BaseTool):
     def description(self) -> str:
         return "Search the web for current information. Use this when you need to look up recent events, facts, or any information that may not be in the model's training data."
 
+    @property
+    def parallel_safe(self) -> bool:
+        return True
+
     def _parameters_schema(self) -> dict[str, Any]:
         return {
             "type": "object",
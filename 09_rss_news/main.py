@@ -1,6 +1,7 @@
 """Lesson 09: RSS News Agent - 入口"""
 
 import argparse
+import asyncio
 import sys
 from pathlib import Path
 
@@ -8,7 +9,7 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "lib"))
 
 from env import find_and_load_env
-from openai_compat import load_config_from_env
+from openai_compat import aclose_clients, load_config_from_env
 from log import init_logger
 from loguru import logger
 
@@ -20,6 +21,12 @@ def main():
     parser.add_argument("--task", default="生成今日AI新闻简报", help="任务描述")
     parser.add_argument("--max-steps", type=int, default=20, help="最大步数")
     parser.add_argument("--log-dir", type=str, default=None, help="日志目录")
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="使用异步协调器（子任务并发执行）",
+    )
     args = parser.parse_args()
 
     # 日志目录
@@ -38,7 +45,17 @@ def main():
     logger.info(f"已注册 Agent: {coordinator.list_agents()}")
 
     # 执行任务
-    result = coordinator.dispatch(args.task)
+    if args.use_async:
+
+        async def _run() -> str:
+            try:
+                return await coordinator.adispatch(args.task)
+            finally:
+                await aclose_clients()
+
+        result = asyncio.run(_run())
+    else:
+        result = coordinator.dispatch(args.task)
 
     logger.info("*" * 60)
     logger.info("* 最终答案")
@@ -1,5 +1,15 @@
 """消息存储：SQLite - 支持会话管理"""
 
-from .message_store import MessageStore
+from .background import BackgroundCompressor
+from .message_store import MessageStore, default_db_path
+from .retention import Maintenance, RetentionPolicy
+from .writer import BufferedWriter
 
-__all__ = ["MessageStore"]
+__all__ = [
+    "MessageStore",
+    "BufferedWriter",
+    "BackgroundCompressor",
+    "RetentionPolicy",
+    "Maintenance",
+    "default_db_path",
+]
@@ -0,0 +1,164 @@
+"""Token 计数 - 优先使用 tokenizer，缺失时按字符启发式估算
+
+- 每条内容的计数按文本哈希缓存，重复判断是否需要压缩时不再重新分词
+- 用 API 返回的 usage.prompt_tokens 校准估算值（指数滑动平均）
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+from typing import Any
+
+from loguru import logger
+
+# 每条消息的格式开销（role、分隔符等）
+MESSAGE_OVERHEAD = 4
+
+
+def _is_cjk(ch: str) -> bool:
+    code = ord(ch)
+    return (
+        0x4E00 <= code <= 0x9FFF  # CJK 统一汉字
+        or 0x3400 <= code <= 0x4DBF  # 扩展 A
+        or 0x3000 <= code <= 0x303F  # CJK 标点
+        or 0xFF00 <= code <= 0xFFEF  # 全角字符
+        or 0x3040 <= code <= 0x30FF  # 日文假名
+        or 0xAC00 <= code <= 0xD7AF  # 韩文
+    )
+
+
+def heuristic_tokens(text: str) -> int:
+    """字符启发式：CJK 字符约 1 token / 字，其余约 4 字符 / token"""
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if _is_cjk(ch))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def _load_encoding(name: str):
+    """加载 tiktoken 编码；未安装或加载失败时返回 None"""
+    try:
+        import tiktoken
+    except ImportError:
+        logger.warning("[Token] 未安装 tiktoken，使用字符估算（uv sync 安装依赖）")
+        return None
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        logger.warning(f"[Token] 加载编码 {name} 失败，使用字符估算: {e}")
+        return None
+
+
+class TokenCounter:
+    """Token 计数器
+
+    Args:
+        encoding: tiktoken 编码名（TOKENIZER_ENCODING，默认 cl100k_base）
+        cache_size: 按文本缓存的条目上限
+    """
+
+    def __init__(self, encoding: str | None = None, cache_size: int = 4096):
+        self.encoding_name = encoding or os.environ.get(
+            "TOKENIZER_ENCODING", "cl100k_base"
+        )
+        self.cache_size = cache_size
+        # 校准系数：实际 prompt_tokens / 估算值
+        self.scale = 1.0
+        self._encoding = None
+        self._encoding_loaded = False
+        # 文本摘要 -> 计数（只存摘要，不让整段工具输出常驻内存）
+        self._cache: OrderedDict[bytes, int] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _raw_count(self, text: str) -> int:
+        if not self._encoding_loaded:
+            self._encoding = _load_encoding(self.encoding_name)
+            self._encoding_loaded = True
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return heuristic_tokens(text)
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def _cached(self, text: str) -> int:
+        key = self._key(text)
+        with self._lock:
+            n = self._cache.get(key)
+            if n is not None:
+                self._cache.move_to_end(key)
+                return n
+        n = self._raw_count(text)
+        self._store(key, n)
+        return n
+
+    def prime(self, text: str, tokens: int) -> None:
+        """写入已知的计数（例如从数据库恢复的消息），避免重新分词"""
+        self._store(self._key(text), tokens)
+
+    def _store(self, key: bytes, tokens: int) -> None:
+        with self._lock:
+            self._cache[key] = tokens
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def raw_message_tokens(self, message: dict[str, Any]) -> int:
+        """单条消息的未校准计数（持久化时保存这个值）"""
+        content = message.get("content") or ""
+        if not isinstance(content, str):
+            content = json.dumps(content, ensure_ascii=False)
+        return self._cached(content) + MESSAGE_OVERHEAD
+
+    def count_text(self, text: str) -> int:
+        """文本的 token 数（已校准）"""
+        return round(self._cached(text or "") * self.scale)
+
+    def count_messages(self, messages: list[dict[str, Any]]) -> int:
+        """消息列表的 token 数（已校准）"""
+        raw = sum(self.raw_message_tokens(m) for m in messages)
+        return round(raw * self.scale)
+
+    def calibrate(
+        self,
+        messages: list[dict[str, Any]],
+        usage: dict[str, Any] | None,
+        tools: list[dict[str, Any]] | None = None,
+        alpha: float = 0.2,
+    ) -> None:
+        """用 API 返回的 prompt_tokens 校准估算（工具 schema 也计入 prompt）"""
+        actual = (usage or {}).get("prompt_tokens")
+        if not actual:
+            return
+        raw = sum(self.raw_message_tokens(m) for m in messages)
+        if tools:
+            raw += self._cached(json.dumps(tools, ensure_ascii=False, sort_keys=True))
+        if raw <= 0:
+            return
+        ratio = actual / raw
+        # 单次偏差过大多半是异常数据，限制在合理范围内
+        ratio = min(max(ratio, 0.25), 4.0)
+        self.scale = (1 - alpha) * self.scale + alpha * ratio
+        logger.debug(
+            f"[Token] 校准: 估算 {raw} / 实际 {actual}，系数 -> {self.scale:.3f}"
+        )
+
+
+_default: TokenCounter | None = None
+_default_lock = threading.Lock()
+
+
+def get_counter() -> TokenCounter:
+    """进程共享的计数器（校准结果在多次运行之间保留）"""
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = TokenCounter()
+    return _default
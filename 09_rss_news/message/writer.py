@@ -0,0 +1,150 @@
+"""缓冲写入 - 多个会话的消息合并成一次提交（group commit）"""
+
+from __future__ import annotations
+
+import threading
+import time
+
+from loguru import logger
+
+from .message_store import MessageStore
+
+
+class BufferedWriter:
+    """后台线程批量写入 MessageStore
+
+    write() 只把消息放进缓冲区立即返回；后台线程每隔 flush_interval_s
+    （或缓冲超过 max_batch 条时）把所有会话的消息放进同一个事务提交，
+    并发的多个会话共享一次 fsync。需要读到刚写入的数据时先调用 flush()。
+
+    写入失败时批次留在缓冲区，退避后重试；连续失败 max_retries 次后
+    flush() / close() 抛出异常，调用方能知道消息没有落盘。
+    """
+
+    def __init__(
+        self,
+        store: MessageStore,
+        flush_interval_s: float = 0.05,
+        max_batch: int = 512,
+        max_retries: int = 3,
+    ):
+        self.store = store
+        self.flush_interval_s = flush_interval_s
+        self.max_batch = max_batch
+        self.max_retries = max_retries
+        self._buffer: list[tuple[str, dict]] = []
+        self._cond = threading.Condition()
+        # 已提交给 write() 的批次序号 / 已落盘的批次序号
+        self._submitted = 0
+        self._committed = 0
+        self._flush_target = 0
+        self._closed = False
+        # 连续写入失败次数 / 达到 max_retries 后记录的异常（写入成功后清除）
+        self._failures = 0
+        self._error: Exception | None = None
+        # 已完成的写入尝试次数（flush() 至少等到下一次尝试的结果）
+        self._attempts = 0
+        self._thread = threading.Thread(
+            target=self._run, name="message-writer", daemon=True
+        )
+        self._thread.start()
+
+    def write(self, session_id: str, messages: list[dict]):
+        """写入一个会话的一组消息（同一组消息总在同一个事务里）"""
+        if not messages:
+            return
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("BufferedWriter is closed")
+            self._buffer.extend((session_id, m) for m in messages)
+            self._submitted += 1
+            if len(self._buffer) >= self.max_batch:
+                self._cond.notify_all()
+
+    def flush(self):
+        """阻塞直到此前 write() 的消息全部落盘
+
+        Raises:
+            RuntimeError: 连续写入失败，消息仍在缓冲区中没有落盘
+        """
+        with self._cond:
+            target = self._submitted
+            attempts = self._attempts
+            self._flush_target = max(self._flush_target, target)
+            self._cond.notify_all()
+            self._cond.wait_for(
+                lambda: self._committed >= target
+                or (self._error is not None and self._attempts > attempts)
+            )
+            if self._committed < target:
+                raise RuntimeError("消息写入失败，尚未落盘") from self._error
+
+    def close(self):
+        """写完剩余消息并停止后台线程
+
+        Raises:
+            RuntimeError: 剩余消息重试后仍写入失败
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        with self._cond:
+            if self._committed < self._submitted:
+                raise RuntimeError(
+                    f"消息写入失败，{len(self._buffer)} 条未落盘"
+                ) from self._error
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._closed
+                    or len(self._buffer) >= self.max_batch
+                    or self._flush_target > self._committed,
+                    timeout=self.flush_interval_s,
+                )
+                batch, self._buffer = self._buffer, []
+                target = self._submitted
+                closed = self._closed
+
+            if batch:
+                try:
+                    self.store.write_batch(batch)
+                except Exception as e:
+                    if self._retry_later(batch, e, closed):
+                        continue
+                    return
+
+            with self._cond:
+                self._committed = target
+                self._attempts += 1
+                self._failures = 0
+                self._error = None
+                self._cond.notify_all()
+            if closed:
+                return
+
+    def _retry_later(
+        self, batch: list[tuple[str, dict]], error: Exception, closed: bool
+    ) -> bool:
+        """把失败的批次放回缓冲区开头，退避后重试
+
+        Returns:
+            是否继续重试（已关闭且重试次数用完时返回 False，由 close() 抛出异常）
+        """
+        with self._cond:
+            self._buffer = batch + self._buffer
+            self._attempts += 1
+            self._failures += 1
+            failures = self._failures
+            if failures >= self.max_retries:
+                self._error = error
+            self._cond.notify_all()
+        logger.error(f"[消息] 批量写入失败（第 {failures} 次），保留 {len(batch)} 条: {error}")
+        if closed and failures >= self.max_retries:
+            return False
+        time.sleep(min(self.flush_interval_s * 2**failures, 5.0))
+        return True
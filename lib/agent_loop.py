@@ -0,0 +1,418 @@
+"""Agent Loop 引擎 - 各课 MiniManus 共用的核心循环
+
+循环本身只做三件事：调用 LLM、解析 tool_calls、执行工具并把结果写回 messages。
+各课的差异通过 hook 注入：
+
+- compress(messages) -> messages: 进入循环前压缩上下文
+- pre_step(step, messages): 每一步调用 LLM 之前
+- post_llm(step, messages, resp): 拿到 LLM 回复之后（例如用 usage 校准 token 估算）
+- post_tool(outcome, messages) -> dict | None: 工具执行后，可返回自定义的结果消息
+- persist(result): 循环结束后持久化
+
+连接池、重试、缓存、追踪、工具并发等能力都在这里统一接入，各课不再重复实现。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+from loguru import logger
+
+from log import TraceWriter, format_json, log_json
+from openai_compat import (
+    OpenAICompatConfig,
+    achat_completions,
+    chat_completions,
+    stream_chat_completions,
+)
+from tool_executor import arun_tool_calls, run_tool_calls, submit
+
+
+class MaxStepsExceeded(RuntimeError):
+    """超过 max_steps 仍未终止"""
+
+
+@dataclass
+class ToolCall:
+    """解析后的一次工具调用"""
+
+    index: int
+    id: str
+    name: str
+    args: dict[str, Any]
+
+
+@dataclass
+class ToolOutcome:
+    """工具调用及其结果"""
+
+    step: int
+    call: ToolCall
+    should_stop: bool
+    output: str
+
+
+@dataclass
+class AgentResult:
+    """一次 Agent 运行的结果
+
+    Attributes:
+        start: 本次运行新增消息在 messages 中的起始位置
+        stopped_by: 终止循环的工具名；LLM 直接返回内容时为 None
+    """
+
+    output: str
+    messages: list[dict[str, Any]]
+    steps: int
+    start: int = 0
+    stopped_by: str | None = None
+
+    @property
+    def new_messages(self) -> list[dict[str, Any]]:
+        """本次运行过程中追加的消息（工具结果等）"""
+        return self.messages[self.start :]
+
+
+def tool_result_message(outcome: ToolOutcome) -> dict[str, Any]:
+    """默认的工具结果消息
+
+    Moonshot API workaround: 用 user message 代替 tool message，
+    因为 Moonshot API 不完全支持 tool role。
+    """
+    call = outcome.call
+    return {
+        "role": "user",
+        "content": f"[TOOL_CALL {call.name}] {json.dumps(call.args)}\n"
+        f"[TOOL_RESULT] {outcome.output}",
+    }
+
+
+def _never(name: str) -> bool:
+    return False
+
+
+@dataclass
+class AgentLoop:
+    """通用 Agent Loop
+
+    Args:
+        cfg: LLM 配置
+        tools: 工具 schema 列表
+        execute_tool: (name, args) -> (should_stop, output)
+        parallel_safe: name -> 是否可与同一轮的其他调用并发
+        aexecute_tool: execute_tool 的异步版本（arun 使用，默认放到线程中执行）
+        stream: 流式输出（仅 run 支持）
+        dedupe_tool_names: 同一轮同名工具只执行一次（防止 API 返回重复调用）
+        strict_args: 参数不是合法 JSON 时报错；否则按空参数处理
+        verbose: 是否输出每一步的详细日志
+    """
+
+    cfg: OpenAICompatConfig
+    tools: list[dict[str, Any]]
+    execute_tool: Callable[[str, dict[str, Any]], tuple[bool, str]]
+    parallel_safe: Callable[[str], bool] = _never
+    aexecute_tool: (
+        Callable[[str, dict[str, Any]], Awaitable[tuple[bool, str]]] | None
+    ) = None
+    max_steps: int = 10
+    stream: bool = False
+    dedupe_tool_names: bool = False
+    strict_args: bool = True
+    verbose: bool = True
+    trace: TraceWriter = field(default_factory=TraceWriter)
+
+    compress: Callable[[list[dict[str, Any]]], list[dict[str, Any]]] | None = None
+    pre_step: Callable[[int, list[dict[str, Any]]], None] | None = None
+    post_llm: (
+        Callable[[int, list[dict[str, Any]], dict[str, Any]], None] | None
+    ) = None
+    post_tool: (
+        Callable[[ToolOutcome, list[dict[str, Any]]], dict[str, Any] | None] | None
+    ) = None
+    persist: Callable[[AgentResult], None] | None = None
+
+    # ---------- 同步 ----------
+
+    def run(self, messages: list[dict[str, Any]]) -> AgentResult:
+        """运行 Agent Loop，返回最终答案；超过 max_steps 抛出 MaxStepsExceeded"""
+        try:
+            messages = self._start(messages)
+            start = len(messages)
+
+            for step in range(1, self.max_steps + 1):
+                self._log_step(step)
+                if self.pre_step:
+                    self.pre_step(step, messages)
+
+                resp, prefetched = self._call_llm(step, messages)
+                tool_calls, content = self._read_response(step, messages, resp)
+
+                if tool_calls:
+                    calls = self._parse_calls(step, tool_calls)
+
+                    def execute(call: ToolCall) -> tuple[bool, str]:
+                        # 按 tool_call id 对应（流式 index 可能不从 0 开始或不连续）
+                        if call.id in prefetched:
+                            return prefetched[call.id].result()
+                        return self.execute_tool(call.name, call.args)
+
+                    # 无副作用的工具并发执行，结果按原顺序写回 messages
+                    for call, (should_stop, output) in run_tool_calls(
+                        calls, execute, lambda c: self.parallel_safe(c.name)
+                    ):
+                        outcome = ToolOutcome(step, call, should_stop, output)
+                        self._append_outcome(outcome, messages)
+                        if should_stop:
+                            return self._finish(
+                                step, output, messages, start, stopped_by=call.name
+                            )
+
+                    self._log_new_messages(step, messages)
+                    continue
+
+                if content:
+                    return self._finish(step, content, messages, start)
+
+            raise MaxStepsExceeded(
+                f"Agent exceeded max_steps={self.max_steps} without termination."
+            )
+        finally:
+            self.trace.close()
+
+    def _call_llm(
+        self, step: int, messages: list[dict[str, Any]]
+    ) -> tuple[dict[str, Any], dict[str, Future]]:
+        if not self.stream:
+            resp = chat_completions(
+                cfg=self.cfg, messages=messages, tools=self._tools(), tool_choice="auto"
+            )
+            return resp, {}
+        return self._stream_llm(step, messages)
+
+    def _stream_llm(
+        self, step: int, messages: list[dict[str, Any]]
+    ) -> tuple[dict[str, Any], dict[str, Future]]:
+        """流式调用：边接收边输出文本，可并发的工具参数一完整就提前执行
+
+        Returns:
+            (resp, prefetched): resp 与 chat_completions 返回格式相同，
+            prefetched 是按 tool_call id 提前提交的执行结果
+        """
+        resp: dict[str, Any] = {}
+        prefetched: dict[str, Future] = {}
+        seen_tools = set()
+        printed = False
+
+        for event in stream_chat_completions(
+            cfg=self.cfg, messages=messages, tools=self._tools(), tool_choice="auto"
+        ):
+            if event["type"] == "content":
+                print(event["delta"], end="", flush=True)
+                printed = True
+            elif event["type"] == "tool_call":
+                call_id = event["tool_call"].get("id")
+                fn = event["tool_call"]["function"]
+                name = fn["name"]
+                if self.dedupe_tool_names:
+                    if name in seen_tools:
+                        continue
+                    seen_tools.add(name)
+                if not self.parallel_safe(name) or not call_id:
+                    # 有副作用的工具必须按顺序执行；没有 id 的调用无法与主循环
+                    # 解析出的调用对应。两者都留给主循环
+                    continue
+                try:
+                    args = json.loads(fn["arguments"] or "{}")
+                except ValueError:
+                    # 参数非法，交给主循环统一处理
+                    continue
+                logger.info(f"Step {step}: 参数已完整，提前执行工具 {name}")
+                prefetched[call_id] = submit(self.execute_tool, name, args)
+            elif event["type"] == "done":
+                resp = event["response"]
+
+        if printed:
+            print()
+
+        return resp, prefetched
+
+    # ---------- 异步 ----------
+
+    async def arun(self, messages: list[dict[str, Any]]) -> AgentResult:
+        """run 的异步版本：LLM 调用走 achat_completions，工具在线程中执行"""
+        try:
+            messages = self._start(messages)
+            start = len(messages)
+
+            for step in range(1, self.max_steps + 1):
+                self._log_step(step)
+                if self.pre_step:
+                    self.pre_step(step, messages)
+
+                resp = await achat_completions(
+                    cfg=self.cfg,
+                    messages=messages,
+                    tools=self._tools(),
+                    tool_choice="auto",
+                )
+                tool_calls, content = self._read_response(step, messages, resp)
+
+                if tool_calls:
+                    calls = self._parse_calls(step, tool_calls)
+
+                    async for call, (should_stop, output) in arun_tool_calls(
+                        calls, self._aexecute, lambda c: self.parallel_safe(c.name)
+                    ):
+                        outcome = ToolOutcome(step, call, should_stop, output)
+                        self._append_outcome(outcome, messages)
+                        if should_stop:
+                            return self._finish(
+                                step, output, messages, start, stopped_by=call.name
+                            )
+
+                    self._log_new_messages(step, messages)
+                    continue
+
+                if content:
+                    return self._finish(step, content, messages, start)
+
+            raise MaxStepsExceeded(
+                f"Agent exceeded max_steps={self.max_steps} without termination."
+            )
+        finally:
+            self.trace.close()
+
+    async def _aexecute(self, call: ToolCall) -> tuple[bool, str]:
+        if self.aexecute_tool is not None:
+            return await self.aexecute_tool(call.name, call.args)
+        return await asyncio.to_thread(self.execute_tool, call.name, call.args)
+
+    # ---------- 公共步骤 ----------
+
+    def _tools(self) -> list[dict[str, Any]] | None:
+        return self.tools if self.tools else None
+
+    def _start(self, messages: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        if self.compress:
+            messages = self.compress(messages)
+
+        self.trace.messages(0, messages)
+        if self.verbose:
+            logger.info("=" * 60)
+            logger.info("Step 0: 初始上下文 (messages)")
+            logger.info("=" * 60)
+            # 完整历史可能很大：惰性格式化，只有启用 DEBUG 的 sink 才会序列化
+            log_json(messages)
+            names = [t["function"]["name"] for t in self.tools]
+            logger.info(f"可用工具 ({len(names)}): {names}")
+        return messages
+
+    def _log_step(self, step: int) -> None:
+        if self.verbose:
+            logger.info("#" * 60)
+            logger.info(f"# Step {step}")
+            logger.info("#" * 60)
+
+    def _read_response(
+        self, step: int, messages: list[dict[str, Any]], resp: dict[str, Any]
+    ) -> tuple[list[dict[str, Any]], str]:
+        logger.debug(f"Step {step}: LLM 原始回复")
+        log_json(resp)
+        if self.post_llm:
+            self.post_llm(step, messages, resp)
+
+        msg = (resp.get("choices") or [{}])[0].get("message") or {}
+        self.trace.event(step, "response", message=msg, usage=resp.get("usage"))
+        tool_calls = msg.get("tool_calls") or []
+        content = (msg.get("content") or "").strip()
+        return tool_calls, content
+
+    def _parse_calls(
+        self, step: int, tool_calls: list[dict[str, Any]]
+    ) -> list[ToolCall]:
+        """解析 tool_calls（按需去重），并记录调用日志"""
+        seen_tools = set()
+        calls: list[ToolCall] = []
+        for idx, call in enumerate(tool_calls):
+            fn = call.get("function") or {}
+            name = fn.get("name") or ""
+
+            # 去重：跳过同名的重复工具调用
+            if self.dedupe_tool_names:
+                if name in seen_tools:
+                    continue
+                seen_tools.add(name)
+
+            raw_args = fn.get("arguments") or "{}"
+            try:
+                if isinstance(raw_args, str):
+                    args = json.loads(raw_args)
+                else:
+                    args = dict(raw_args)
+            except Exception as e:
+                if self.strict_args:
+                    raise RuntimeError(
+                        f"Invalid tool arguments for {name}: {raw_args}"
+                    ) from e
+                args = {}
+
+            # 确保有 tool_call_id
+            tool_call_id = call.get("id") or f"toolcall_{step}_{idx}"
+            calls.append(ToolCall(idx, tool_call_id, name, args))
+
+            if self.verbose:
+                logger.info(f"Step {step}: 调用工具 {name}")
+                logger.info(format_json({"arguments": args}))
+        return calls
+
+    def _append_outcome(
+        self, outcome: ToolOutcome, messages: list[dict[str, Any]]
+    ) -> None:
+        if self.verbose:
+            output = outcome.output
+            logger.info(f"Step {outcome.step}: 工具返回 ({outcome.call.name})")
+            logger.info(output[:500] + "..." if len(output) > 500 else output)
+
+        message = self.post_tool(outcome, messages) if self.post_tool else None
+        messages.append(message or tool_result_message(outcome))
+
+    def _log_new_messages(self, step: int, messages: list[dict[str, Any]]) -> None:
+        new_messages = self.trace.messages(step, messages)
+        if self.verbose:
+            logger.info(f"Step {step}: 新增 {len(new_messages)} 条 messages")
+            log_json(new_messages)
+
+    def _finish(
+        self,
+        step: int,
+        output: str,
+        messages: list[dict[str, Any]],
+        start: int,
+        stopped_by: str | None = None,
+    ) -> AgentResult:
+        self.trace.messages(step, messages)
+        self.trace.event(step, "final", content=output)
+
+        if self.verbose:
+            logger.info("*" * 60)
+            if stopped_by is None:
+                logger.info("* LLM 直接返回内容 (未调用工具)")
+            else:
+                logger.info("* 最终答案 (Agent Loop 终止)")
+            logger.info("*" * 60)
+            logger.info(output)
+
+        result = AgentResult(
+            output=output,
+            messages=messages,
+            steps=step,
+            start=start,
+            stopped_by=stopped_by,
+        )
+        if self.persist:
+            self.persist(result)
+        return result
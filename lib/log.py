@@ -2,9 +2,14 @@
 
 from __future__ import annotations
 
+import json
+import os
 import sys
+import threading
+import time
+from datetime import datetime
 from pathlib import Path
-from typing import Any
+from typing import Any, Iterator
 
 from loguru import logger
 
@@ -33,8 +38,6 @@ def init_logger(log_dir: Path | str | None = None, level: str = "INFO") -> None:
         log_dir.mkdir(parents=True, exist_ok=True)
 
         # 日志文件名使用时间戳，避免覆盖
-        from datetime import datetime
-
         log_file = log_dir / f"agent_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
 
         logger.add(
@@ -49,6 +52,87 @@ def init_logger(log_dir: Path | str | None = None, level: str = "INFO") -> None:
 
 def format_json(data: Any) -> str:
     """格式化 JSON 数据用于日志输出"""
-    import json
-
     return json.dumps(data, ensure_ascii=False, indent=2)
+
+
+def log_json(data: Any, level: str = "DEBUG") -> None:
+    """惰性输出 JSON：只有某个 sink 启用了该级别时才会真正格式化"""
+    logger.opt(lazy=True).log(level, "{}", lambda: format_json(data))
+
+
+class TraceWriter:
+    """步骤追踪：以 JSON Lines 追加写入，每步只记录增量
+
+    每行一个事件：
+    - {"type": "message", "step", "message"}: 新加入 messages 的消息
+    - {"type": "response", "step", "message", "usage"}: LLM 回复
+    - 以及调用方自定义的事件（tool_call / tool_result / system_update ...）
+
+    path 为 None 时不落盘，只做增量计算。用 rebuild_messages() 可离线还原完整对话。
+    文件以 "x" 模式创建：同名文件已存在时报错，两次运行不会写进同一个文件。
+    """
+
+    def __init__(self, path: Path | str | None = None):
+        self.path = Path(path) if path else None
+        self._file = None
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # 行缓冲：每个事件写完即落盘，进程中途退出也不丢
+            self._file = open(self.path, "x", encoding="utf-8", buffering=1)
+        self._seen = 0
+
+    def event(self, step: int, type: str, **data: Any) -> None:
+        """写入一个事件"""
+        if self._file is None:
+            return
+        record = {"ts": time.time(), "step": step, "type": type, **data}
+        self._file.write(
+            json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        )
+
+    def messages(
+        self, step: int, messages: list[dict[str, Any]]
+    ) -> list[dict[str, Any]]:
+        """记录自上次调用以来新增的消息，并返回这些消息"""
+        new_messages = messages[self._seen :]
+        for message in new_messages:
+            self.event(step, "message", message=message)
+        self._seen = len(messages)
+        return new_messages
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def open_trace(log_dir: Path | str | None) -> TraceWriter:
+    """在日志目录下创建本次运行的追踪文件（log_dir 为 None 时不落盘）
+
+    文件名带微秒、进程号和线程号：同一秒内连续运行的任务、并发的 worker 各写各的文件。
+    """
+    if not log_dir:
+        return TraceWriter(None)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    name = f"trace_{timestamp}_{os.getpid()}_{threading.get_ident()}.jsonl"
+    return TraceWriter(Path(log_dir) / name)
+
+
+def read_trace(path: Path | str) -> Iterator[dict[str, Any]]:
+    """逐行读取追踪事件"""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def rebuild_messages(path: Path | str) -> list[dict[str, Any]]:
+    """从追踪文件还原 Agent 最终看到的完整 messages"""
+    messages: list[dict[str, Any]] = []
+    for record in read_trace(path):
+        if record["type"] == "message":
+            messages.append(record["message"])
+        elif record["type"] == "system_update" and messages:
+            messages[0] = {**messages[0], "content": record["content"]}
+    return messages
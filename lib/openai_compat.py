@@ -1,11 +1,25 @@
 from __future__ import annotations
 
+import asyncio
+import atexit
+import importlib.util
+import json
 import os
+import random
+import re
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager, contextmanager
 from dataclasses import dataclass
-from typing import Any
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator
 
+import httpx
 from loguru import logger
-from openai import OpenAI
+from openai import APIConnectionError, APIStatusError, AsyncOpenAI, OpenAI
+
+from llm_cache import ResponseCache, make_cache_key
 
 
 @dataclass(frozen=True)
@@ -14,18 +28,500 @@ class OpenAICompatConfig:
     base_url: str
     model: str
     timeout_s: float = 60.0
+    # 连接池参数：同一 (base_url, api_key, timeout) 共享一个长连接池
+    max_connections: int = 20
+    max_keepalive_connections: int = 10
+    keepalive_expiry_s: float = 30.0
+    http2: bool = True
+    # 进程级限流：同一服务的所有会话共享（0 表示不限速）
+    max_concurrency: int = 8
+    requests_per_minute: float = 0.0
+    # 429 / 5xx / 网络错误的最大重试次数（由 RequestScheduler 负责）
+    max_retries: int = 6
+    # 可选的响应缓存（cache_path 为空表示关闭）
+    cache_path: str = ""
+    cache_ttl_s: float = 7 * 86400
+    cache_max_entries: int = 10000
 
 
-def chat_completions(
-    *,
+# 客户端注册表：避免每次调用都重新握手 TLS、建立连接
+_clients: dict[tuple, OpenAI] = {}
+_clients_lock = threading.Lock()
+
+
+def _pool_key(cfg: OpenAICompatConfig) -> tuple:
+    """连接池的 key（不含 model，同一服务的不同模型共享连接）"""
+    return (
+        cfg.base_url,
+        cfg.api_key,
+        cfg.timeout_s,
+        cfg.max_connections,
+        cfg.max_keepalive_connections,
+        cfg.keepalive_expiry_s,
+        cfg.http2,
+    )
+
+
+def _http2_available() -> bool:
+    """HTTP/2 需要可选依赖 h2（pip install 'httpx[http2]'）"""
+    return importlib.util.find_spec("h2") is not None
+
+
+def _httpx_kwargs(cfg: OpenAICompatConfig) -> dict[str, Any]:
+    """构造 httpx 客户端参数（同步 / 异步共用）"""
+    return {
+        "timeout": cfg.timeout_s,
+        "limits": httpx.Limits(
+            max_connections=cfg.max_connections,
+            max_keepalive_connections=cfg.max_keepalive_connections,
+            keepalive_expiry=cfg.keepalive_expiry_s,
+        ),
+        "http2": cfg.http2 and _http2_available(),
+        "follow_redirects": True,
+    }
+
+
+def get_client(cfg: OpenAICompatConfig) -> OpenAI:
+    """获取（或创建）与配置对应的长生命周期客户端"""
+    key = _pool_key(cfg)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = OpenAI(
+                api_key=cfg.api_key,
+                base_url=cfg.base_url,
+                timeout=cfg.timeout_s,
+                max_retries=0,
+                http_client=httpx.Client(**_httpx_kwargs(cfg)),
+            )
+            _clients[key] = client
+            logger.debug(f"[LLM] 新建连接池: {cfg.base_url}")
+        return client
+
+
+def close_clients() -> None:
+    """关闭所有连接池（进程退出时自动调用，也可手动调用）"""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        try:
+            client.close()
+        except Exception as e:
+            logger.warning(f"[LLM] 关闭连接池失败: {e}")
+
+
+atexit.register(close_clients)
+
+
+# 异步客户端绑定在创建它的事件循环上，所以按事件循环分别缓存
+_async_clients: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, dict[tuple, AsyncOpenAI]
+] = weakref.WeakKeyDictionary()
+
+
+def get_async_client(cfg: OpenAICompatConfig) -> AsyncOpenAI:
+    """获取当前事件循环中与配置对应的异步客户端"""
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.setdefault(loop, {})
+    key = _pool_key(cfg)
+    client = clients.get(key)
+    if client is None:
+        client = AsyncOpenAI(
+            api_key=cfg.api_key,
+            base_url=cfg.base_url,
+            timeout=cfg.timeout_s,
+            max_retries=0,
+            http_client=httpx.AsyncClient(**_httpx_kwargs(cfg)),
+        )
+        clients[key] = client
+        logger.debug(f"[LLM] 新建异步连接池: {cfg.base_url}")
+    return client
+
+
+async def aclose_clients() -> None:
+    """关闭当前事件循环中的异步连接池（在 asyncio.run 结束前调用）"""
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.pop(loop, {})
+    for client in clients.values():
+        try:
+            await client.close()
+        except Exception as e:
+            logger.warning(f"[LLM] 关闭异步连接池失败: {e}")
+
+
+class RequestLimiter:
+    """请求限流器：并发上限 + 令牌桶
+
+    同步调用（多线程）和异步调用（协程）共用同一个令牌桶，
+    保证整个进程对同一服务的请求速率不超过 requests_per_minute。
+    """
+
+    def __init__(self, max_concurrency: int, requests_per_minute: float = 0.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self._rate = requests_per_minute / 60.0
+        self._capacity = float(self.max_concurrency)
+        self._tokens = self._capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        self._sem = threading.BoundedSemaphore(self.max_concurrency)
+        self._async_sems: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, asyncio.Semaphore
+        ] = weakref.WeakKeyDictionary()
+
+    def _reserve(self) -> float:
+        """预占一个令牌，返回需要等待的秒数"""
+        if self._rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self._capacity, self._tokens + (now - self._last) * self._rate
+            )
+            self._last = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self._rate
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """同步获取一个请求名额"""
+        with self._sem:
+            wait = self._reserve()
+            if wait > 0:
+                time.sleep(wait)
+            yield
+
+    @asynccontextmanager
+    async def aslot(self) -> AsyncIterator[None]:
+        """异步获取一个请求名额"""
+        loop = asyncio.get_running_loop()
+        sem = self._async_sems.get(loop)
+        if sem is None:
+            sem = self._async_sems[loop] = asyncio.Semaphore(self.max_concurrency)
+        async with sem:
+            wait = self._reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            yield
+
+
+_limiters: dict[tuple, RequestLimiter] = {}
+
+
+def get_limiter(cfg: OpenAICompatConfig) -> RequestLimiter:
+    """获取同一服务（base_url + api_key）共享的限流器"""
+    key = (cfg.base_url, cfg.api_key)
+    limiter = _limiters.get(key)
+    if limiter is None:
+        with _clients_lock:
+            limiter = _limiters.get(key)
+            if limiter is None:
+                limiter = RequestLimiter(cfg.max_concurrency, cfg.requests_per_minute)
+                _limiters[key] = limiter
+    return limiter
+
+
+@dataclass
+class _ModelBudget:
+    """单个模型的剩余额度（来自 x-ratelimit-* 响应头）"""
+
+    remaining_requests: int | None = None
+    remaining_tokens: int | None = None
+    requests_reset_at: float = 0.0
+    tokens_reset_at: float = 0.0
+    # 收到 429 后，所有请求都要等到这个时间点
+    blocked_until: float = 0.0
+
+    def wait_s(self, now: float) -> float:
+        waits = [self.blocked_until - now]
+        if self.remaining_requests is not None and self.remaining_requests <= 0:
+            waits.append(self.requests_reset_at - now)
+        if self.remaining_tokens is not None and self.remaining_tokens <= 0:
+            waits.append(self.tokens_reset_at - now)
+        return max(0.0, *waits)
+
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def _parse_duration(value: str | None) -> float | None:
+    """解析 "1s" / "6m0s" / "20ms" / "0.5" 这类重置时间"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(n) * _DURATION_UNITS[unit] for n, unit in parts)
+
+
+def _parse_retry_after(headers: httpx.Headers | None) -> float | None:
+    """解析 Retry-After（秒数或 HTTP 日期）以及 retry-after-ms"""
+    if headers is None:
+        return None
+    retry_ms = headers.get("retry-after-ms")
+    if retry_ms:
+        try:
+            return float(retry_ms) / 1000.0
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_int(value: str | None) -> int | None:
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class RequestScheduler:
+    """请求调度器：额度感知 + 指数退避重试
+
+    - 发请求前按模型检查剩余额度，额度用完就排队等到重置，而不是直接报错
+    - 429 / 5xx / 网络错误按 Retry-After 或带抖动的指数退避重试
+    - 每次成功响应后用 x-ratelimit-* 响应头刷新额度
+    """
+
+    RETRYABLE_STATUS = {408, 409, 429}
+
+    def __init__(
+        self, max_retries: int = 6, base_delay_s: float = 1.0, max_delay_s: float = 60.0
+    ):
+        self.max_retries = max_retries
+        self.base_delay_s = base_delay_s
+        self.max_delay_s = max_delay_s
+        self._budgets: dict[str, _ModelBudget] = {}
+        self._lock = threading.Lock()
+
+    def _budget(self, model: str) -> _ModelBudget:
+        budget = self._budgets.get(model)
+        if budget is None:
+            budget = self._budgets.setdefault(model, _ModelBudget())
+        return budget
+
+    def _reserve(self, model: str) -> float:
+        """返回发请求前需要等待的秒数；无需等待时预扣一次请求额度"""
+        with self._lock:
+            budget = self._budget(model)
+            now = time.monotonic()
+            wait = budget.wait_s(now)
+            if wait > 0:
+                return wait
+            # 额度已过重置时间，等待响应头给出新值
+            if budget.requests_reset_at and now >= budget.requests_reset_at:
+                budget.remaining_requests = None
+            if budget.tokens_reset_at and now >= budget.tokens_reset_at:
+                budget.remaining_tokens = None
+            if budget.remaining_requests is not None:
+                budget.remaining_requests -= 1
+            return 0.0
+
+    def update(self, model: str, headers: httpx.Headers | None) -> None:
+        """根据响应头刷新模型额度"""
+        if headers is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            budget = self._budget(model)
+            remaining_requests = _parse_int(
+                headers.get("x-ratelimit-remaining-requests")
+            )
+            if remaining_requests is not None:
+                budget.remaining_requests = remaining_requests
+                reset = _parse_duration(headers.get("x-ratelimit-reset-requests"))
+                budget.requests_reset_at = now + (reset or 0.0)
+            remaining_tokens = _parse_int(headers.get("x-ratelimit-remaining-tokens"))
+            if remaining_tokens is not None:
+                budget.remaining_tokens = remaining_tokens
+                reset = _parse_duration(headers.get("x-ratelimit-reset-tokens"))
+                budget.tokens_reset_at = now + (reset or 0.0)
+
+    def _retry_delay(self, model: str, error: Exception, attempt: int) -> float | None:
+        """计算重试等待时间；不可重试或超过次数时返回 None"""
+        if attempt >= self.max_retries:
+            return None
+
+        headers = None
+        if isinstance(error, APIStatusError):
+            status = error.status_code
+            if status not in self.RETRYABLE_STATUS and status < 500:
+                return None
+            headers = error.response.headers
+        elif not isinstance(error, APIConnectionError):
+            return None
+
+        backoff = min(self.max_delay_s, self.base_delay_s * (2**attempt))
+        delay = random.uniform(0, backoff)  # full jitter
+        retry_after = _parse_retry_after(headers)
+        if retry_after is not None:
+            delay = retry_after + random.uniform(0, self.base_delay_s)
+
+        if isinstance(error, APIStatusError) and error.status_code == 429:
+            # 429 说明额度已耗尽：让同一模型的其他请求也一起排队
+            with self._lock:
+                budget = self._budget(model)
+                budget.blocked_until = max(
+                    budget.blocked_until, time.monotonic() + delay
+                )
+        return delay
+
+    def call(
+        self,
+        model: str,
+        fn: Callable[[], Any],
+        limiter: RequestLimiter | None = None,
+    ) -> Any:
+        """同步执行请求：fn 返回 raw response（with_raw_response），本方法返回解析结果"""
+        attempt = 0
+        while True:
+            wait = self._reserve(model)
+            if wait > 0:
+                logger.info(f"[LLM] {model} 额度用尽，排队等待 {wait:.1f}s")
+                time.sleep(wait)
+                continue
+            try:
+                if limiter is None:
+                    raw = fn()
+                else:
+                    with limiter.slot():
+                        raw = fn()
+            except Exception as e:
+                delay = self._retry_delay(model, e, attempt)
+                if delay is None:
+                    logger.error(f"OpenAI API error: {e}")
+                    raise
+                attempt += 1
+                logger.warning(
+                    f"[LLM] 请求失败，{delay:.1f}s 后第 {attempt} 次重试: {e}"
+                )
+                time.sleep(delay)
+                continue
+            self.update(model, raw.headers)
+            return raw.parse()
+
+    async def acall(
+        self,
+        model: str,
+        fn: Callable[[], Awaitable[Any]],
+        limiter: RequestLimiter | None = None,
+    ) -> Any:
+        """call 的异步版本"""
+        attempt = 0
+        while True:
+            wait = self._reserve(model)
+            if wait > 0:
+                logger.info(f"[LLM] {model} 额度用尽，排队等待 {wait:.1f}s")
+                await asyncio.sleep(wait)
+                continue
+            try:
+                if limiter is None:
+                    raw = await fn()
+                else:
+                    async with limiter.aslot():
+                        raw = await fn()
+            except Exception as e:
+                delay = self._retry_delay(model, e, attempt)
+                if delay is None:
+                    logger.error(f"OpenAI API error: {e}")
+                    raise
+                attempt += 1
+                logger.warning(
+                    f"[LLM] 请求失败，{delay:.1f}s 后第 {attempt} 次重试: {e}"
+                )
+                await asyncio.sleep(delay)
+                continue
+            self.update(model, raw.headers)
+            return raw.parse()
+
+
+_schedulers: dict[tuple, RequestScheduler] = {}
+
+
+def get_scheduler(cfg: OpenAICompatConfig) -> RequestScheduler:
+    """获取同一服务（base_url + api_key）共享的调度器"""
+    key = (cfg.base_url, cfg.api_key)
+    scheduler = _schedulers.get(key)
+    if scheduler is None:
+        with _clients_lock:
+            scheduler = _schedulers.get(key)
+            if scheduler is None:
+                scheduler = RequestScheduler(max_retries=cfg.max_retries)
+                _schedulers[key] = scheduler
+    return scheduler
+
+
+_caches: dict[str, ResponseCache] = {}
+
+
+def get_cache(cfg: OpenAICompatConfig) -> ResponseCache | None:
+    """获取配置对应的响应缓存；未配置 cache_path 时返回 None"""
+    if not cfg.cache_path:
+        return None
+    cache = _caches.get(cfg.cache_path)
+    if cache is None:
+        with _clients_lock:
+            cache = _caches.get(cfg.cache_path)
+            if cache is None:
+                cache = ResponseCache(
+                    cfg.cache_path,
+                    ttl_s=cfg.cache_ttl_s,
+                    max_entries=cfg.cache_max_entries,
+                )
+                _caches[cfg.cache_path] = cache
+    return cache
+
+
+def cache_stats() -> dict[str, dict[str, int]]:
+    """所有响应缓存的命中统计"""
+    return {path: cache.stats() for path, cache in _caches.items()}
+
+
+def _cache_key(
     cfg: OpenAICompatConfig,
     messages: list[dict[str, Any]],
-    tools: list[dict[str, Any]] | None = None,
-    tool_choice: str | dict[str, Any] = "auto",
-    temperature: float = 1.0,
-) -> dict[str, Any]:
-    client = OpenAI(api_key=cfg.api_key, base_url=cfg.base_url, timeout=cfg.timeout_s)
+    tools: list[dict[str, Any]] | None,
+    tool_choice: str | dict[str, Any],
+    temperature: float,
+) -> str:
+    return make_cache_key(
+        base_url=cfg.base_url,
+        model=cfg.model,
+        messages=messages,
+        tools=tools,
+        tool_choice=tool_choice,
+        temperature=temperature,
+    )
 
+
+def _build_kwargs(
+    cfg: OpenAICompatConfig,
+    messages: list[dict[str, Any]],
+    tools: list[dict[str, Any]] | None,
+    tool_choice: str | dict[str, Any],
+    temperature: float,
+) -> dict[str, Any]:
     kwargs: dict[str, Any] = {
         "model": cfg.model,
         "messages": messages,
@@ -34,13 +530,216 @@ def chat_completions(
     if tools is not None:
         kwargs["tools"] = tools
         kwargs["tool_choice"] = tool_choice
+    return kwargs
 
-    try:
-        resp = client.chat.completions.create(**kwargs)
-        return resp.model_dump(mode="json")
-    except Exception as e:
-        logger.error(f"OpenAI API error: {e}")
-        raise
+
+def chat_completions(
+    *,
+    cfg: OpenAICompatConfig,
+    messages: list[dict[str, Any]],
+    tools: list[dict[str, Any]] | None = None,
+    tool_choice: str | dict[str, Any] = "auto",
+    temperature: float = 1.0,
+    cache: bool = False,
+) -> dict[str, Any]:
+    """调用 Chat Completions
+
+    cache=True 表示这个请求是可重复的（路由、分解、摘要等），
+    在配置了 OPENAI_CACHE_PATH 时相同请求直接返回缓存结果。
+    """
+    response_cache = get_cache(cfg) if cache else None
+    key = ""
+    if response_cache is not None:
+        key = _cache_key(cfg, messages, tools, tool_choice, temperature)
+        cached = response_cache.get(key)
+        if cached is not None:
+            logger.debug(f"[LLM] 缓存命中: {key[:12]}")
+            return cached
+
+    client = get_client(cfg)
+    kwargs = _build_kwargs(cfg, messages, tools, tool_choice, temperature)
+
+    resp = get_scheduler(cfg).call(
+        cfg.model,
+        lambda: client.chat.completions.with_raw_response.create(**kwargs),
+        limiter=get_limiter(cfg),
+    )
+    result = resp.model_dump(mode="json")
+    if response_cache is not None:
+        response_cache.put(key, result)
+    return result
+
+
+async def achat_completions(
+    *,
+    cfg: OpenAICompatConfig,
+    messages: list[dict[str, Any]],
+    tools: list[dict[str, Any]] | None = None,
+    tool_choice: str | dict[str, Any] = "auto",
+    temperature: float = 1.0,
+    cache: bool = False,
+) -> dict[str, Any]:
+    """chat_completions 的异步版本，返回值格式相同"""
+    response_cache = get_cache(cfg) if cache else None
+    key = ""
+    if response_cache is not None:
+        key = _cache_key(cfg, messages, tools, tool_choice, temperature)
+        cached = response_cache.get(key)
+        if cached is not None:
+            logger.debug(f"[LLM] 缓存命中: {key[:12]}")
+            return cached
+
+    client = get_async_client(cfg)
+    kwargs = _build_kwargs(cfg, messages, tools, tool_choice, temperature)
+
+    resp = await get_scheduler(cfg).acall(
+        cfg.model,
+        lambda: client.chat.completions.with_raw_response.create(**kwargs),
+        limiter=get_limiter(cfg),
+    )
+    result = resp.model_dump(mode="json")
+    if response_cache is not None:
+        response_cache.put(key, result)
+    return result
+
+
+class ToolCallAssembler:
+    """把流式返回的 tool_calls 片段拼装成完整调用
+
+    每个 tool_call 按 index 累积 id / name / arguments；
+    arguments 拼成完整 JSON 对象（或下一个 index 开始）时即视为完成，
+    调用方可以立即开始执行，而不必等整个回复结束。
+    """
+
+    def __init__(self) -> None:
+        self._calls: dict[int, dict[str, Any]] = {}
+        self._done: set[int] = set()
+
+    def feed(self, deltas: list[dict[str, Any]]) -> list[tuple[int, dict[str, Any]]]:
+        """输入一批 delta.tool_calls，返回本次新完成的 (index, tool_call)"""
+        finished: list[tuple[int, dict[str, Any]]] = []
+        for delta in deltas:
+            index = delta.get("index") or 0
+            # 新 index 出现说明之前的调用都已输出完毕
+            for prev in sorted(self._calls):
+                if prev < index:
+                    finished.extend(self._finish(prev))
+
+            call = self._calls.setdefault(
+                index,
+                {"id": "", "type": "function", "function": {"name": "", "arguments": ""}},
+            )
+            if delta.get("id"):
+                call["id"] = delta["id"]
+            fn = delta.get("function") or {}
+            if fn.get("name"):
+                call["function"]["name"] += fn["name"]
+            if fn.get("arguments"):
+                call["function"]["arguments"] += fn["arguments"]
+
+            if self._args_complete(call):
+                finished.extend(self._finish(index))
+        return finished
+
+    def flush(self) -> list[tuple[int, dict[str, Any]]]:
+        """流结束：剩余调用全部视为完成"""
+        finished: list[tuple[int, dict[str, Any]]] = []
+        for index in sorted(self._calls):
+            finished.extend(self._finish(index))
+        return finished
+
+    def tool_calls(self) -> list[dict[str, Any]]:
+        """按 index 顺序返回全部调用"""
+        return [self._calls[i] for i in sorted(self._calls)]
+
+    def _finish(self, index: int) -> list[tuple[int, dict[str, Any]]]:
+        if index in self._done:
+            return []
+        self._done.add(index)
+        return [(index, self._calls[index])]
+
+    @staticmethod
+    def _args_complete(call: dict[str, Any]) -> bool:
+        args = call["function"]["arguments"].rstrip()
+        # 先做廉价检查，只有可能完整时才尝试解析
+        if not call["function"]["name"] or not args.endswith("}"):
+            return False
+        try:
+            return isinstance(json.loads(args), dict)
+        except ValueError:
+            return False
+
+
+def stream_chat_completions(
+    *,
+    cfg: OpenAICompatConfig,
+    messages: list[dict[str, Any]],
+    tools: list[dict[str, Any]] | None = None,
+    tool_choice: str | dict[str, Any] = "auto",
+    temperature: float = 1.0,
+) -> Iterator[dict[str, Any]]:
+    """流式版本的 chat_completions
+
+    依次产出事件：
+    - {"type": "content", "delta": str}: 文本增量
+    - {"type": "tool_call", "index": int, "tool_call": dict}: 某个工具调用参数已完整
+    - {"type": "done", "response": dict}: 结束，response 与 chat_completions 返回格式相同
+    """
+    client = get_client(cfg)
+    kwargs = _build_kwargs(cfg, messages, tools, tool_choice, temperature)
+    kwargs["stream"] = True
+
+    assembler = ToolCallAssembler()
+    content_parts: list[str] = []
+    finish_reason = None
+    usage = None
+
+    # 流式请求只在建立连接阶段重试；一旦开始输出，中途出错直接抛出
+    with get_limiter(cfg).slot():
+        stream = get_scheduler(cfg).call(
+            cfg.model,
+            lambda: client.chat.completions.with_raw_response.create(**kwargs),
+        )
+        try:
+            for chunk in stream:
+                data = chunk.model_dump(mode="json")
+                usage = data.get("usage") or usage
+                for choice in data.get("choices") or []:
+                    delta = choice.get("delta") or {}
+                    if delta.get("content"):
+                        content_parts.append(delta["content"])
+                        yield {"type": "content", "delta": delta["content"]}
+                    for index, call in assembler.feed(delta.get("tool_calls") or []):
+                        yield {"type": "tool_call", "index": index, "tool_call": call}
+                    finish_reason = choice.get("finish_reason") or finish_reason
+        except Exception as e:
+            logger.error(f"OpenAI API error: {e}")
+            raise
+
+    for index, call in assembler.flush():
+        yield {"type": "tool_call", "index": index, "tool_call": call}
+
+    message: dict[str, Any] = {"role": "assistant", "content": "".join(content_parts)}
+    tool_calls = assembler.tool_calls()
+    if tool_calls:
+        message["tool_calls"] = tool_calls
+
+    yield {
+        "type": "done",
+        "response": {
+            "choices": [
+                {"index": 0, "message": message, "finish_reason": finish_reason}
+            ],
+            "usage": usage,
+        },
+    }
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
 
 
 def load_config_from_env() -> OpenAICompatConfig:
@@ -48,6 +747,16 @@ def load_config_from_env() -> OpenAICompatConfig:
     base_url = os.environ.get("OPENAI_BASE_URL") or os.environ.get("OPENAI_BASE") or ""
     model = os.environ.get("OPENAI_MODEL") or ""
     timeout_s = float(os.environ.get("OPENAI_TIMEOUT_S") or "60")
+    max_connections = int(os.environ.get("OPENAI_MAX_CONNECTIONS") or "20")
+    max_keepalive = int(os.environ.get("OPENAI_MAX_KEEPALIVE") or "10")
+    keepalive_expiry_s = float(os.environ.get("OPENAI_KEEPALIVE_S") or "30")
+    http2 = _env_flag("OPENAI_HTTP2", True)
+    max_concurrency = int(os.environ.get("OPENAI_MAX_CONCURRENCY") or "8")
+    requests_per_minute = float(os.environ.get("OPENAI_RPM") or "0")
+    max_retries = int(os.environ.get("OPENAI_MAX_RETRIES") or "6")
+    cache_path = os.environ.get("OPENAI_CACHE_PATH") or ""
+    cache_ttl_s = float(os.environ.get("OPENAI_CACHE_TTL_S") or str(7 * 86400))
+    cache_max_entries = int(os.environ.get("OPENAI_CACHE_MAX_ENTRIES") or "10000")
 
     missing = [
         k
@@ -64,5 +773,18 @@ def load_config_from_env() -> OpenAICompatConfig:
         )
 
     return OpenAICompatConfig(
-        api_key=api_key, base_url=base_url, model=model, timeout_s=timeout_s
+        api_key=api_key,
+        base_url=base_url,
+        model=model,
+        timeout_s=timeout_s,
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive,
+        keepalive_expiry_s=keepalive_expiry_s,
+        http2=http2,
+        max_concurrency=max_concurrency,
+        requests_per_minute=requests_per_minute,
+        max_retries=max_retries,
+        cache_path=cache_path,
+        cache_ttl_s=cache_ttl_s,
+        cache_max_entries=cache_max_entries,
     )
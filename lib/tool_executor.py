@@ -0,0 +1,94 @@
+"""工具执行器 - 同一轮回复中的多个工具调用并发执行"""
+
+from __future__ import annotations
+
+import asyncio
+import atexit
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import AsyncIterator, Awaitable, Callable, Iterator, Sequence, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+_pool: ThreadPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    """进程共享的工具线程池（TOOL_MAX_WORKERS，默认 8）"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                max_workers = int(os.environ.get("TOOL_MAX_WORKERS") or "8")
+                _pool = ThreadPoolExecutor(
+                    max_workers=max_workers, thread_name_prefix="tool"
+                )
+    return _pool
+
+
+def _shutdown_pool() -> None:
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+
+
+atexit.register(_shutdown_pool)
+
+
+def submit(fn: Callable[..., R], *args) -> Future:
+    """把单个工具调用提交到共享线程池（例如流式输出时提前执行）"""
+    return _get_pool().submit(fn, *args)
+
+
+def _batches(
+    calls: Sequence[T], parallel_safe: Callable[[T], bool]
+) -> Iterator[list[T]]:
+    """切分批次：连续的可并发调用组成一批，其余调用各自单独一批（作为屏障）"""
+    batch: list[T] = []
+    for call in calls:
+        if parallel_safe(call):
+            batch.append(call)
+            continue
+        if batch:
+            yield batch
+            batch = []
+        yield [call]
+    if batch:
+        yield batch
+
+
+def run_tool_calls(
+    calls: Sequence[T],
+    execute: Callable[[T], R],
+    parallel_safe: Callable[[T], bool],
+) -> Iterator[tuple[T, R]]:
+    """按原顺序产出 (call, result)
+
+    - 连续的 parallel_safe 调用提交到线程池并发执行，耗时取最大值而不是求和
+    - 其他调用（有副作用 / terminate 等）串行执行，且必须等前面的调用全部完成
+    - 调用方拿到终止结果后停止迭代即可，后面的非并发调用不会再执行
+    """
+    for batch in _batches(calls, parallel_safe):
+        if len(batch) == 1:
+            yield batch[0], execute(batch[0])
+            continue
+        futures = [_get_pool().submit(execute, call) for call in batch]
+        for call, future in zip(batch, futures):
+            yield call, future.result()
+
+
+async def arun_tool_calls(
+    calls: Sequence[T],
+    execute: Callable[[T], Awaitable[R]],
+    parallel_safe: Callable[[T], bool],
+) -> AsyncIterator[tuple[T, R]]:
+    """run_tool_calls 的异步版本：execute 是协程函数，同一批用 gather 并发
+
+    同步工具可以用 asyncio.to_thread 包一层，避免阻塞事件循环。
+    """
+    for batch in _batches(calls, parallel_safe):
+        results = await asyncio.gather(*(execute(call) for call in batch))
+        for call, result in zip(batch, results):
+            yield call, result